@@ -0,0 +1,251 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from file_transfer import TRANSFER_WORKERS, move_file, plan
+
+# Bulk moves and deletes for the dataset cleanup scripts, done in three steps:
+#
+#   plan     every operation is decided up front from the listing, so a dry
+#            run just prints the plan and nothing is touched half way through
+#            a scan
+#   run      the plan goes to a JSONL journal first, then runs on a thread
+#            pool (renames over NFS are mostly waiting on the server); each
+#            finished operation is appended to the journal as it completes
+#   undo     finished operations are reversed from the journal
+#
+# Deletes remove the file and a move replaces whatever was at its
+# destination, so neither can be undone. With --trash, deleted and overwritten
+# files are moved into a <journal>.trash folder next to the journal instead,
+# outside the dataset so nothing walking it picks them up again, and undo puts
+# them back. The trash takes as much space as the files in it (and is a copy
+# when the journal is on another drive); remove it once the result looks right.
+#
+# A run that was interrupted continues with --resume: operations without a
+# finished line are run again, and one whose source is already gone but whose
+# destination exists is taken as finished before the interruption.
+
+TRASH_SUFFIX = '.trash'
+
+
+def default_journal_folder():
+    return os.path.join(os.path.expanduser('~'), '.cache', 'ai-utils', 'bulk_ops')
+
+
+def add_bulk_args(parser, workers=True):
+    # Scripts that already take file_transfer's options leave out workers.
+    parser.add_argument('--journal', default=None, help='Where to write the journal of this run. Default is a new file in ~/.cache/ai-utils/bulk_ops.')
+    parser.add_argument('--resume', metavar='JOURNAL', default=None, help='Finish an interrupted run from its journal, then exit.')
+    parser.add_argument('--undo', metavar='JOURNAL', default=None, help='Reverse a run from its journal, then exit. Deleted and overwritten files only come back if the run used --trash.')
+    parser.add_argument('--trash', action='store_true', help='Move deleted and overwritten files into a trash folder next to the journal instead of removing them, so --undo can bring them back. Remove the folder once the result looks right.')
+    if workers:
+        parser.add_argument('--transfer-workers', type=int, default=TRANSFER_WORKERS, help=f'Files moved or deleted in parallel. Default is {TRANSFER_WORKERS}.')
+
+
+def journal_command(args):
+    # Runs --resume or --undo if given; True when the script should stop there.
+    if args.resume:
+        report(resume(args.resume, args.transfer_workers))
+        return True
+    if args.undo:
+        report(undo(args.undo, args.transfer_workers), restored=True)
+        return True
+    return False
+
+
+def new_run_id():
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+
+
+def trash_folder(journal_path):
+    return os.path.splitext(journal_path)[0] + TRASH_SUFFIX
+
+
+def trash_path(trash, entry):
+    # Each operation gets its own folder, so files with the same name from
+    # different folders don't collide.
+    return os.path.join(trash, str(entry['id']), os.path.basename(entry['src'] if entry['op'] == 'delete' else entry['dest']))
+
+
+def plan_ops(ops, on_collision='overwrite', run_id=None):
+    # [(op, src, dest)] -> [{'id', 'op', 'src', 'dest'}] with absolute paths.
+    # Move collisions are settled like file_transfer.plan; moves it skips are
+    # left out. Deletes have no dest until run_plan knows about the trash.
+    run_id = run_id or new_run_id()
+    moves = plan([(os.path.abspath(src), os.path.abspath(dest)) for op, src, dest in ops if op == 'move'], on_collision)
+    moves.reverse()
+    planned = []
+    for op, src, dest in ops:
+        if op == 'move':
+            src, dest = moves.pop()
+            if dest is None:
+                continue
+        else:
+            src, dest = os.path.abspath(src), None
+        planned.append({'id': len(planned), 'op': op, 'src': src, 'dest': dest})
+    return run_id, planned
+
+
+def print_plan(planned):
+    for entry in planned:
+        if entry['op'] == 'move':
+            print(f"Would move: {entry['src']} to {entry['dest']}")
+        else:
+            print(f"Would remove: {entry['src']}")
+    print(f"{len(planned)} operations planned.")
+
+
+class Journal:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'a', encoding='utf-8')
+        # A line cut short by a crash must not swallow the next record.
+        if self.file.tell() > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    self.file.write('\n')
+
+    def write(self, record, flush=True):
+        with self.lock:
+            self.file.write(json.dumps(record) + '\n')
+            if flush:
+                self.file.flush()
+
+    def close(self):
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+
+def load_journal(path):
+    # (run record, planned, finished {id: record}, undone ids). A line cut
+    # short by a crash is dropped.
+    run, planned, finished, undone = {}, [], {}, set()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if 'run' in record:
+                run = record
+            elif 'op' in record:
+                planned.append(record)
+            elif 'done' in record:
+                finished[record['done']] = record
+            elif 'undone' in record:
+                undone.add(record['undone'])
+    return run, planned, finished, undone
+
+
+def run_op(entry, trash=None):
+    src, dest = entry['src'], entry['dest']
+    if dest is None:
+        # Delete without a trash.
+        if os.path.lexists(src):
+            os.remove(src)
+        return {'done': entry['id'], 'replaced': None}
+    replaced = trash_path(trash, entry) if trash and entry['op'] == 'move' else None
+    if not os.path.lexists(src):
+        if os.path.lexists(dest):
+            # Finished before an interruption, only the journal line is missing.
+            return {'done': entry['id'], 'replaced': replaced if replaced and os.path.lexists(replaced) else None}
+        raise FileNotFoundError(2, 'Source no longer exists', src)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    if replaced and os.path.lexists(dest):
+        # plan_ops already decided it may be overwritten; keep it for undo.
+        os.makedirs(os.path.dirname(replaced), exist_ok=True)
+        move_file(dest, replaced)
+    move_file(src, dest)
+    return {'done': entry['id'], 'replaced': replaced if replaced and os.path.lexists(replaced) else None}
+
+
+def undo_op(entry, record):
+    src, dest = entry['src'], entry['dest']
+    if not os.path.lexists(dest) and os.path.lexists(src):
+        # Undone before an interruption.
+        return {'undone': entry['id']}
+    if os.path.lexists(src):
+        raise FileExistsError(17, 'Original path is taken again', src)
+    os.makedirs(os.path.dirname(src), exist_ok=True)
+    move_file(dest, src)
+    if record.get('replaced'):
+        move_file(record['replaced'], dest)
+    return {'undone': entry['id']}
+
+
+def execute(entries, job, journal_path, workers):
+    # Runs job(entry) on the pool, journaling each result as it completes.
+    # Returns [(src, dest, op or None, error or None)], the same shape as
+    # file_transfer.transfer_many.
+    journal = Journal(journal_path)
+    results = []
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {executor.submit(job, entry): entry for entry in entries}
+            for future in as_completed(futures):
+                entry = futures[future]
+                try:
+                    journal.write(future.result())
+                    results.append((entry['src'], entry['dest'], entry['op'], None))
+                except OSError as error:
+                    results.append((entry['src'], entry['dest'], None, error))
+    finally:
+        journal.close()
+    return results
+
+
+def run_plan(planned, run_id, journal_path=None, workers=TRANSFER_WORKERS, trash=False):
+    if journal_path is None:
+        os.makedirs(default_journal_folder(), exist_ok=True)
+        journal_path = os.path.join(default_journal_folder(), f"{run_id}.jsonl")
+    trash = trash_folder(os.path.abspath(journal_path)) if trash else None
+    if trash:
+        for entry in planned:
+            if entry['op'] == 'delete':
+                entry['dest'] = trash_path(trash, entry)
+    journal = Journal(journal_path)
+    journal.write({'run': run_id, 'created': time.time(), 'ops': len(planned), 'trash': trash})
+    for entry in planned:
+        journal.write(entry, flush=False)
+    journal.close()
+    print(f"Journal: {journal_path} (undo with --undo {journal_path})")
+    if trash:
+        print(f"Trash: {trash} (remove it once the result looks right)")
+    return execute(planned, lambda entry: run_op(entry, trash), journal_path, workers)
+
+
+def resume(journal_path, workers=TRANSFER_WORKERS):
+    run, planned, finished, _ = load_journal(journal_path)
+    remaining = [entry for entry in planned if entry['id'] not in finished]
+    print(f"Resuming {len(remaining)} of {len(planned)} operations.")
+    return execute(remaining, lambda entry: run_op(entry, run.get('trash')), journal_path, workers)
+
+
+def undo(journal_path, workers=TRANSFER_WORKERS):
+    # Operations of one plan never share a path, so they can be undone in any
+    # order and in parallel.
+    _, planned, finished, undone = load_journal(journal_path)
+    remaining = [entry for entry in planned if entry['id'] in finished and entry['id'] not in undone]
+    permanent = [entry for entry in remaining if entry['dest'] is None]
+    if permanent:
+        print(f"{len(permanent)} files were deleted without --trash and can't be restored.")
+    remaining = [entry for entry in remaining if entry['dest'] is not None]
+    print(f"Undoing {len(remaining)} operations.")
+    return execute(remaining, lambda entry: undo_op(entry, finished[entry['id']]), journal_path, workers)
+
+
+def report(results, restored=False):
+    moved = sum(1 for _, _, op, _ in results if op == 'move')
+    removed = sum(1 for _, _, op, _ in results if op == 'delete')
+    failed = [(src, error) for src, _, op, error in results if error is not None]
+    for src, error in failed:
+        print(f"Failed on {src}: {error}")
+    if restored:
+        print(f"Restored {moved + removed} files, {len(failed)} failed.")
+        return len(failed)
+    print(f"Moved {moved} files, removed {removed}, {len(failed)} failed.")
+    return len(failed)
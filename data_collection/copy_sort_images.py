@@ -1,10 +1,12 @@
 import os
-import shutil
+import sys
 from PIL import Image
 import argparse
-import random
 
-def copy_images(base_folder, out_folder, min_width, min_height):
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from file_transfer import TRANSFER_WORKERS, add_transfer_args, report_failures, transfer_many
+
+def copy_images(base_folder, out_folder, min_width, min_height, link_mode='copy', on_collision='rename', transfer_workers=TRANSFER_WORKERS):
     # Check if output directories exist; if not, create them
     landscape_dir = os.path.join(out_folder, 'landscape')
     portrait_dir = os.path.join(out_folder, 'portrait')
@@ -14,7 +16,7 @@ def copy_images(base_folder, out_folder, min_width, min_height):
     if not os.path.exists(portrait_dir):
         os.makedirs(portrait_dir)
 
-    current_seed = None
+    transfers = []
 
     # Walk through the base directory
     for dirpath, dirnames, filenames in os.walk(base_folder):
@@ -31,14 +33,10 @@ def copy_images(base_folder, out_folder, min_width, min_height):
                         destination_dir = landscape_dir if width > height else portrait_dir
                         destination_path = os.path.join(destination_dir, filename)
 
-                        # Roll a new seed if needed
-                        if os.path.exists(destination_path):
-                            current_seed = random.randint(1000, 1001000)
-                        
-                        new_filename = f"{current_seed}_{filename}" if current_seed and os.path.exists(destination_path) else filename
-                        destination_path = os.path.join(destination_dir, new_filename)
+                        # Same names from different folders are settled by --on-collision
+                        transfers.append((full_path, destination_path))
 
-                        shutil.copy2(full_path, destination_path)
+    report_failures(transfer_many(transfers, link_mode, on_collision, transfer_workers))
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Sort images into portrait and landscape folders.')
@@ -46,7 +44,8 @@ if __name__ == '__main__':
     parser.add_argument('--out', required=True, help='Output directory where images should be copied.')
     parser.add_argument('--minWidth', type=int, default=0, help='Minimum width of images to be copied.')
     parser.add_argument('--minHeight', type=int, default=0, help='Minimum height of images to be copied.')
+    add_transfer_args(parser, on_collision='rename')
 
     args = parser.parse_args()
 
-    copy_images(args.folder, args.out, args.minWidth, args.minHeight)
+    copy_images(args.folder, args.out, args.minWidth, args.minHeight, args.link_mode, args.on_collision, args.transfer_workers)
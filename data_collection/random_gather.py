@@ -1,10 +1,13 @@
 import argparse
 import os
 import random
+import sys
 from PIL import Image
-import shutil
 
-def main(path, outpath, per_set, set_limit, min_width, min_height, ignore_ends, repick, first, last):
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from file_transfer import TRANSFER_WORKERS, add_transfer_args, report_failures, transfer_many
+
+def main(path, outpath, per_set, set_limit, min_width, min_height, ignore_ends, repick, first, last, link_mode='copy', on_collision='rename', transfer_workers=TRANSFER_WORKERS):
     if not os.path.exists(outpath):
         os.makedirs(outpath)
 
@@ -55,12 +58,8 @@ def main(path, outpath, per_set, set_limit, min_width, min_height, ignore_ends,
         if set_limit and len(selected_images) >= set_limit:
             break
 
-    for img_path, img_name in selected_images:
-        new_name = img_name
-        while os.path.exists(os.path.join(outpath, new_name)):
-            new_name = f"{img_name.split('.')[0]}_{random.randint(1, 1000)}.{img_name.split('.')[1]}"
-
-        shutil.copy(img_path, os.path.join(outpath, new_name))
+    transfers = [(img_path, os.path.join(outpath, img_name)) for img_path, img_name in selected_images]
+    report_failures(transfer_many(transfers, link_mode, on_collision, transfer_workers, preserve=False))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -74,10 +73,11 @@ if __name__ == "__main__":
     parser.add_argument('--repick', action='store_true')
     parser.add_argument('--first', action='store_true', help='Take from the start of each folder')
     parser.add_argument('--last', action='store_true', help='Take from the end of each folder')
+    add_transfer_args(parser, on_collision='rename')
     
     args = parser.parse_args()
 
     if args.first and args.last:
         parser.error("--first and --last are mutually exclusive. Choose one.")
     
-    main(args.path, args.outpath, args.perSet, args.setLimit, args.minWidth, args.minHeight, args.ignore_ends, args.repick, args.first, args.last)
+    main(args.path, args.outpath, args.perSet, args.setLimit, args.minWidth, args.minHeight, args.ignore_ends, args.repick, args.first, args.last, args.link_mode, args.on_collision, args.transfer_workers)
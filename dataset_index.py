@@ -0,0 +1,208 @@
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, UnidentifiedImageError
+
+# Persistent listing of dataset folders, shared by the scripts that pair up
+# images, captions and masks by file stem. Each folder is read with one
+# os.scandir pass and stored in SQLite: name, stem, extension, size, mtime and,
+# once someone asked for it, the image dimensions.
+#
+# A folder is only listed again when its own mtime changed, which every add,
+# delete and rename in it does, so asking for a million-entry folder that
+# nobody touched is a single stat and a query. When it is listed again,
+# entries whose size and mtime are unchanged keep their dimensions. A folder
+# whose mtime is within MTIME_SLACK of the last listing is always listed
+# again, since a change in the same clock tick would not move the mtime.
+#
+# Stored dimensions are only kept for entries whose size and mtime matched at
+# the last listing, so sizes() trusts them without touching the files and only
+# reads headers for the rest. A file rewritten in place doesn't move its
+# folder's mtime; touch the folder (or use --no-index) after doing that.
+
+INDEX_ENV = 'AI_UTILS_INDEX'
+MTIME_SLACK_NS = 2 * 10**9
+PROBE_WORKERS = 16
+
+
+def default_index_path():
+    return os.environ.get(INDEX_ENV) or os.path.join(os.path.expanduser('~'), '.cache', 'ai-utils', 'dataset_index.sqlite')
+
+
+def add_index_args(parser):
+    parser.add_argument('--index-path', default=None, help=f'SQLite file the folder listings are kept in. Default is ~/.cache/ai-utils/dataset_index.sqlite, or ${INDEX_ENV}.')
+    parser.add_argument('--no-index', action='store_true', help='List the folders directly without keeping a persistent index.')
+
+
+def open_index(args):
+    if args.no_index:
+        return DatasetIndex(':memory:')
+    return DatasetIndex(args.index_path or default_index_path())
+
+
+def folder_key(folder):
+    return os.path.normcase(os.path.abspath(folder))
+
+
+def probe_size(path):
+    try:
+        with Image.open(path) as image:
+            return image.size
+    except (OSError, UnidentifiedImageError):
+        return None
+
+
+class DatasetIndex:
+    def __init__(self, path):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS folders ("
+            " folder TEXT PRIMARY KEY,"
+            " mtime_ns INTEGER NOT NULL,"
+            " listed_ns INTEGER NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " folder TEXT NOT NULL,"
+            " name TEXT NOT NULL,"
+            " stem TEXT NOT NULL,"
+            " ext TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " width INTEGER,"
+            " height INTEGER,"
+            " PRIMARY KEY (folder, name))"
+        )
+        self.connection.commit()
+        self.fresh = set()
+
+    def refresh(self, folder):
+        # Brings the stored listing up to date; True if the folder was listed.
+        key = folder_key(folder)
+        if key in self.fresh:
+            return False
+        # Stat before listing, so a change during the listing is seen next time.
+        mtime_ns = os.stat(folder).st_mtime_ns
+        row = self.connection.execute("SELECT mtime_ns, listed_ns FROM folders WHERE folder = ?", (key,)).fetchone()
+        if row is not None and row[0] == mtime_ns and mtime_ns < row[1] - MTIME_SLACK_NS:
+            self.fresh.add(key)
+            return False
+
+        known = {
+            name: (size, file_mtime_ns, width, height)
+            for name, size, file_mtime_ns, width, height in self.connection.execute(
+                "SELECT name, size, mtime_ns, width, height FROM files WHERE folder = ?", (key,))
+        }
+        listed_ns = time.time_ns()
+        rows = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                old = known.get(entry.name)
+                width, height = old[2:] if old is not None and old[:2] == (stat.st_size, stat.st_mtime_ns) else (None, None)
+                stem, ext = os.path.splitext(entry.name)
+                rows.append((key, entry.name, stem, ext[1:], stat.st_size, stat.st_mtime_ns, width, height))
+        with self.connection:
+            self.connection.execute("DELETE FROM files WHERE folder = ?", (key,))
+            self.connection.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.connection.execute("INSERT OR REPLACE INTO folders VALUES (?, ?, ?)", (key, mtime_ns, listed_ns))
+        self.fresh.add(key)
+        return True
+
+    def invalidate(self, folder):
+        # Call after changing a folder, so the next query in this run lists it again.
+        self.fresh.discard(folder_key(folder))
+
+    def names(self, folder):
+        # File names in the folder, sorted.
+        self.refresh(folder)
+        return [name for name, in self.connection.execute(
+            "SELECT name FROM files WHERE folder = ? ORDER BY name", (folder_key(folder),))]
+
+    def rows(self, folder):
+        # [(stem, ext, name, size, mtime_ns)] of the folder, sorted by name.
+        self.refresh(folder)
+        return self.connection.execute(
+            "SELECT stem, ext, name, size, mtime_ns FROM files WHERE folder = ? ORDER BY name", (folder_key(folder),)).fetchall()
+
+    def stems(self, folder):
+        # stem -> {extension: name}, e.g. 'img1' -> {'png': 'img1.png', 'txt': 'img1.txt'}.
+        stems = {}
+        for stem, ext, name, _, _ in self.rows(folder):
+            stems.setdefault(stem, {})[ext] = name
+        return stems
+
+    def records(self, image_folder, image_exts, caption_folder=None, mask_folder=None):
+        # stem -> {'image', 'caption', 'mask' (paths or None), 'size', 'mtime_ns'}
+        # for every image in image_folder; captions are <stem>.txt, masks an
+        # image with the same stem in mask_folder. One query per folder.
+        image_exts = {ext.lower() for ext in image_exts}
+        caption_folder = caption_folder or image_folder
+        captions = {stem for stem, ext, _, _, _ in self.rows(caption_folder) if ext == 'txt'}
+        masks = {}
+        if mask_folder:
+            for stem, ext, name, _, _ in self.rows(mask_folder):
+                if ext.lower() in image_exts:
+                    masks.setdefault(stem, name)
+        records = {}
+        for stem, ext, name, size, mtime_ns in self.rows(image_folder):
+            if ext.lower() not in image_exts or stem in records:
+                continue
+            records[stem] = {
+                'image': os.path.join(image_folder, name),
+                'caption': os.path.join(caption_folder, stem + '.txt') if stem in captions else None,
+                'mask': os.path.join(mask_folder, masks[stem]) if stem in masks else None,
+                'size': size,
+                'mtime_ns': mtime_ns,
+            }
+        return records
+
+    def sizes(self, folder, names, workers=PROBE_WORKERS):
+        # name -> (width, height), or None if PIL can't read it. Stored
+        # dimensions are used as they are; the rest are read from the file
+        # headers in parallel and stored.
+        self.refresh(folder)
+        key = folder_key(folder)
+        stored = {
+            name: (width, height)
+            for name, width, height in self.connection.execute(
+                "SELECT name, width, height FROM files WHERE folder = ? AND width IS NOT NULL", (key,))
+        }
+
+        def lookup(name):
+            path = os.path.join(folder, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return name, None, None
+            return name, probe_size(path), stat
+
+        missing = [name for name in names if name not in stored]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            found = list(executor.map(lookup, missing))
+
+        updates = [
+            (stat.st_size, stat.st_mtime_ns, size[0], size[1], key, name)
+            for name, size, stat in found if stat is not None and size is not None
+        ]
+        if updates:
+            with self.connection:
+                self.connection.executemany(
+                    "UPDATE files SET size = ?, mtime_ns = ?, width = ?, height = ? WHERE folder = ? AND name = ?", updates)
+        probed = {name: size for name, size, _ in found}
+        return {name: stored[name] if name in stored else probed[name] for name in names}
+
+    def close(self):
+        self.connection.close()
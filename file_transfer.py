@@ -0,0 +1,201 @@
+import ctypes
+import errno
+import os
+import shutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Copying, linking and moving files for the dataset scripts, so all of them
+# handle link modes and name collisions the same way.
+#
+#   copy      a full copy of the bytes
+#   hardlink  a second name for the same file: instant and no extra space, but
+#             only on the same filesystem, and editing one edits both
+#   symlink   a link to the absolute source path
+#   reflink   a copy-on-write clone (btrfs, XFS, APFS): instant and no extra
+#             space until one side is changed
+#
+# When a link can't be made (another device, filesystem without support, no
+# symlink permission on Windows) the file is copied instead and counted.
+# Destinations are all decided first, in order, so two sources with the same
+# name never race for it; then the transfers run on a thread pool, which is
+# what keeps copies across devices busy. Every file is written or linked under
+# a temporary name next to its destination and renamed over it, so an existing
+# destination is only replaced by a complete file, never removed first.
+
+LINK_MODES = ('copy', 'hardlink', 'symlink', 'reflink')
+COLLISION_MODES = ('overwrite', 'skip', 'rename', 'error')
+TRANSFER_WORKERS = 8
+FICLONE = 0x40049409  # linux/fs.h
+
+
+def add_transfer_args(parser, link_mode=True, on_collision='overwrite'):
+    # The same options for every script; scripts that only move files leave
+    # out --link-mode.
+    if link_mode:
+        parser.add_argument('--link-mode', default='copy', choices=LINK_MODES, help='How files are put in place: copy (default), hardlink, symlink or reflink. Links that are not possible fall back to copying.')
+    parser.add_argument('--on-collision', default=on_collision, choices=COLLISION_MODES, help=f'What to do when the destination file already exists: overwrite, skip, rename (adds _1, _2, ...) or error. Default is {on_collision}.')
+    parser.add_argument('--transfer-workers', type=int, default=TRANSFER_WORKERS, help=f'Files transferred in parallel. Default is {TRANSFER_WORKERS}.')
+
+
+def renamed(path, taken):
+    stem, ext = os.path.splitext(path)
+    counter = 1
+    while os.path.lexists(f"{stem}_{counter}{ext}") or f"{stem}_{counter}{ext}" in taken:
+        counter += 1
+    return f"{stem}_{counter}{ext}"
+
+
+def plan(pairs, on_collision='overwrite'):
+    # [(src, dest)] -> [(src, dest or None to skip)], with collisions settled
+    # against both the disk and earlier entries of the same plan.
+    taken = {}
+    planned = []
+    for src, dest in pairs:
+        exists = os.path.lexists(dest) or dest in taken
+        if exists and on_collision == 'skip':
+            dest = None
+        elif exists and on_collision == 'rename':
+            dest = renamed(dest, taken)
+        elif exists and on_collision == 'error':
+            raise FileExistsError(errno.EEXIST, 'Destination already exists', dest)
+        elif dest in taken:
+            # Overwritten later in the same plan, so the earlier one never
+            # has to be written (and the two can't race on the pool). Said
+            # out loud, since a move dropped this way leaves its source behind.
+            earlier = taken[dest]
+            print(f"Skipping {planned[earlier][0]}: {src} also goes to {dest} and replaces it.")
+            planned[earlier] = (planned[earlier][0], None)
+        if dest is not None:
+            taken[dest] = len(planned)
+        planned.append((src, dest))
+    return planned
+
+
+def reflink(src, dest):
+    if sys.platform == 'darwin':
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.clonefile(os.fsencode(src), os.fsencode(dest), 0) != 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), dest)
+        return
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, 'Reflinks are not supported on this platform', dest)
+    with open(src, 'rb') as source, open(dest, 'wb') as target:
+        try:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        except OSError:
+            target.close()
+            os.remove(dest)
+            raise
+
+
+def copy_file(src, dest, preserve=True):
+    if preserve:
+        shutil.copy2(src, dest)
+    else:
+        shutil.copy(src, dest)
+
+
+def temp_path(dest):
+    # Hidden, and unique per process and thread, in the destination folder so
+    # the final rename stays on one filesystem.
+    folder, name = os.path.split(dest)
+    return os.path.join(folder, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def put_file(src, dest, link_mode='copy', preserve=True):
+    try:
+        if link_mode == 'hardlink':
+            os.link(src, dest)
+        elif link_mode == 'symlink':
+            os.symlink(os.path.abspath(src), dest)
+        elif link_mode == 'reflink':
+            reflink(src, dest)
+            if preserve:
+                shutil.copystat(src, dest)
+        else:
+            copy_file(src, dest, preserve)
+        return link_mode
+    except OSError:
+        if link_mode == 'copy':
+            raise
+    copy_file(src, dest, preserve)
+    return 'copy'
+
+
+def transfer_file(src, dest, link_mode='copy', preserve=True):
+    # Puts src at dest and returns the mode that was actually used. An
+    # existing dest is replaced (plan() has already decided it may be).
+    if os.path.exists(dest) and os.path.samefile(src, dest):
+        return link_mode
+    temp = temp_path(dest)
+    try:
+        used = put_file(src, temp, link_mode, preserve)
+        os.replace(temp, dest)
+        return used
+    finally:
+        if os.path.lexists(temp):
+            os.remove(temp)
+
+
+def move_file(src, dest):
+    # Rename when on the same filesystem; otherwise copy next to dest, rename
+    # it into place and only then delete the source.
+    if os.path.lexists(dest) and os.path.samestat(os.lstat(src), os.lstat(dest)):
+        # Two links to one file: a rename between them does nothing.
+        os.remove(src)
+        return 'rename'
+    try:
+        os.replace(src, dest)
+        return 'rename'
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+    temp = temp_path(dest)
+    try:
+        shutil.copy2(src, temp, follow_symlinks=False)
+        os.replace(temp, dest)
+    finally:
+        if os.path.lexists(temp):
+            os.remove(temp)
+    os.remove(src)
+    return 'copy'
+
+
+def transfer_many(pairs, link_mode='copy', on_collision='overwrite', workers=TRANSFER_WORKERS, move=False, preserve=True):
+    # Returns [(src, dest, mode used or None if skipped, error or None)] in
+    # the order of pairs, and prints how many links fell back to copies.
+    planned = plan(pairs, on_collision)
+
+    def run(item):
+        src, dest = item
+        if dest is None:
+            return src, None, None, None
+        try:
+            used = move_file(src, dest) if move else transfer_file(src, dest, link_mode, preserve)
+            return src, dest, used, None
+        except OSError as error:
+            return src, dest, None, error
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(run, planned))
+
+    if not move and link_mode != 'copy':
+        fell_back = sum(1 for _, _, used, _ in results if used == 'copy')
+        if fell_back:
+            print(f"Could not {link_mode} {fell_back} files (different filesystem or not supported), copied them instead.")
+    return results
+
+
+def report_failures(results):
+    failed = [(src, error) for src, _, _, error in results if error is not None]
+    for src, error in failed:
+        print(f"Failed to transfer {src}: {error}")
+    return len(failed)
@@ -1,318 +1,19 @@
 import os
 import argparse
-import cv2
-from PIL import Image, ImageDraw
-import easyocr
+import importlib.util
 from tqdm import tqdm
-import numpy as np
-import itertools
-import math
+from ocr_engine import get_engine
+import mask_pipeline
+from preprocess_cache import CACHE_MAX_MB
+from detection_export import EXPORT_FORMATS
+from mask_core import BORDER_MARGIN, KEEP_BOXES, MAX_COMBINATIONS, TILE_OVERLAP, exports_closed, held_claims, process_batch, process_shard, quiet_output, should_process
+import mask_io
+import mask_reports
+import text_prefilter
+import metrics
+import shards
+import work_claims
 
-KEEP_BOXES = 1 #todo: make this a flag
-
-def is_touching_edges(x1, y1, x2, y2, img_width, img_height, xpad, ypad):
-    return x1 <= xpad or y1 <= ypad or x2 >= img_width - xpad or y2 >= img_height - ypad
-
-def is_touching_corners(x1, y1, x2, y2, img_width, img_height, xpad, ypad):
-    corners = [(xpad, ypad), (img_width - xpad, ypad), (xpad, img_height - ypad), (img_width - xpad, img_height - ypad)]
-    for cx, cy in corners:
-        if x1 <= cx <= x2 and y1 <= cy <= y2:
-            return True
-    return False
-
-def calculate_area(x1, y1, x2, y2):
-    return (x2 - x1) * (y2 - y1)
-
-def calculate_area_percentage(area, total_area):
-    return (area / total_area) * 100
-
-def nCr(n, r):
-    return math.comb(n, r)
-
-def read_image(image_path, use_color, use_cache, cache_folder, use_binary):
-    reader = easyocr.Reader(['en'])
-    
-    if use_color:
-        image = Image.open(image_path)
-        result = reader.readtext(image_path)
-    else:
-        image = read_grayscale_image(image_path, use_cache, cache_folder, use_binary)
-        gray_np = np.array(image)
-        result = reader.readtext(gray_np)
-
-    return image, result
-
-
-def read_grayscale_image(image_path, use_cache, cache_folder, use_binary):
-    if use_cache:
-        cached_filename = os.path.join(cache_folder, os.path.basename(image_path))
-        if os.path.exists(cached_filename):
-            return Image.open(cached_filename)
-        
-    img = cv2.imread(image_path)
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    
-    if use_binary:
-        _, gray = cv2.threshold(gray, 128, 255, cv2.THRESH_BINARY)
-    
-    if use_cache:
-        cv2.imwrite(cached_filename, gray)
-    
-    return Image.fromarray(gray)
-
-
-def prepare_boxes(image, **kwargs):
-    width, height = image.size
-    total_area = width * height
-    # If xpad_detect is None or not found, set it to 5% of the width
-    xpad_detect = kwargs.get('xpad_detect')
-    if xpad_detect is None:
-        xpad_detect = int(width * 0.05)
-
-    # If ypad_detect is None or not found, set it to 5% of the height
-    ypad_detect = kwargs.get('ypad_detect')
-    if ypad_detect is None:
-        ypad_detect = int(height * 0.05)
-
-    return {
-        'total_area': total_area,
-        'width': width,
-        'height': height,
-        'xpad_detect': xpad_detect,
-        'ypad_detect': ypad_detect,
-    }
-
-
-def draw_boxes(result, draw, **kwargs):
-    min_x = 0
-    min_y = 0
-    max_x = 0
-    max_y = 0
-    total_masked_area_percent = 0
-
-    min_area = kwargs.get('min_area')  # Default value if not passed
-    max_area = kwargs.get('max_area', 10)  # Default value if not passed
-    only_largest = kwargs.get('only_largest', False)  # Default value if not passed
-    contain_bounding_boxes = kwargs.get('contain_bounding_boxes', False)  # Default value if not passed
-    text_direction = kwargs.get('text_direction', 'horizontal')  # Default value if not passed
-    xpad_box = kwargs.get('xpad_box', 0)  # Default value if not passed
-    ypad_box = kwargs.get('ypad_box', 0)  # Default value if not passed
-    corners = kwargs.get('corners', False)  # Default value if not passed
-    edges = kwargs.get('edges', False)  # Default value if not passed
-    min_total_area = kwargs.get('min_total_area', 0.1)  # Default value if not passed
-    xpad_detect = kwargs.get('xpad_detect')  # Assuming this is in box_settings
-    ypad_detect = kwargs.get('ypad_detect')  # Assuming this is in box_settings
-    width = kwargs.get('width')  # Assuming this is in box_settings
-    height = kwargs.get('height')  # Assuming this is in box_settings
-    total_area = kwargs.get('total_area')  # Assuming this is in box_settings
-    was_mask_created = False
-    detected_boxes = []
-
-    for detection in result:
-        top_left, top_right, bottom_right, bottom_left = detection[0]
-        x1, y1 = top_left
-        x2, y2 = bottom_right
-        if (min_x == 0 and min_y == 0 and max_x == 0 and max_y == 0):
-            min_x = x1
-            min_y = y1
-            max_x = x2
-            max_y = y2
-
-        box_width = x2 - x1  # Dimensions of the bounding box, renamed to avoid conflict
-        box_height = y2 - y1  # Dimensions of the bounding box, renamed to avoid conflict
-        is_horizontally_longer = box_width > box_height  # Use 'box_width' and 'box_height' here
-
-        if text_direction == 'horizontal' and not is_horizontally_longer and not box_width == box_height:
-            continue
-        if text_direction == 'vertical' and is_horizontally_longer and not box_width == box_height:
-            continue
-
-        area = (x2 - x1) * (y2 - y1)
-        area_percent = (area / total_area) * 100
-        if area_percent < min_area or area_percent > max_area:
-            print(f"\nArea percentage {area_percent} is not within the range of {min_area} and {max_area}.")
-            continue
-
-        should_draw = False
-        if corners:
-            should_draw = is_touching_corners(x1, y1, x2, y2, width, height, xpad_detect, ypad_detect)
-        elif edges:
-            x1_draw, y1_draw, x2_draw, y2_draw = x1, y1, x2, y2
-            if x1 <= xpad_detect: x1_draw = 0
-            if y1 <= ypad_detect: y1_draw = 0
-            if x2 >= (width - xpad_detect): x2_draw = width
-            if y2 >= (height - ypad_detect): y2_draw = height
-            
-            # Recalculate area and area_percent when box is extended
-            extended_area = calculate_area(x1_draw, y1_draw, x2_draw, y2_draw)
-            extended_area_percent = calculate_area_percentage(extended_area, total_area)
-
-            if extended_area_percent < min_area or extended_area_percent > max_area:
-                print(f"\nExtended area percentage {extended_area_percent} is not within the range of {min_area} and {max_area}.")
-                continue
-
-            draw.rectangle([x1_draw, y1_draw, x2_draw, y2_draw], fill="black")
-            was_mask_created = True
-            total_masked_area_percent += extended_area_percent
-        else:
-            should_draw = True
-
-        if should_draw and not edges:
-            detected_boxes.append((x1, y1, x2, y2))
-            min_x = min(min_x, x1)
-            min_y = min(min_y, y1)
-            max_x = max(max_x, x2)
-            max_y = max(max_y, y2)
-
-            if only_largest:
-                if area > max_area:
-                    max_area = area
-                    largest_detection = detection
-            else:
-                x1_draw = max(x1 - xpad_box, 0)
-                y1_draw = max(y1 - ypad_box, 0)
-                x2_draw = min(x2 + xpad_box, width)
-                y2_draw = min(y2 + ypad_box, height)
-                draw.rectangle([x1_draw, y1_draw, x2_draw, y2_draw], fill="black")
-                was_mask_created = True
-                total_masked_area_percent += area_percent
-
-    if only_largest and largest_detection:
-        x1, y1 = largest_detection[0][0]
-        x2, y2 = largest_detection[0][2]
-        x1_draw = max(x1 - xpad_box, 0)
-        y1_draw = max(y1 - ypad_box, 0)
-        x2_draw = min(x2 + xpad_box, width)
-        y2_draw = min(y2 + ypad_box, height)
-        draw.rectangle([x1_draw, y1_draw, x2_draw, y2_draw], fill="black")
-        was_mask_created = True
-        # print(f"\nDrawing bounding box for largest detection {detection[1]}")
-        total_masked_area_percent += area_percent
-
-    largest_valid_combination = None
-    largest_valid_area = 0
-
-    if contain_bounding_boxes and len(detected_boxes) > 1:
-        # print(f"\nFound {len(detected_boxes)} bounding boxes. Checking if they can be combined.")
-        
-        largest_valid_combination = None  # Initialize
-        largest_valid_area = 0  # Initialize
-        combinations_area = []  # List to store all possible combinations and their areas
-
-        combinations_area = []
-        for box1, box2 in itertools.combinations(detected_boxes, 2):
-            min_x = min(box1[0], box2[0])
-            min_y = min(box1[1], box2[1])
-            max_x = max(box1[2], box2[2])
-            max_y = max(box1[3], box2[3])
-            area_comb = (max_x - min_x) * (max_y - min_y)
-            combinations_area.append((area_comb, (box1, box2)))
-
-        combinations_area.sort(reverse=True)  # Sort by area, largest to smallest
-        largest_valid_combination = None
-        largest_valid_area = 0
-
-        for area_comb, boxes in combinations_area:
-            area_percent = (area_comb / total_area) * 100
-            if area_percent <= max_area:
-                largest_valid_combination = (min(boxes[0][0], boxes[1][0]), 
-                                            min(boxes[0][1], boxes[1][1]), 
-                                            max(boxes[0][2], boxes[1][2]), 
-                                            max(boxes[0][3], boxes[1][3]))
-                largest_valid_area = area_comb
-                contributing_boxes = boxes  # Store the contributing boxes
-                break
-
-        if largest_valid_combination:
-            print(f"\nThe largest valid bounding box was found. Area percentage: {total_masked_area_percent}")
-            min_x, min_y, max_x, max_y = largest_valid_combination
-            # White out the areas not covered by the largest bounding box
-            draw.rectangle([0, 0, width, min_y], fill="white")
-            draw.rectangle([0, max_y, width, height], fill="white")
-            draw.rectangle([0, min_y, min_x, max_y], fill="white")
-            draw.rectangle([max_x, min_y, width, max_y], fill="white")
-            # Finally, draw the largest valid bounding box
-            if(kwargs.get('draw_contain', True)):
-                # breakpoint()
-                print(f"\nmin total area: {kwargs.get('min_total_area', 0.1)}")
-                if (kwargs.get('contain_under_min', True) and total_masked_area_percent < kwargs.get('min_total_area', 0.1)) or not kwargs.get('contain_under_min', True):
-                    draw.rectangle([largest_valid_combination[0], largest_valid_combination[1], largest_valid_combination[2], largest_valid_combination[3]], fill="black")    
-                    was_mask_created = True
-        else:
-            # print(f"\nNo valid bounding box found. Keeping the closest {KEEP_BOXES} bounding boxes to the corner. modify KEEP_BOXES in batch_create_masks.py to change")
-            # Calculate the distance of each bounding box to the top-left corner (0, 0)
-            distances_to_corner = [(box[0]**2 + box[1]**2, box) for box in detected_boxes]
-            distances_to_corner.sort()
-            # Keep only the closest N boxes (todo: determined by --keep-boxes flag)
-            keep_boxes = int(KEEP_BOXES)  # Replace with the actual flag value
-            boxes_to_keep = [box for _, box in distances_to_corner[:keep_boxes]]
-            for box in detected_boxes:
-                if box not in boxes_to_keep:
-                    draw.rectangle([box[0], box[1], box[2], box[3]], fill="white")
-
-
-    return was_mask_created, total_masked_area_percent
-
-def save_mask(mask, mask_filename, include_textfile, result):
-    mask.save(mask_filename)
-    
-    if include_textfile:
-        txt_filename = mask_filename.rsplit('.', 1)[0] + '.txt'
-        with open(txt_filename, 'w', encoding='utf-8') as f:
-            for detection in result:
-                f.write(detection[1] + '\n')
-
-MAX_COMBINATIONS = 2**15
-
-def process_image(**kwargs):
-    print(f"\nProcessing {os.path.basename(kwargs['image_path'])}")
-    image_path = kwargs['image_path']
-    out_folder = kwargs['out_folder']
-    overwrite = kwargs.get('overwrite', False)
-
-    mask_filename = os.path.join(out_folder, os.path.basename(image_path))
-    if os.path.exists(mask_filename) and not overwrite:
-        print(f"\nMask already exists for {os.path.basename(image_path)}, skipping.")
-        return
-    
-    image, result = read_image(
-        image_path=image_path,
-        use_color=kwargs.get('use_color', True),
-        use_cache=kwargs.get('use_cache', False),
-        cache_folder=kwargs.get('cache_folder'),
-        use_binary=kwargs.get('use_binary', False),
-    )
-
-    box_settings = prepare_boxes(image, **kwargs)
-    mask = Image.new("RGB", image.size, "white")
-    draw = ImageDraw.Draw(mask)
-
-
-    all_kwargs = box_settings.copy()  # Start with the contents of box_settings
-
-    # Update all_kwargs only for keys that have non-None values in kwargs
-    for key, value in kwargs.items():
-        if value is not None:
-            all_kwargs[key] = value
-
-    mask_created = False
-
-    mask_created, total_masked_area_percent = draw_boxes(
-        result=result,
-        draw=draw,
-        **all_kwargs,
-    )
-
-    if mask_created and total_masked_area_percent >= kwargs.get('min_total_area', 0.1):
-        save_mask(mask, mask_filename, kwargs.get('include_textfile', True), result)
-    else:
-        include_blank = kwargs.get('include_empty', True)
-        if include_blank and total_masked_area_percent == 0:
-            mask = Image.new("RGB", image.size, "white")
-            save_mask(mask, mask_filename, kwargs.get('include_textfile', True), result)
-        print(f"\nMask was not created for {os.path.basename(image_path)}, total masked area percentage was {total_masked_area_percent} and threshold was {kwargs.get('min_total_area', 0.1)}")
-
-    
 
 def main():
     parser = argparse.ArgumentParser()
@@ -330,30 +31,90 @@ def main():
     parser.add_argument('--min-area', type=float, default=0.1, help='Minimum area as a percentage to include bounding box. Default is 1%.')
     parser.add_argument('--max-area', type=float, default=10, help='Maximum area as a percentage to include bounding box. Default is 10%.')
     parser.add_argument('--use-color', type=bool, default=True, help='Use color images instead of grayscale.')
-    parser.add_argument('--use-cache', action='store_true', help='Cache grayscale images to disk.')
+    parser.add_argument('--use-cache', action='store_true', help='Cache grayscale images to disk, keyed by image content and --use-binary.')
+    parser.add_argument('--cache-max-mb', type=int, default=CACHE_MAX_MB, help='Use with --use-cache. Size limit of the grayscale cache in MB, least recently used images are removed past it. Default is 2048.')
     parser.add_argument('--use-binary', action='store_true', help='Use binary black/white instead of grayscale.')
     parser.add_argument('--text-direction', default='horizontal', choices=['horizontal', 'vertical', 'any'], help='Orientation of the bounding box. Choices are horizontal, vertical, or any')
     parser.add_argument('--min-total-area', type=float, default=0.1, help='Minimum total area as a percentage to create masks for the image. Default is 0.1%. Recommended range 10-20%. Useful for images with multiple bounding boxes where sometimes one of the boxes is missing.')
     parser.add_argument('--contain', action='store_true', help='Measure around all bounding boxes to find the largest within the --max-area. Useful for eliminating false positives.')
     parser.add_argument('--draw-contain', action='store_true', help='Use in combination with --contain. Draw a bounding box around all bounding boxes. Useful for images with multiple bounding boxes where sometimes one of the middle boxes is missing.')
+    parser.add_argument('--contain-max-nodes', type=int, default=MAX_COMBINATIONS, help='Use in combination with --contain. Cap on the number of box groups the contain search expands per image. Default is 2**15.')
+    parser.add_argument('--keep-boxes', type=int, default=KEEP_BOXES, help=f'Use in combination with --contain. When no group of boxes fits in --max-area, keep this many boxes closest to the top-left corner. Default is {KEEP_BOXES}.')
     parser.add_argument('--contain-under-min', action='store_true', help='Use in combination with --contain and --draw-contain. Only draws contain if the detected boxes have less than the total area already.')
     parser.add_argument('--include-empty', action='store_true', help='Include blank masks for images that do not meet the --min-total-area threshold.')
+    parser.add_argument('--border-ocr', action='store_true', help='Use with --edges or --corners. Only OCR the border strips (top and bottom strips for --corners) instead of the whole image. Text away from the border is not detected.')
+    parser.add_argument('--border-margin', type=int, default=BORDER_MARGIN, help='Use with --border-ocr. How far past --xpad-detect/--ypad-detect the strips reach, in pixels. Default is 64.')
+    parser.add_argument('--prefilter', action='store_true', help='Skip OCR on images that a quick classical check finds no text in. Those images are handled like images with no detections (see --include-empty).')
+    parser.add_argument('--prefilter-threshold', type=int, default=text_prefilter.PREFILTER_THRESHOLD, help=f'Use with --prefilter. Characters the longest text-like line needs to have for the image to be sent to OCR. Default is {text_prefilter.PREFILTER_THRESHOLD}.')
+    parser.add_argument('--prefilter-report', type=int, metavar='N', help='Compare the prefilter with real OCR on N random images, print its recall and exit.')
+    parser.add_argument('--prefilter-report-file', help='Use with --prefilter-report. Also write the full report to this JSON file.')
+    parser.add_argument('--tile-budget-mb', type=int, help='Memory budget for one OCR call, in MB. Images too large for it are OCR\'d as overlapping tiles sized to fit. Off by default.')
+    parser.add_argument('--tile-overlap', type=int, default=TILE_OVERLAP, help='Use with --tile-budget-mb. Overlap between neighbouring tiles in pixels, should be taller than the text. Default is 128.')
+    parser.add_argument('--detect-max-side', type=int, help='Run text detection on a copy of the image resized so its longest side is at most this many pixels, and scale the boxes back. Off by default.')
+    parser.add_argument('--detect-refine', action='store_true', help='Use with --detect-max-side. Detect again at full resolution, only around the boxes found on the resized copy.')
+    parser.add_argument('--detect-report', type=int, metavar='N', help='Use with --detect-max-side. Compare time and masks against full resolution detection on N random images, print a summary and exit.')
+    parser.add_argument('--detect-report-file', help='Use with --detect-report. Also write the full report to this JSON file.')
+    parser.add_argument('--recognize-all', action='store_true', help='Run text recognition on every image. By default only the text detector runs, and text is recognized just for masks written with --include-textfile.')
+    parser.add_argument('--mask-format', default='image', choices=mask_io.MASK_FORMATS, help='How masks are written: image (RGB file with the source extension), png1 (1-bit PNG) or rle (one masks.jsonl with COCO-style RLE). Default is image.')
+    parser.add_argument('--batch-size', type=int, default=1, help='Number of images sent to the OCR engine at once. Same-size images are run through the batched readtext path. Default is 1.')
+    parser.add_argument('--detection-cache', nargs='?', const='', default=None, help='Store OCR detections in a SQLite file and reuse them when only post-OCR settings change. Defaults to <path>_detections.sqlite when given without a value.')
+    parser.add_argument('--journal', nargs='?', const='', default=None, help='Keep a SQLite journal of each image\'s file and settings, and on re-runs only redo images whose file or output settings changed. Defaults to <out>_journal.sqlite when given without a value.')
+    parser.add_argument('--shards', action='store_true', help='Read the images from the .tar shards in --path and write masks (and .txt files) into a shard of the same name in --out. An output shard that already exists is skipped unless --overwrite.')
+    parser.add_argument('--export-detections', help='Write every image\'s detections (box, text, confidence), its size and the settings used into this folder as a dataset, one row per detection. Text is recognized for every exported image.')
+    parser.add_argument('--export-format', default='jsonl', choices=EXPORT_FORMATS, help='Use with --export-detections. jsonl or parquet (needs pyarrow). Default is jsonl.')
+    parser.add_argument('--dedupe-phash', type=int, help='Skip OCR on a frame whose perceptual hash is within this many bits (of 64) of a frame of the same size already OCR\'d in this run, and reuse its detections. Around 4 catches re-encoded copies of the same frame. With --workers, each worker only compares against its own frames.')
+    parser.add_argument('--shard', help='Only process the images (or --shards files) whose name hashes to shard i of N, given as i/N. Runs started with 0/N to N-1/N on any machines split the work between them without overlap.')
+    parser.add_argument('--claim', nargs='?', const='', default=None, help='Claim each image with a lease file in this folder before processing it and mark it done afterwards, so any number of runs sharing the output folder can pull work from the same list without doing an image twice. Defaults to <out>_claims when given without a value.')
+    parser.add_argument('--claim-ttl', type=int, default=work_claims.LEASE_TTL, help='Use with --claim. Seconds after which a lease that is no longer renewed counts as left behind by a crashed run and is taken over. Default is 600.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes. Above 1, decode, OCR, mask rendering and writing run as separate stages with one OCR engine per worker. Default is 1.')
+    parser.add_argument('--quiet', action='store_true', help='Hide the per-image messages, only show the progress bar and the summary.')
+    parser.add_argument('--metrics-file', help='Write the run summary (time per stage, images per second, counters) to this JSON file.')
+    parser.add_argument('--live-metrics', help='Keep rewriting the summary to this JSON file while the run is going, for long runs.')
+    parser.add_argument('--live-interval', type=int, default=metrics.LIVE_INTERVAL, help='Use with --live-metrics. Seconds between rewrites. Default is 30.')
+    parser.add_argument('--profile', help='Profile the run with cProfile and save the stats to this file (main process only).')
+    parser.add_argument('--trace-memory', action='store_true', help='Trace Python memory allocations with tracemalloc and add the peak and top allocations to the summary (main process only).')
+    parser.add_argument('--ocr-backend', default='easyocr', help='OCR backend to use, either a registered name (easyocr, stub) or module:Class. Default is easyocr.')
 
 
     args = parser.parse_args()
+
+    if args.shards and args.mask_format == 'rle':
+        parser.error('--shards writes one mask file per image, use --mask-format image or png1')
+    if (args.shard or args.claim is not None) and args.mask_format == 'rle':
+        parser.error('--shard and --claim run several processes into one output folder, use --mask-format image or png1')
+    if args.export_format == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+        parser.error('--export-format parquet needs pyarrow (pip install pyarrow)')
+    shard = None
+    if args.shard:
+        try:
+            shard = work_claims.parse_shard(args.shard)
+        except ValueError:
+            parser.error(f"--shard takes i/N with 0 <= i < N, got {args.shard}")
     
     if not os.path.exists(args.out):
         os.mkdir(args.out)
 
     if args.use_cache:
         cache_folder = args.path + '_grayscale_cache'
-        if not os.path.exists(cache_folder):
-            os.mkdir(cache_folder)
     else:
         cache_folder = None
 
+    detection_cache = args.detection_cache
+    if detection_cache == '':
+        detection_cache = args.path.rstrip('/\\') + '_detections.sqlite'
+
+    journal = args.journal
+    if journal == '':
+        journal = args.out.rstrip('/\\') + '_journal.sqlite'
+
+    claims = args.claim
+    if claims == '':
+        claims = args.out.rstrip('/\\') + '_claims'
+
 
     image_files = [f for f in os.listdir(args.path) if f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff'))]
+    if shard is not None:
+        image_files = [f for f in image_files if work_claims.in_shard(f, *shard)]
     
     tqdm.write(f"Total images to process: {len(image_files)}")
     tqdm.write(f"Output directory: {args.out}")
@@ -370,42 +131,156 @@ def main():
     tqdm.write(f"Maximum area as a percentage to include bounding box: {args.max_area}")
     tqdm.write(f"Use color images instead of grayscale: {args.use_color}")
     tqdm.write(f"Cache grayscale images to disk: {args.use_cache}")
+    tqdm.write(f"Grayscale cache size limit (MB): {args.cache_max_mb}")
     tqdm.write(f"Use binary black/white instead of grayscale: {args.use_binary}")
     tqdm.write(f"Orientation of the bounding box: {args.text_direction}")
     tqdm.write(f"Minimum total area as a percentage to create masks for the image: {args.min_total_area}")
     tqdm.write(f"Measure around all bounding boxes to find the largest within the --max-area: {args.contain}")
     tqdm.write(f"Draw a bounding box around all bounding boxes: {args.draw_contain}")
+    tqdm.write(f"Boxes kept when nothing fits in the max area: {args.keep_boxes}")
     tqdm.write(f"Only draws contain if the detected boxes have less than the total area already: {args.contain_under_min}")
     tqdm.write(f"Include blank masks for images that do not meet the --min-total-area threshold: {args.include_empty}")
+    tqdm.write(f"OCR only the border strips: {args.border_ocr}")
+    tqdm.write(f"Border strip margin: {args.border_margin}")
+    tqdm.write(f"Skip OCR on images without text: {args.prefilter}")
+    tqdm.write(f"Prefilter threshold: {args.prefilter_threshold}")
+    tqdm.write(f"OCR tile memory budget (MB): {args.tile_budget_mb}")
+    tqdm.write(f"OCR tile overlap: {args.tile_overlap}")
+    tqdm.write(f"Maximum side for text detection: {args.detect_max_side}")
+    tqdm.write(f"Refine detections at full resolution: {args.detect_refine}")
+    tqdm.write(f"Recognize text on every image: {args.recognize_all}")
+    tqdm.write(f"Mask format: {args.mask_format}")
+    tqdm.write(f"OCR batch size: {args.batch_size}")
+    tqdm.write(f"OCR backend: {args.ocr_backend}")
+    tqdm.write(f"Read and write tar shards: {args.shards}")
+    tqdm.write(f"Worker processes: {args.workers}")
+    tqdm.write(f"Detection cache: {detection_cache}")
+    tqdm.write(f"Run journal: {journal}")
+    tqdm.write(f"Export detections to: {args.export_detections}")
+    tqdm.write(f"Export format: {args.export_format}")
+    tqdm.write(f"Reuse detections of near-duplicate frames within (bits): {args.dedupe_phash}")
+    tqdm.write(f"Shard: {args.shard}")
+    tqdm.write(f"Work claims: {claims}")
+    tqdm.write(f"Claim lease TTL (seconds): {args.claim_ttl}")
+
+    engine_options = {'backend': args.ocr_backend, 'batch_size': args.batch_size}
+    engine = get_engine(**engine_options)
+
+    args_dict = {
+        'out_folder': args.out,
+        'include_textfile': args.include_textfile,
+        'use_color': args.use_color,
+        'use_binary': args.use_binary,
+        'use_cache': args.use_cache,
+        'cache_folder': cache_folder,
+        'cache_max_mb': args.cache_max_mb,
+        'xpad_detect': args.xpad_detect,
+        'ypad_detect': args.ypad_detect,
+        'xpad_box': args.xpad_box,
+        'ypad_box': args.ypad_box,
+        'corners': args.corners,
+        'edges': args.edges,
+        'only_largest': args.only_largest,
+        'overwrite': args.overwrite,
+        'min_area': args.min_area,
+        'max_area': args.max_area,
+        'text_direction': args.text_direction,
+        'min_total_area': args.min_total_area,
+        'contain_bounding_boxes': args.contain,
+        'draw_contain': args.draw_contain,
+        'contain_under_min': args.contain_under_min,
+        'contain_max_nodes': args.contain_max_nodes,
+        'keep_boxes': args.keep_boxes,
+        'include_empty': args.include_empty,
+        'mask_format': args.mask_format,
+        'border_ocr': args.border_ocr,
+        'border_margin': args.border_margin,
+        'prefilter': args.prefilter,
+        'prefilter_threshold': args.prefilter_threshold,
+        'tile_budget_mb': args.tile_budget_mb,
+        'tile_overlap': args.tile_overlap,
+        'detect_max_side': args.detect_max_side,
+        'detect_refine': args.detect_refine,
+        'recognize_all': args.recognize_all,
+        'batch_size': args.batch_size,
+        'engine': engine,
+        'ocr_backend': args.ocr_backend,
+        'detection_cache': detection_cache,
+        'journal': journal,
+        'claims': claims,
+        'claim_ttl': args.claim_ttl,
+        'export_detections': args.export_detections,
+        'export_format': args.export_format,
+        'dedupe_phash': args.dedupe_phash,
+        'quiet': args.quiet,
+    }
+
+    if args.prefilter_report:
+        report = mask_reports.prefilter_report([os.path.join(args.path, f) for f in image_files], args.prefilter_report, **args_dict)
+        tqdm.write(f"Prefilter sample: {report['sample']} images, threshold {report['threshold']}")
+        tqdm.write(f"Would skip OCR on: {report['skip_rate']}")
+        tqdm.write(f"Recall on images with any detection: {report['text_recall']}")
+        tqdm.write(f"Recall on images that got a mask: {report['mask_recall']}")
+        tqdm.write(f"Masked images the prefilter would miss: {', '.join(report['missed']) or 'none'}")
+        if args.prefilter_report_file:
+            mask_reports.write_report(report, args.prefilter_report_file)
+        return
+
+    if args.detect_report:
+        if not args.detect_max_side:
+            parser.error('--detect-report needs --detect-max-side')
+        report = mask_reports.detect_report([os.path.join(args.path, f) for f in image_files], args.detect_report, **args_dict)
+        tqdm.write(f"Detection sample: {report['sample']} images, max side {report['detect_max_side']}, refine {report['detect_refine']}")
+        tqdm.write(f"OCR seconds at full resolution: {report['full_seconds']:.2f}, downscaled: {report['scaled_seconds']:.2f} (speedup {report['speedup']})")
+        tqdm.write(f"Mask IoU against full resolution, mean: {report['mean_iou']}, worst: {report['min_iou']}")
+        tqdm.write(f"Images where both agree on writing a mask: {report['mask_agreement']}")
+        tqdm.write(f"Masked at full resolution only: {', '.join(report['missed']) or 'none'}")
+        tqdm.write(f"Masked when downscaled only: {', '.join(report['extra']) or 'none'}")
+        if args.detect_report_file:
+            mask_reports.write_report(report, args.detect_report_file)
+        return
 
-    for filename in tqdm(image_files, desc="Processing images"):
-        full_path = os.path.join(args.path, filename)
-        args_dict = {
-            'image_path': full_path,
-            'out_folder': args.out,
-            'include_textfile': args.include_textfile,
-            'use_color': args.use_color,
-            'use_binary': args.use_binary,
-            'use_cache': args.use_cache,
-            'cache_folder': cache_folder,
-            'xpad_detect': args.xpad_detect,
-            'ypad_detect': args.ypad_detect,
-            'xpad_box': args.xpad_box,
-            'ypad_box': args.ypad_box,
-            'corners': args.corners,
-            'edges': args.edges,
-            'only_largest': args.only_largest,
-            'overwrite': args.overwrite,
-            'min_area': args.min_area,
-            'max_area': args.max_area,
-            'text_direction': args.text_direction,
-            'min_total_area': args.min_total_area,
-            'contain_bounding_boxes': args.contain,
-            'draw_contain': args.draw_contain,
-            'contain_under_min': args.contain_under_min,
-            'include_empty': args.include_empty,
-        }
-        process_image(**args_dict)
+    if args.live_metrics:
+        metrics.configure_live(args.live_metrics, args.live_interval)
+
+    with metrics.profiled(args.profile, args.trace_memory) as memory:
+        with quiet_output(args.quiet), held_claims(**args_dict), exports_closed():
+            if args.shards:
+                shard_paths = shards.list_shards(args.path)
+                if shard is not None:
+                    shard_paths = [p for p in shard_paths if work_claims.in_shard(p, *shard)]
+                with tqdm(total=len(shard_paths), desc="Processing shards") as progress:
+                    if args.workers > 1:
+                        mask_pipeline.run_shards(shard_paths, args.workers, engine_options, progress=progress, **args_dict)
+                    else:
+                        for shard_path in shard_paths:
+                            process_shard(shard_path, **args_dict)
+                            progress.update(1)
+            elif args.workers > 1:
+                image_paths = [os.path.join(args.path, f) for f in image_files]
+                image_paths = [p for p in image_paths if should_process(p, **args_dict)]
+                with tqdm(total=len(image_paths), desc="Processing images") as progress:
+                    mask_pipeline.run_pipeline(image_paths, args.workers, engine_options, progress=progress, **args_dict)
+            else:
+                with tqdm(total=len(image_files), desc="Processing images") as progress:
+                    for start in range(0, len(image_files), args.batch_size):
+                        batch = image_files[start:start + args.batch_size]
+                        process_batch([os.path.join(args.path, f) for f in batch], **args_dict)
+                        progress.update(len(batch))
+
+    summary = metrics.get_metrics().summary()
+    if memory:
+        summary['memory'] = memory
+    tqdm.write(f"\nProcessed {summary['counters'].get('images', 0)} images in {summary['elapsed_seconds']:.1f}s ({summary['images_per_second'] or 0:.2f} images/s)")
+    for name, stage in summary['stages'].items():
+        tqdm.write(f"  {name}: {stage['seconds']:.2f}s ({stage['share'] * 100:.1f}%), {stage['mean_ms']:.1f} ms per call, max {stage['max_ms']:.1f} ms")
+    tqdm.write(f"  counters: {', '.join(f'{k} {v}' for k, v in sorted(summary['counters'].items())) or 'none'}")
+    if memory:
+        tqdm.write(f"  peak traced memory: {memory['peak_mb']:.1f} MB")
+    if args.metrics_file:
+        metrics.write_json(summary, args.metrics_file)
+    if args.live_metrics:
+        metrics.write_json(summary, args.live_metrics)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from tqdm import tqdm
+
+import mask_io
+from ocr_engine import OCRBackend
+
+# Benchmark batch_create_masks on generated images. Each dataset has text
+# drawn at known positions (saved to boxes.json next to the images), and OCR
+# is done by SyntheticTextBackend, a deterministic stand-in that finds the
+# dark text pixels, so no model is needed and timings only move when our code
+# does. Every (dataset size, box density, run settings) combination is run as
+# its own batch_create_masks process; its --metrics-file summary gives
+# images/sec, per-stage latency percentiles and peak RSS. The masks of each
+# setting are scored against boxes.json: recall is the share of text pixels
+# masked and precision the share of masked pixels that are text (the
+# rectangle around each drawn word), so a faster change that masks less or
+# more shows up too. All of it is saved to one JSON file that can be compared
+# across commits.
+
+BACKEND = 'bench_masks:SyntheticTextBackend'
+DELAY_ENV = 'BENCH_OCR_DELAY_MS'
+TEXT_VALUE = 0  # text is drawn pure black, the background never goes below BACKGROUND_MIN
+BACKGROUND_MIN = 96
+WORDS = ['SAMPLE', 'watermark', 'stock photo', 'preview', '(c) 2024', 'DO NOT COPY', 'studio', 'www.example.com']
+
+
+class SyntheticTextBackend(OCRBackend):
+    # Boxes around dark pixels, merged along text lines. An optional fixed
+    # delay per image (BENCH_OCR_DELAY_MS) stands in for model time.
+    def __init__(self, delay_ms=None):
+        self.delay = float(os.environ.get(DELAY_ENV, 0) if delay_ms is None else delay_ms) / 1000
+
+    def readtext(self, image):
+        if self.delay:
+            time.sleep(self.delay)
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        text = (gray < BACKGROUND_MIN // 2).astype(np.uint8)
+        text = cv2.dilate(text, cv2.getStructuringElement(cv2.MORPH_RECT, (15, 5)))
+        _, _, stats, _ = cv2.connectedComponentsWithStats(text, connectivity=8)
+        result = []
+        for x, y, w, h, _ in stats[1:].tolist():
+            result.append(([[x, y], [x + w, y], [x + w, y + h], [x, y + h]], 'text', 1.0))
+        return result
+
+
+_FONTS = {}
+
+
+def load_font(size):
+    if size not in _FONTS:
+        try:
+            _FONTS[size] = ImageFont.load_default(size=size)
+        except TypeError:  # Pillow < 10.1 only has the small bitmap font
+            _FONTS[size] = ImageFont.load_default()
+    return _FONTS[size]
+
+
+def make_image(rng, width, height, boxes):
+    # Smooth noisy background plus `boxes` words, about a third of them in the
+    # border area so --edges has something to keep.
+    background = rng.integers(BACKGROUND_MIN, 256, size=(height // 16 + 1, width // 16 + 1, 3), dtype=np.uint8)
+    image = Image.fromarray(cv2.resize(background, (width, height), interpolation=cv2.INTER_LINEAR))
+    draw = ImageDraw.Draw(image)
+    truth = []
+    for index in range(boxes):
+        font = load_font(int(rng.integers(max(12, height // 40), max(13, height // 12))))
+        word = WORDS[int(rng.integers(len(WORDS)))]
+        left, top, right, bottom = draw.textbbox((0, 0), word, font=font)
+        text_w, text_h = right - left, bottom - top
+        if index % 3 == 0:
+            x = int(rng.choice([rng.integers(0, max(1, width // 10)), rng.integers(max(0, width - width // 10 - text_w), max(1, width - text_w))]))
+        else:
+            x = int(rng.integers(0, max(1, width - text_w)))
+        y = int(rng.integers(0, max(1, height - text_h)))
+        draw.text((x - left, y - top), word, fill=(TEXT_VALUE,) * 3, font=font)
+        truth.append([x, y, x + text_w, y + text_h])
+    return image, truth
+
+
+def make_dataset(folder, images, boxes, size, seed=0):
+    # Reused when the folder already holds the same dataset.
+    width, height = size
+    spec = {'images': images, 'boxes': boxes, 'size': [width, height], 'seed': seed}
+    spec_path = os.path.join(folder, 'dataset.json')
+    if os.path.exists(spec_path):
+        with open(spec_path, 'r', encoding='utf-8') as f:
+            if json.load(f) == spec:
+                return folder
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    truth = {}
+    for index in tqdm(range(images), desc=f"Generating {images} images with {boxes} boxes", leave=False):
+        filename = f"bench_{index:05d}.png"
+        image, truth[filename] = make_image(rng, width, height, boxes)
+        image.save(os.path.join(folder, filename))
+    with open(os.path.join(folder, 'boxes.json'), 'w', encoding='utf-8') as f:
+        json.dump(truth, f)
+    with open(spec_path, 'w', encoding='utf-8') as f:
+        json.dump(spec, f)
+    return folder
+
+
+def run_once(dataset, out_folder, run_args, delay_ms):
+    # One batch_create_masks process over the dataset; returns its metrics.
+    metrics_file = out_folder.rstrip('/\\') + '_metrics.json'
+    command = [
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'batch_create_masks.py'),
+        '--path', dataset, '--out', out_folder, '--overwrite', '--quiet',
+        '--ocr-backend', BACKEND, '--metrics-file', metrics_file,
+    ] + run_args
+    env = dict(os.environ, **{DELAY_ENV: str(delay_ms)})
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)), env.get('PYTHONPATH')]))
+    start = time.perf_counter()
+    subprocess.run(command, check=True, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wall = time.perf_counter() - start
+    with open(metrics_file, 'r', encoding='utf-8') as f:
+        summary = json.load(f)
+    summary['wall_seconds'] = wall
+    return summary
+
+
+def read_masked(out_folder, filename, rle_records):
+    # Boolean array, True where masked, or None when no mask was written.
+    if rle_records is not None:
+        record = rle_records.get(filename)
+        return None if record is None else mask_io.rle_decode(record)
+    for mask_path in (os.path.join(out_folder, filename), os.path.splitext(os.path.join(out_folder, filename))[0] + '.png'):
+        if os.path.exists(mask_path):
+            return np.asarray(Image.open(mask_path).convert('L')) == 0
+    return None
+
+
+def score_masks(dataset, out_folder, size):
+    # Pixel recall and precision of the masks against the drawn text boxes,
+    # summed over the dataset. Precision is None when nothing was masked.
+    with open(os.path.join(dataset, 'boxes.json'), 'r', encoding='utf-8') as f:
+        truth = json.load(f)
+    rle_path = os.path.join(out_folder, mask_io.RLE_FILENAME)
+    rle_records = mask_io.load_rle(rle_path) if os.path.exists(rle_path) else None
+    width, height = size
+    text_pixels = masked_pixels = hit_pixels = 0
+    for filename, boxes in truth.items():
+        text = np.zeros((height, width), dtype=bool)
+        for x1, y1, x2, y2 in boxes:
+            text[y1:y2, x1:x2] = True
+        masked = read_masked(out_folder, filename, rle_records)
+        text_pixels += np.count_nonzero(text)
+        if masked is not None:
+            masked_pixels += np.count_nonzero(masked)
+            hit_pixels += np.count_nonzero(masked & text)
+    return {
+        'mask_recall': hit_pixels / text_pixels if text_pixels else None,
+        'mask_precision': hit_pixels / masked_pixels if masked_pixels else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark batch_create_masks on synthetic images with a deterministic stand-in OCR backend.')
+    parser.add_argument('--work', default='./bench_work', help='Folder for the generated datasets and mask outputs. Datasets are reused between runs.')
+    parser.add_argument('--report', default='bench.json', help='JSON file the results are written to.')
+    parser.add_argument('--images', type=int, nargs='+', default=[50, 200], help='Dataset sizes to run.')
+    parser.add_argument('--boxes', type=int, nargs='+', default=[2, 8, 32], help='Text boxes per image to run.')
+    parser.add_argument('--image-size', default='1024x768', help='Size of the generated images, WIDTHxHEIGHT.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per combination, the report keeps all of them and the median images/sec.')
+    parser.add_argument('--ocr-delay-ms', type=float, default=0, help='Fixed time the stand-in OCR spends per image, to mimic a real model.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the generated datasets.')
+    parser.add_argument('--run', action='append', help='batch_create_masks arguments for one run setting, as one quoted string. Can be given several times. Default runs "--edges --contain" serially and with --workers 2.')
+
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.image_size.lower().split('x'))
+    run_settings = args.run or ['--edges --contain', '--edges --contain --workers 2']
+
+    results = []
+    for images in args.images:
+        for boxes in args.boxes:
+            dataset = make_dataset(os.path.join(args.work, f"data_{images}_{boxes}_{width}x{height}_{args.seed}"), images, boxes, (width, height), args.seed)
+            for index, run in enumerate(run_settings):
+                runs = []
+                for _ in range(args.repeat):
+                    out_folder = os.path.join(args.work, f"out_{images}_{boxes}_{index}")
+                    runs.append(run_once(dataset, out_folder, run.split(), args.ocr_delay_ms))
+                rates = sorted(run_summary['images_per_second'] for run_summary in runs)
+                entry = {
+                    'images': images,
+                    'boxes': boxes,
+                    'run': run,
+                    'median_images_per_second': rates[len(rates) // 2],
+                }
+                # Every repeat writes the same masks, the last one is scored.
+                entry.update(score_masks(dataset, out_folder, (width, height)))
+                entry['runs'] = runs
+                results.append(entry)
+                recall, precision = entry['mask_recall'], entry['mask_precision']
+                tqdm.write(
+                    f"{images} images, {boxes} boxes, [{run}]: {entry['median_images_per_second']:.2f} images/s, "
+                    f"mask recall {'-' if recall is None else f'{recall:.3f}'}, precision {'-' if precision is None else f'{precision:.3f}'}"
+                )
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'image_size': [width, height],
+        'ocr_delay_ms': args.ocr_delay_ms,
+        'seed': args.seed,
+        'results': results,
+    }
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    tqdm.write(f"Saved {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,51 +1,79 @@
 import os
-import shutil
+import sys
 import argparse
 
-def handle_files(path, maskpath, moveoutpath, unmaskedpath, delete_flag):
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from file_transfer import TRANSFER_WORKERS, add_transfer_args
+from bulk_ops import add_bulk_args, journal_command, plan_ops, print_plan, report, run_plan
+from dataset_index import DatasetIndex, add_index_args, open_index
+
+IMAGE_EXTS = ['png', 'jpg', 'jpeg', 'bmp', 'tif', 'tiff', 'webp']
+
+def handle_files(path, maskpath, moveoutpath, unmaskedpath, delete_flag, on_collision='overwrite', transfer_workers=TRANSFER_WORKERS, index=None, journal=None, dry_run=False, trash=False):
     # Create directories if they do not exist
-    if moveoutpath and not os.path.exists(moveoutpath):
+    if moveoutpath and not dry_run and not os.path.exists(moveoutpath):
         os.mkdir(moveoutpath)
-    if unmaskedpath and not os.path.exists(unmaskedpath):
+    if unmaskedpath and not dry_run and not os.path.exists(unmaskedpath):
         os.mkdir(unmaskedpath)
 
-    # List of image files in maskpath
-    masked_files = set(os.listdir(maskpath))
-    
-    for filename in os.listdir(path):
-        original_file = os.path.join(path, filename)
+    # Images paired with their masks (same stem, so png1 masks of .jpg images
+    # count) and captions by the dataset index. A caption goes wherever its
+    # image goes.
+    index = index or DatasetIndex(':memory:')
+    records = index.records(path, IMAGE_EXTS, mask_folder=maskpath)
+    # Planned first, then run by bulk_ops with a journal for --resume and --undo
+    ops = []
+
+    for record in records.values():
+        files = [record['image']] + ([record['caption']] if record['caption'] else [])
 
-        # File exists in both path and maskpath
-        if filename in masked_files:
+        # Image has a mask in maskpath
+        if record['mask']:
             if moveoutpath:
-                shutil.move(original_file, os.path.join(moveoutpath, filename))
+                ops.extend(('move', file, os.path.join(moveoutpath, os.path.basename(file))) for file in files)
 
-        # File does not exist in maskpath
+        # Image has no mask
         else:
             if delete_flag:
-                os.remove(original_file)
-                print(f"Deleted image without matching mask: {filename}")
+                ops.extend(('delete', file, None) for file in files)
             elif unmaskedpath:
-                shutil.move(original_file, os.path.join(unmaskedpath, filename))
+                ops.extend(('move', file, os.path.join(unmaskedpath, os.path.basename(file))) for file in files)
+
+    run_id, planned = plan_ops(ops, on_collision)
+    if dry_run:
+        print_plan(planned)
+    elif planned:
+        report(run_plan(planned, run_id, journal, transfer_workers, trash))
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--path', required=True, help='Path to the source directory of images.')
-    parser.add_argument('--moveout', action='store_true' help='Move images to path_moveout, if they have a matching mask.')
+    parser.add_argument('--moveout', action='store_true', help='Move images to path_moveout, if they have a matching mask.')
     parser.add_argument('--maskpath', help='Path to the directory of masked images.')
     parser.add_argument('--delete', action='store_true', help='Delete flag for destructive action.')
+    add_transfer_args(parser, link_mode=False)
+    parser.add_argument('--dry-run', action='store_true', help='Only print what would be done, without making changes.')
+    add_index_args(parser)
+    add_bulk_args(parser, workers=False)
 
     args = parser.parse_args()
 
+    if journal_command(args):
+        exit()
+
     # Update moveoutpath, unmaskedpath, and maskpath based on path
-    moveoutpath = args.moveoutpath if args.moveoutpath else args.path + '_moveout'
+    moveoutpath = args.path.rstrip('/') + '_moveout' if args.moveout else None
     unmaskedpath = args.path.rstrip('/') + '_unmasked'
     maskpath = args.maskpath if args.maskpath else args.path + '_masked'
 
-    if args.delete:
-        user_input = input("WARNING! This is a destructive action, and will delete training images without a matching image mask. Are you sure you wish to continue? Type YES in all caps to continue: ")
+    if args.delete and not args.dry_run:
+        if args.trash:
+            action = "move training images without a matching image mask (and their captions) into a trash folder next to the run's journal, where --undo can restore them until you remove it"
+        else:
+            action = "permanently delete training images without a matching image mask (and their captions); add --trash to keep them for --undo"
+        user_input = input(f"WARNING! This is a destructive action, and will {action}. Are you sure you wish to continue? Type YES in all caps to continue: ")
         if user_input != "YES":
             print("Aborting.")
             exit()
 
-    handle_files(args.path, maskpath, moveoutpath, unmaskedpath, args.delete)
+    handle_files(args.path, maskpath, moveoutpath, unmaskedpath, args.delete, args.on_collision, args.transfer_workers, open_index(args), args.journal, args.dry_run, args.trash)
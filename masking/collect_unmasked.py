@@ -2,13 +2,19 @@
 
 import argparse
 import os
-import shutil
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from file_transfer import add_transfer_args, report_failures, transfer_many
+from dataset_index import add_index_args, open_index
 
 def collect_unmasked():
     parser = argparse.ArgumentParser()
     parser.add_argument("--mask-path", "-i", required=True, help="Path to the input images")
     parser.add_argument("--masked-images-path", "-o", required=True, help="Path to the masked images")
     parser.add_argument("--copyto", "-c", required=True, help="Directory to copy images")
+    add_transfer_args(parser)
+    add_index_args(parser)
     
     args = parser.parse_args()
     
@@ -16,32 +22,37 @@ def collect_unmasked():
     masked_images_path = args.masked_images_path
     copy_to = args.copyto
 
-    mask_files = set(os.path.splitext(f)[0] for f in os.listdir(mask_path) if os.path.isfile(os.path.join(mask_path, f)))
-    masked_files = set(os.path.splitext(f)[0] for f in os.listdir(masked_images_path) if os.path.isfile(os.path.join(masked_images_path, f)))
+    # stem -> {extension: file name}, from the dataset index
+    index = open_index(args)
+    mask_stems = index.stems(mask_path)
+    mask_files = set(mask_stems)
+    masked_files = set(index.stems(masked_images_path))
 
     unmasked_files = mask_files - masked_files
     print(f"Found {len(unmasked_files)} unmasked files")
 
     possible_extensions = ['jpg', 'jpeg', 'png']
+    transfers = []
 
     for file in unmasked_files:
         src_path = None
         for ext in possible_extensions:
             # Check for both lowercase and uppercase extensions
             for case_ext in [ext, ext.upper()]:
-                tentative_path = os.path.join(mask_path, f"{file}.{case_ext}")
-                if os.path.isfile(tentative_path):
-                    src_path = tentative_path
+                if case_ext in mask_stems[file]:
+                    src_path = os.path.join(mask_path, mask_stems[file][case_ext])
                     break
             if src_path:
                 break
 
         if src_path:
             dest_path = os.path.join(copy_to, f"{file}{os.path.splitext(src_path)[1]}")
-            shutil.copy2(src_path, dest_path)
+            transfers.append((src_path, dest_path))
         else:
             print(f"Could not find a matching file for {file}")
 
+    report_failures(transfer_many(transfers, args.link_mode, args.on_collision, args.transfer_workers))
+
 
 if __name__ == "__main__":
     collect_unmasked()
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import sqlite3
+
+# On-disk store of OCR detections, keyed by the image's content hash plus the
+# settings that change what the OCR engine sees. Anything applied after OCR
+# (--min-area, --max-area, --contain, --edges, ...) is not part of the key, so
+# re-tuning those only re-runs draw_boxes.
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def bytes_digest(data):
+    # Same digest file_digest gives for a file holding these bytes.
+    return hashlib.sha256(data).hexdigest()
+
+
+def _plain(value):
+    # easyocr hands back numpy scalars; store plain ints/floats.
+    return value.item() if hasattr(value, 'item') else value
+
+
+def serialize_result(result):
+    return json.dumps([
+        [[[_plain(v) for v in point] for point in detection[0]], detection[1], _plain(detection[2])]
+        for detection in result
+    ])
+
+
+def deserialize_result(data):
+    return [(box, text, confidence) for box, text, confidence in json.loads(data)]
+
+
+class DetectionCache:
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS detections ("
+            " digest TEXT NOT NULL,"
+            " settings TEXT NOT NULL,"
+            " width INTEGER NOT NULL,"
+            " height INTEGER NOT NULL,"
+            " result TEXT NOT NULL,"
+            " PRIMARY KEY (digest, settings))"
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def settings_key(settings):
+        return json.dumps(settings, sort_keys=True)
+
+    def get(self, digest, settings):
+        # Returns ((width, height), result) or None.
+        row = self.connection.execute(
+            "SELECT width, height, result FROM detections WHERE digest = ? AND settings = ?",
+            (digest, self.settings_key(settings)),
+        ).fetchone()
+        if row is None:
+            return None
+        width, height, data = row
+        return (width, height), deserialize_result(data)
+
+    def put(self, digest, settings, size, result):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO detections (digest, settings, width, height, result) VALUES (?, ?, ?, ?, ?)",
+            (digest, self.settings_key(settings), size[0], size[1], serialize_result(result)),
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+_CACHES = {}
+
+
+def get_detection_cache(path):
+    # One connection per process and file, shared by every image it handles.
+    if path not in _CACHES:
+        _CACHES[path] = DetectionCache(path)
+    return _CACHES[path]
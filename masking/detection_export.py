@@ -0,0 +1,185 @@
+import json
+import os
+import socket
+
+from run_journal import settings_hash
+
+# Detections of every processed image, written as a dataset for analysis
+# rather than one sidecar per image:
+#
+#   <folder>/images/part-*      one row per image: size, detection count,
+#                               whether a mask was written, settings id
+#   <folder>/detections/part-*  one row per detection: bounds, box corners,
+#                               text and confidence
+#
+# Images are keyed by their name relative to where they were read from: the
+# file name in the input folder, or the member name in the tar shard given in
+# the shard column. Exported images always have their text recognized.
+#   <folder>/settings/<id>.json the settings each settings id stands for
+#
+# Parts are JSONL or Parquet. Every process writes its own parts (host and pid
+# in the name), so --workers, --shard and --claim runs never share a file, and
+# the whole folder loads in one read with pyarrow.dataset, pandas or duckdb.
+# Rows are buffered and flushed every FLUSH_ROWS rows. JSONL parts are
+# appended to as they go (readers drop a line cut short by a crash); a Parquet
+# part is written under a hidden name and renamed into place when closed.
+
+EXPORT_FORMATS = ('jsonl', 'parquet')
+TABLES = ('images', 'detections')
+FLUSH_ROWS = 50000
+
+COLUMNS = {
+    'images': [
+        ('image', 'string'), ('shard', 'string'), ('width', 'int32'), ('height', 'int32'),
+        ('detections', 'int32'), ('masked', 'bool'), ('digest', 'string'), ('settings', 'string'),
+    ],
+    'detections': [
+        ('image', 'string'), ('shard', 'string'), ('index', 'int32'),
+        ('x_min', 'float32'), ('y_min', 'float32'), ('x_max', 'float32'), ('y_max', 'float32'),
+        ('box', 'list<float32>'), ('text', 'string'), ('confidence', 'float32'), ('settings', 'string'),
+    ],
+}
+
+
+def arrow_schema(table):
+    import pyarrow as pa
+    types = {
+        'string': pa.string(), 'int32': pa.int32(), 'float32': pa.float32(),
+        'bool': pa.bool_(), 'list<float32>': pa.list_(pa.float32()),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in COLUMNS[table]])
+
+
+def detection_rows(image, shard, result, settings_id):
+    rows = []
+    for index, (box, text, confidence) in enumerate(result):
+        xs = [float(point[0]) for point in box]
+        ys = [float(point[1]) for point in box]
+        rows.append({
+            'image': image,
+            'shard': shard,
+            'index': index,
+            'x_min': min(xs),
+            'y_min': min(ys),
+            'x_max': max(xs),
+            'y_max': max(ys),
+            'box': [value for point in zip(xs, ys) for value in point],
+            # Only a result that was never recognized has no text.
+            'text': None if confidence is None else text,
+            'confidence': None if confidence is None else float(confidence),
+            'settings': settings_id,
+        })
+    return rows
+
+
+class DetectionExport:
+    def __init__(self, folder, export_format='jsonl', flush_rows=FLUSH_ROWS):
+        self.folder = folder
+        self.format = export_format
+        self.flush_rows = flush_rows
+        self.prefix = f"part-{socket.gethostname()}-{os.getpid()}"
+        self.part = 0
+        self.rows = {table: [] for table in TABLES}
+        self.writers = {}
+        self.settings_written = set()
+        for table in TABLES + ('settings',):
+            os.makedirs(os.path.join(folder, table), exist_ok=True)
+
+    def add(self, image, size, result, masked, settings, digest=None, shard=None):
+        settings_id = settings_hash(settings)[:16]
+        if settings_id not in self.settings_written:
+            self._write_settings(settings_id, settings)
+        width, height = size
+        self.rows['images'].append({
+            'image': image,
+            'shard': shard,
+            'width': width,
+            'height': height,
+            'detections': len(result),
+            'masked': masked,
+            'digest': digest,
+            'settings': settings_id,
+        })
+        self.rows['detections'].extend(detection_rows(image, shard, result, settings_id))
+        if sum(len(rows) for rows in self.rows.values()) >= self.flush_rows:
+            self.flush()
+
+    def _write_settings(self, settings_id, settings):
+        path = os.path.join(self.folder, 'settings', settings_id + '.json')
+        if not os.path.exists(path):
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(settings, f, indent=2, sort_keys=True)
+            os.replace(temp_path, path)
+        self.settings_written.add(settings_id)
+
+    def _part_path(self, table):
+        return os.path.join(self.folder, table, f"{self.prefix}-{self.part:05d}.{self.format}")
+
+    def flush(self):
+        for table, rows in self.rows.items():
+            if not rows:
+                continue
+            if self.format == 'parquet':
+                self._write_parquet(table, rows)
+            else:
+                with open(self._part_path(table), 'a', encoding='utf-8') as f:
+                    for row in rows:
+                        f.write(json.dumps(row) + '\n')
+        self.rows = {table: [] for table in TABLES}
+
+    def _write_parquet(self, table, rows):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema = arrow_schema(table)
+        if table not in self.writers:
+            # Leading dot: dataset readers skip the part until it is complete.
+            final_path = self._part_path(table)
+            temp_path = os.path.join(os.path.dirname(final_path), '.' + os.path.basename(final_path))
+            self.writers[table] = (pq.ParquetWriter(temp_path, schema), temp_path, final_path)
+        self.writers[table][0].write_table(pa.Table.from_pylist(rows, schema=schema))
+
+    def close(self):
+        # Ends the current parts; anything added later goes to new ones.
+        self.flush()
+        for writer, temp_path, final_path in self.writers.values():
+            writer.close()
+            os.replace(temp_path, final_path)
+        self.writers = {}
+        self.part += 1
+
+
+_EXPORTS = {}
+
+
+def get_detection_export(folder, export_format='jsonl'):
+    key = (folder, export_format)
+    if key not in _EXPORTS:
+        _EXPORTS[key] = DetectionExport(folder, export_format)
+    return _EXPORTS[key]
+
+
+def close_detection_exports():
+    for export in _EXPORTS.values():
+        export.close()
+
+
+def load_export(folder, table='detections'):
+    # All rows of one table as a list of dicts, from JSONL or Parquet parts.
+    rows = []
+    table_folder = os.path.join(folder, table)
+    for name in sorted(os.listdir(table_folder)):
+        path = os.path.join(table_folder, name)
+        if name.startswith('.'):
+            continue
+        if name.endswith('.parquet'):
+            import pyarrow.parquet as pq
+            rows.extend(pq.read_table(path).to_pylist())
+        elif name.endswith('.jsonl'):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        rows.append(json.loads(line))
+                    except ValueError:
+                        continue
+    return rows
@@ -1,8 +1,16 @@
 import argparse
+import json
 import os
-from PIL import Image, UnidentifiedImageError
-import shutil
-import Levenshtein
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+
+from mask_index import MaskIndex
+from perceptual_hash import HASH_METHODS, FrameIndex, file_hash
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from file_transfer import TRANSFER_WORKERS, add_transfer_args, report_failures, transfer_many
+from dataset_index import PROBE_WORKERS, DatasetIndex, add_index_args, open_index
 
 # def main(image_path, mask_path):
 #     image_files = [f for f in os.listdir(image_path) if f.endswith(('jpg', 'png', 'jpeg'))]
@@ -46,43 +54,101 @@ import Levenshtein
 #     args = parser.parse_args()
 #     main(args.path, args.out)
 
-def main(image_path, mask_path):
-    image_files = [f for f in os.listdir(image_path) if f.lower().endswith(('jpg', 'png', 'jpeg'))]
-    mask_files = [f for f in os.listdir(mask_path) if f.lower().endswith(('jpg', 'png', 'jpeg'))]
-    mask_dimensions = {}
-    
-    for mask in mask_files:
-        try:
-            with Image.open(os.path.join(mask_path, mask)) as img:
-                dimensions = img.size
-            mask_dimensions.setdefault(dimensions, []).append(mask)
-        except UnidentifiedImageError:
+def hash_files(folder, files, method, workers=PROBE_WORKERS):
+    # cv2 decodes without holding the GIL, so threads hash in parallel.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        hashes = executor.map(lambda f: file_hash(os.path.join(folder, f), method), files)
+        return dict(zip(files, hashes))
+
+
+def main(image_path, mask_path, candidates=1, report=None, probe_workers=PROBE_WORKERS, hash_distance=None, hash_method='phash', hash_only=False, link_mode='copy', on_collision='overwrite', transfer_workers=TRANSFER_WORKERS, index=None):
+    # Listings and image sizes come from the dataset index, which only reads
+    # what changed since the last run.
+    index = index or DatasetIndex(':memory:')
+    image_files = [f for f in index.names(image_path) if f.lower().endswith(('jpg', 'png', 'jpeg'))]
+    mask_files = [f for f in index.names(mask_path) if f.lower().endswith(('jpg', 'png', 'jpeg'))]
+    mask_names = set(mask_files)
+
+    mask_index = MaskIndex()
+    for mask, dimensions in index.sizes(mask_path, mask_files, probe_workers).items():
+        if dimensions is not None:
+            mask_index.add(dimensions, mask)
+
+    unmasked = [image for image in image_files if image not in mask_names]
+    image_dimensions = index.sizes(image_path, unmasked, probe_workers)
+    guesses = []
+    transfers = []
+
+    # With --hash-distance, masked images are hashed and indexed so an
+    # unmasked frame can take the mask of a near-identical one, whatever
+    # it is called.
+    frame_index = None
+    if hash_distance is not None:
+        masked = [image for image in image_files if image in mask_names]
+        masked_dimensions = index.sizes(image_path, masked, probe_workers)
+        frame_index = FrameIndex(hash_distance, hash_method)
+        for image, value in hash_files(image_path, masked, hash_method, probe_workers).items():
+            if value is not None and masked_dimensions[image] is not None:
+                frame_index.add(masked_dimensions[image], value, image)
+        image_hashes = hash_files(image_path, [image for image in unmasked if image_dimensions[image] is not None], hash_method, probe_workers)
+
+    for image in unmasked:
+        dimensions = image_dimensions[image]
+        if dimensions is None:
             continue
+        match = None
+        if frame_index is not None and image_hashes[image] is not None:
+            match = frame_index.nearest(dimensions, image_hashes[image])
+        nearest = [] if hash_only else mask_index.nearest(dimensions, image, candidates)
+        guesses.append({
+            'image': image,
+            'dimensions': list(dimensions),
+            'hash_match': {'mask': match[1], 'distance': match[0]} if match else None,
+            'candidates': [{'mask': mask, 'distance': distance} for distance, mask in nearest],
+        })
+        if match:
+            source_mask = os.path.join(mask_path, match[1])
+            transfers.append((source_mask, os.path.join(mask_path, image)))
+            print(f"Guessed mask for {image} from near-duplicate frame {match[1]} (hash distance {match[0]}), saved as {image}")
+        elif nearest:
+            closest_mask = nearest[0][1]
+            source_mask = os.path.join(mask_path, closest_mask)
+
+            # Copy the mask to the mask directory, but rename it according to the original image
+            target_mask = os.path.join(mask_path, image)
+            transfers.append((source_mask, target_mask))
+
+            print(f"Guessed mask for {image} was {closest_mask}, saved as {image}")
+            if candidates > 1:
+                print(f"Candidates: {', '.join(f'{mask} ({distance})' for distance, mask in nearest)}")
+        else:
+            print(f"Could not guess mask for {image}")
+            print(f"Dimensions: {dimensions}")
+
+    # Masks are copied (or linked) together at the end, in parallel.
+    report_failures(transfer_many(transfers, link_mode, on_collision, transfer_workers, preserve=False))
 
-    for image in image_files:
-        if image not in mask_files:
-            try:
-                with Image.open(os.path.join(image_path, image)) as img:
-                    dimensions = img.size
-                if dimensions in mask_dimensions:
-                    closest_mask = min(mask_dimensions[dimensions], key=lambda m: Levenshtein.distance(image, m))
-                    source_mask = os.path.join(mask_path, closest_mask)
-
-                    # Copy the mask to the mask directory, but rename it according to the original image
-                    target_mask = os.path.join(mask_path, image)
-                    shutil.copy(source_mask, target_mask)
-
-                    print(f"Guessed mask for {image} was {closest_mask}, saved as {image}")
-                else:
-                    print(f"Could not guess mask for {image}")
-                    print(f"Dimensions: {dimensions}")
-            except UnidentifiedImageError:
-                continue
+    if report:
+        with open(report, 'w', encoding='utf-8') as f:
+            json.dump(guesses, f, indent=2)
+        print(f"Saved {report}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Mask guessing utility.")
     parser.add_argument('--path', required=True, help="Path to the directory containing the images.")
     parser.add_argument('--out', required=True, help="Path to the directory containing the masks.")
+    parser.add_argument('--candidates', type=int, default=1, help="Number of closest masks (by filename edit distance) to list for each image. The closest one is used. Default is 1.")
+    parser.add_argument('--report', help="Write each image's dimensions and candidate masks with their distances to this JSON file.")
+    parser.add_argument('--probe-workers', type=int, default=PROBE_WORKERS, help="Threads reading image headers for their dimensions (and hashing images). Default is 16.")
+    parser.add_argument('--hash-distance', type=int, help="Give each unmasked image the mask of the masked image with the same dimensions whose perceptual hash is within this many bits (of 64), before falling back to filenames. Around 6 catches recompressed and lightly edited frames.")
+    parser.add_argument('--hash-method', default='phash', choices=HASH_METHODS, help="Use with --hash-distance. phash (DCT, default) or dhash (gradients, faster).")
+    add_transfer_args(parser)
+    add_index_args(parser)
+    parser.add_argument('--hash-only', action='store_true', help="Use with --hash-distance. Don't fall back to the closest filename when no frame is close enough.")
 
     args = parser.parse_args()
-    main(args.path, args.out)
\ No newline at end of file
+    if args.candidates < 1:
+        parser.error('--candidates must be at least 1')
+    if args.hash_only and args.hash_distance is None:
+        parser.error('--hash-only needs --hash-distance')
+    main(args.path, args.out, args.candidates, args.report, args.probe_workers, args.hash_distance, args.hash_method, args.hash_only, args.link_mode, args.on_collision, args.transfer_workers, open_index(args))
\ No newline at end of file
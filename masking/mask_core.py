@@ -0,0 +1,940 @@
+import os
+import contextlib
+import io
+import posixpath
+import cv2
+from PIL import Image
+import numpy as np
+import math
+from ocr_engine import get_engine, needs_recognition
+from detection_cache import bytes_digest, file_digest, get_detection_cache
+from preprocess_cache import CACHE_MAX_MB, cache_key, get_preprocess_cache
+from run_journal import NO_MASK, WRITTEN, get_run_journal
+from detection_export import close_detection_exports, get_detection_export
+import mask_io
+import ocr_regions
+import text_prefilter
+import metrics
+import perceptual_hash
+import scaled_detect
+import shards
+import work_claims
+
+# Everything batch_create_masks does to one image or batch, without the
+# command line. The pipeline workers, the sweep and the report tools import
+# this module rather than the script, which is __main__ when it runs.
+
+KEEP_BOXES = 1
+MAX_COMBINATIONS = 2**15
+CONTAIN_TOLERANCE = 1e-3
+BORDER_MARGIN = 64
+TILE_OVERLAP = 128
+TILE_BYTES_PER_PIXEL = 64  # rough peak memory of the text detector per input pixel
+
+# The helpers below work on plain numbers and on NumPy arrays of boxes alike.
+
+def is_touching_edges(x1, y1, x2, y2, img_width, img_height, xpad, ypad):
+    return (x1 <= xpad) | (y1 <= ypad) | (x2 >= img_width - xpad) | (y2 >= img_height - ypad)
+
+def is_touching_corners(x1, y1, x2, y2, img_width, img_height, xpad, ypad):
+    corners = [(xpad, ypad), (img_width - xpad, ypad), (xpad, img_height - ypad), (img_width - xpad, img_height - ypad)]
+    touching = False
+    for cx, cy in corners:
+        touching = touching | ((x1 <= cx) & (cx <= x2) & (y1 <= cy) & (cy <= y2))
+    return touching
+
+def calculate_area(x1, y1, x2, y2):
+    return (x2 - x1) * (y2 - y1)
+
+def calculate_area_percentage(area, total_area):
+    return (area / total_area) * 100
+
+def nCr(n, r):
+    return math.comb(n, r)
+
+def load_image(image_path, use_color, use_cache, cache_folder, use_binary, cache_max_mb=CACHE_MAX_MB, digest=None, data=None):
+    # One decode per image. The returned array (RGB, or single-channel
+    # grayscale) goes to the OCR engine as is, and its shape gives the size
+    # used for box settings and the mask. With data (the file's bytes, e.g.
+    # from a shard) nothing is read from image_path.
+    with metrics.stage('preprocess'):
+        if use_color:
+            ocr_input = decode_image(image_path, cv2.IMREAD_COLOR, data)
+            return cv2.cvtColor(ocr_input, cv2.COLOR_BGR2RGB, dst=ocr_input)
+        return read_grayscale_image(image_path, use_cache, cache_folder, use_binary, cache_max_mb, digest, data)
+
+
+def decode_image(image_path, flags, data=None):
+    # Orientation is ignored so sizes match the file header (see probe_size).
+    flags |= cv2.IMREAD_IGNORE_ORIENTATION
+    with metrics.stage('decode'):
+        if data is None:
+            image = cv2.imread(image_path, flags)
+        else:
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+    if image is None:
+        raise ValueError(f"Could not read image {image_path}")
+    return image
+
+
+def probe_size(image_path, data=None):
+    # (width, height) from the file header, without decoding any pixels.
+    with Image.open(image_path if data is None else io.BytesIO(data)) as image:
+        return image.size
+
+
+def image_size(ocr_input):
+    return ocr_input.shape[1], ocr_input.shape[0]
+
+
+def read_image(image_path, use_color, use_cache, cache_folder, use_binary, engine=None):
+    if engine is None:
+        engine = get_engine()
+
+    ocr_input = load_image(image_path, use_color, use_cache, cache_folder, use_binary)
+    result = engine.readtext(ocr_input)
+
+    return ocr_input, result
+
+
+def read_grayscale_image(image_path, use_cache, cache_folder, use_binary, cache_max_mb=CACHE_MAX_MB, digest=None, data=None):
+    if use_cache:
+        cache = get_preprocess_cache(cache_folder, cache_max_mb * 2**20)
+        if digest is None:
+            digest = file_digest(image_path) if data is None else bytes_digest(data)
+        key = cache_key(digest, {'grayscale': True, 'use_binary': bool(use_binary)})
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+        
+    img = decode_image(image_path, cv2.IMREAD_COLOR, data)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    
+    if use_binary:
+        _, gray = cv2.threshold(gray, 128, 255, cv2.THRESH_BINARY)
+    
+    if use_cache:
+        cache.put(key, gray)
+    
+    return gray
+
+
+def prepare_boxes(size, **kwargs):
+    width, height = size
+    total_area = width * height
+    # If xpad_detect is None or not found, set it to 5% of the width
+    xpad_detect = kwargs.get('xpad_detect')
+    if xpad_detect is None:
+        xpad_detect = int(width * 0.05)
+
+    # If ypad_detect is None or not found, set it to 5% of the height
+    ypad_detect = kwargs.get('ypad_detect')
+    if ypad_detect is None:
+        ypad_detect = int(height * 0.05)
+
+    return {
+        'total_area': total_area,
+        'width': width,
+        'height': height,
+        'xpad_detect': xpad_detect,
+        'ypad_detect': ypad_detect,
+    }
+
+
+def detections_to_array(result):
+    # (N, 4) array of x1, y1, x2, y2 taken from each detection's top-left and
+    # bottom-right corners.
+    boxes = np.array([(d[0][0][0], d[0][0][1], d[0][2][0], d[0][2][1]) for d in result])
+    return boxes.reshape(-1, 4)
+
+
+def fill_rects(mask, rects, value):
+    # Fill rectangles the way ImageDraw.rectangle does: coordinates are
+    # truncated to ints, both ends are inclusive and anything outside the mask
+    # is clipped.
+    with metrics.stage('render'):
+        rects = np.trunc(np.asarray(rects, dtype=np.float64).reshape(-1, 4)).astype(np.int64)
+        height, width = mask.shape[:2]
+        rects[:, [0, 2]] = np.clip(rects[:, [0, 2]], -1, width)
+        rects[:, [1, 3]] = np.clip(rects[:, [1, 3]], -1, height)
+        for x1, y1, x2, y2 in rects.tolist():
+            if x2 >= x1 and y2 >= y1:
+                mask[max(y1, 0):y2 + 1, max(x1, 0):x2 + 1] = value
+
+
+def union_areas(rect, boxes):
+    # Area of the bounding rectangle of rect and each box in boxes.
+    return (
+        (np.maximum(rect[2], boxes[:, 2]) - np.minimum(rect[0], boxes[:, 0]))
+        * (np.maximum(rect[3], boxes[:, 3]) - np.minimum(rect[1], boxes[:, 1]))
+    )
+
+
+def find_contain_rect(detected_boxes, max_area_px, max_nodes=None):
+    # Largest rectangle enclosing a group of two or more boxes whose area stays
+    # within max_area_px, or None if no group fits.
+    #
+    # The search is branch-and-bound over enclosing rectangles. Growing a group
+    # never shrinks its rectangle, so a box that already pushes the current
+    # rectangle over the limit can be dropped from the whole branch, and the
+    # rectangle around every box still compatible with it bounds what the
+    # branch can reach. When that bound itself fits, it is the branch's answer.
+    # max_nodes caps the number of rectangles expanded; pairs are checked up
+    # front, so running out of budget is no worse than the old pair-only search.
+    # Both stop early once a group is within CONTAIN_TOLERANCE of the limit.
+    if max_nodes is None:
+        max_nodes = MAX_COMBINATIONS
+    boxes = np.asarray(detected_boxes, dtype=np.float64).reshape(-1, 4)
+    boxes = boxes[np.lexsort((boxes[:, 1], boxes[:, 0]))]  # sweep left to right
+    if len(boxes) < 2:
+        return None
+
+    best_rect = None
+    best_area = -1.0
+
+    for i in range(len(boxes) - 1):
+        if max_area_px <= best_area * (1 + CONTAIN_TOLERANCE):
+            break
+        areas = union_areas(boxes[i], boxes[i + 1:])
+        areas[areas > max_area_px] = -1
+        j = int(np.argmax(areas))
+        if areas[j] > best_area:
+            other = boxes[i + 1 + j]
+            best_area = float(areas[j])
+            best_rect = (
+                min(boxes[i][0], other[0]), min(boxes[i][1], other[1]),
+                max(boxes[i][2], other[2]), max(boxes[i][3], other[3]),
+            )
+
+    stack = [tuple(box) for box in boxes[::-1].tolist()]
+    visited = set()
+    while stack and len(visited) < max_nodes:
+        rect = stack.pop()
+        if rect in visited:
+            continue
+        visited.add(rect)
+        rect_area = calculate_area(*rect)
+        if rect_area > max_area_px:
+            continue
+
+        inside = (
+            (boxes[:, 0] >= rect[0]) & (boxes[:, 1] >= rect[1])
+            & (boxes[:, 2] <= rect[2]) & (boxes[:, 3] <= rect[3])
+        )
+        if np.count_nonzero(inside) >= 2 and rect_area > best_area:
+            best_area, best_rect = rect_area, rect
+
+        areas = union_areas(rect, boxes)
+        compatible = areas <= max_area_px
+        bound = (
+            min(rect[0], boxes[compatible, 0].min()), min(rect[1], boxes[compatible, 1].min()),
+            max(rect[2], boxes[compatible, 2].max()), max(rect[3], boxes[compatible, 3].max()),
+        )
+        bound_area = calculate_area(*bound)
+        if bound_area <= max_area_px:
+            if np.count_nonzero(compatible) >= 2 and bound_area > best_area:
+                best_area, best_rect = bound_area, bound
+            continue
+        if max_area_px <= best_area * (1 + CONTAIN_TOLERANCE):
+            break
+
+        # Push the smallest growth first so the largest is expanded next.
+        candidates = np.flatnonzero(compatible & ~inside)
+        candidates = candidates[np.argsort(areas[candidates], kind='stable')]
+        children = np.stack([
+            np.minimum(rect[0], boxes[candidates, 0]), np.minimum(rect[1], boxes[candidates, 1]),
+            np.maximum(rect[2], boxes[candidates, 2]), np.maximum(rect[3], boxes[candidates, 3]),
+        ], axis=1)
+        stack.extend(map(tuple, children.tolist()))
+
+    return best_rect
+
+
+def sum_in_order(values):
+    # Add up like the old per-detection loop did, so threshold checks on the
+    # total come out exactly the same.
+    return sum(values.tolist(), 0)
+
+
+def draw_boxes(result, mask, **kwargs):
+    # Fills detections into mask, a (height, width) uint8 array where 0 is
+    # masked (black) and 255 is kept (white).
+    total_masked_area_percent = 0
+
+    min_area = kwargs.get('min_area', 0.1)  # Default value if not passed
+    max_area = kwargs.get('max_area', 10)  # Default value if not passed
+    only_largest = kwargs.get('only_largest', False)  # Default value if not passed
+    contain_bounding_boxes = kwargs.get('contain_bounding_boxes', False)  # Default value if not passed
+    text_direction = kwargs.get('text_direction', 'horizontal')  # Default value if not passed
+    xpad_box = kwargs.get('xpad_box', 0)  # Default value if not passed
+    ypad_box = kwargs.get('ypad_box', 0)  # Default value if not passed
+    corners = kwargs.get('corners', False)  # Default value if not passed
+    edges = kwargs.get('edges', False)  # Default value if not passed
+    xpad_detect = kwargs.get('xpad_detect')  # Assuming this is in box_settings
+    ypad_detect = kwargs.get('ypad_detect')  # Assuming this is in box_settings
+    width = kwargs.get('width')  # Assuming this is in box_settings
+    height = kwargs.get('height')  # Assuming this is in box_settings
+    total_area = kwargs.get('total_area')  # Assuming this is in box_settings
+    was_mask_created = False
+
+    boxes = detections_to_array(result)
+    x1, y1, x2, y2 = boxes.T
+    box_width = x2 - x1
+    box_height = y2 - y1
+
+    # Square boxes pass either orientation.
+    keep = np.ones(len(boxes), dtype=bool)
+    if text_direction == 'horizontal':
+        keep &= box_width >= box_height
+    elif text_direction == 'vertical':
+        keep &= box_width <= box_height
+
+    area = box_width * box_height
+    area_percent = (area / total_area) * 100
+    in_range = (area_percent >= min_area) & (area_percent <= max_area)
+    rejected = np.count_nonzero(keep & ~in_range)
+    if rejected:
+        print(f"\n{rejected} detections had an area percentage outside the range of {min_area} and {max_area}.")
+    keep &= in_range
+
+    detected_boxes = boxes[:0]
+    if corners:
+        if not edges:
+            keep &= is_touching_corners(x1, y1, x2, y2, width, height, xpad_detect, ypad_detect)
+            detected_boxes = boxes[keep]
+    elif edges:
+        # Boxes near a border are stretched out to it.
+        extended = np.stack([
+            np.where(x1 <= xpad_detect, 0, x1),
+            np.where(y1 <= ypad_detect, 0, y1),
+            np.where(x2 >= (width - xpad_detect), width, x2),
+            np.where(y2 >= (height - ypad_detect), height, y2),
+        ], axis=1).reshape(-1, 4)
+        extended_area_percent = calculate_area_percentage(calculate_area(*extended.T), total_area)
+        extended_in_range = (extended_area_percent >= min_area) & (extended_area_percent <= max_area)
+        rejected = np.count_nonzero(keep & ~extended_in_range)
+        if rejected:
+            print(f"\n{rejected} extended detections had an area percentage outside the range of {min_area} and {max_area}.")
+        keep &= extended_in_range
+
+        fill_rects(mask, extended[keep], 0)
+        was_mask_created = bool(keep.any())
+        total_masked_area_percent = sum_in_order(extended_area_percent[keep])
+    else:
+        detected_boxes = boxes[keep]
+
+    if len(detected_boxes):
+        if only_largest:
+            # First of the largest boxes wins.
+            largest = np.flatnonzero(keep)[np.argmax(area[keep])]
+            draw_indices = [largest]
+        else:
+            draw_indices = np.flatnonzero(keep)
+        padded = boxes[draw_indices] + np.array([-xpad_box, -ypad_box, xpad_box, ypad_box])
+        padded[:, :2] = np.maximum(padded[:, :2], 0)
+        padded[:, 2] = np.minimum(padded[:, 2], width)
+        padded[:, 3] = np.minimum(padded[:, 3], height)
+        fill_rects(mask, padded, 0)
+        was_mask_created = True
+        total_masked_area_percent = sum_in_order(area_percent[draw_indices])
+
+    detected_boxes = [tuple(box) for box in detected_boxes.tolist()]
+
+    largest_valid_combination = None
+
+    if contain_bounding_boxes and len(detected_boxes) > 1:
+        max_area_px = max_area * total_area / 100
+        largest_valid_combination = find_contain_rect(
+            detected_boxes,
+            max_area_px,
+            max_nodes=kwargs.get('contain_max_nodes', MAX_COMBINATIONS),
+        )
+
+        if largest_valid_combination is not None:
+            print(f"\nThe largest valid bounding box was found. Area percentage: {total_masked_area_percent}")
+            min_x, min_y, max_x, max_y = largest_valid_combination
+            # White out the areas not covered by the largest bounding box
+            fill_rects(mask, [
+                (0, 0, width, min_y),
+                (0, max_y, width, height),
+                (0, min_y, min_x, max_y),
+                (max_x, min_y, width, max_y),
+            ], 255)
+            # Finally, draw the largest valid bounding box
+            if(kwargs.get('draw_contain', True)):
+                if (kwargs.get('contain_under_min', True) and total_masked_area_percent < kwargs.get('min_total_area', 0.1)) or not kwargs.get('contain_under_min', True):
+                    fill_rects(mask, [largest_valid_combination], 0)
+                    was_mask_created = True
+        else:
+            # No group fits in --max-area: keep the --keep-boxes boxes closest to the top-left corner (0, 0)
+            distances_to_corner = [(box[0]**2 + box[1]**2, box) for box in detected_boxes]
+            distances_to_corner.sort()
+            keep_boxes = int(kwargs.get('keep_boxes', KEEP_BOXES))
+            boxes_to_keep = [box for _, box in distances_to_corner[:keep_boxes]]
+            fill_rects(mask, [box for box in detected_boxes if box not in boxes_to_keep], 255)
+
+
+    return was_mask_created, total_masked_area_percent
+
+def save_mask(mask, mask_filename, include_textfile, result, mask_format='image'):
+    mask_io.write_mask(mask, mask_filename, mask_format)
+    
+    if include_textfile:
+        txt_filename = mask_filename.rsplit('.', 1)[0] + '.txt'
+        with mask_io.atomic_path(txt_filename) as temp_filename:
+            with open(temp_filename, 'w', encoding='utf-8') as f:
+                f.write(sidecar_text(result))
+
+def sidecar_text(result):
+    return ''.join(detection[1] + '\n' for detection in result)
+
+def get_mask_filename(image_path, out_folder, mask_format='image'):
+    return mask_io.mask_filename(image_path, out_folder, mask_format)
+
+
+def should_process(image_path, **kwargs):
+    mask_format = kwargs.get('mask_format', 'image')
+    mask_filename = get_mask_filename(image_path, kwargs['out_folder'], mask_format)
+    if kwargs.get('overwrite', False):
+        return True
+
+    # With --journal, images the journal knows are redone when the file or any
+    # setting that changes the output is different from the last run.
+    journal_path = kwargs.get('journal')
+    entry = get_run_journal(journal_path).get(image_path) if journal_path else None
+    if entry is not None:
+        if not get_run_journal(journal_path).is_current(entry, image_path, output_settings(**kwargs)):
+            return True
+        if entry['status'] == WRITTEN and not mask_io.mask_exists(mask_filename, mask_format):
+            return True
+        print(f"\nMask is up to date for {os.path.basename(image_path)}, skipping.")
+        metrics.count('skipped')
+        return False
+
+    if mask_io.mask_exists(mask_filename, mask_format):
+        print(f"\nMask already exists for {os.path.basename(image_path)}, skipping.")
+        metrics.count('skipped')
+        return False
+    return True
+
+
+def load_kwargs(**kwargs):
+    return {
+        'use_color': kwargs.get('use_color', True),
+        'use_cache': kwargs.get('use_cache', False),
+        'cache_folder': kwargs.get('cache_folder'),
+        'cache_max_mb': kwargs.get('cache_max_mb', CACHE_MAX_MB),
+        'use_binary': kwargs.get('use_binary', False),
+    }
+
+
+def detection_settings(**kwargs):
+    # Only the settings that change what the OCR engine sees.
+    use_color = kwargs.get('use_color', True)
+    settings = {
+        'ocr_backend': kwargs.get('ocr_backend', 'easyocr'),
+        'use_color': use_color,
+        'use_binary': not use_color and kwargs.get('use_binary', False),
+    }
+    if kwargs.get('prefilter'):
+        # A skipped image is cached with no detections, so everything the
+        # prefilter's verdict depends on goes into the key: the threshold,
+        # the text direction it scores and the border strips it scans.
+        settings['prefilter_threshold'] = kwargs.get('prefilter_threshold', text_prefilter.PREFILTER_THRESHOLD)
+        settings['prefilter_text_direction'] = kwargs.get('text_direction', 'horizontal')
+        if kwargs.get('edges') or kwargs.get('corners'):
+            settings['prefilter_regions'] = {
+                'corners': bool(kwargs.get('corners')),
+                'xpad_detect': kwargs.get('xpad_detect'),
+                'ypad_detect': kwargs.get('ypad_detect'),
+                'border_margin': kwargs.get('border_margin', BORDER_MARGIN),
+            }
+    if uses_border_ocr(**kwargs):
+        settings['border_ocr'] = {
+            'corners': bool(kwargs.get('corners')),
+            'xpad_detect': kwargs.get('xpad_detect'),
+            'ypad_detect': kwargs.get('ypad_detect'),
+            'border_margin': kwargs.get('border_margin', BORDER_MARGIN),
+        }
+    if kwargs.get('tile_budget_mb'):
+        settings['tiles'] = {
+            'tile_budget_mb': kwargs['tile_budget_mb'],
+            'tile_overlap': kwargs.get('tile_overlap', TILE_OVERLAP),
+            'batch_size': kwargs.get('batch_size', 1),
+        }
+    if kwargs.get('detect_max_side'):
+        settings['detect_max_side'] = kwargs['detect_max_side']
+        settings['detect_refine'] = bool(kwargs.get('detect_refine'))
+    if kwargs.get('dedupe_phash') is not None:
+        # Reused detections depend on which frames came first.
+        settings['dedupe_phash'] = kwargs['dedupe_phash']
+    return settings
+
+
+def output_settings(**kwargs):
+    # Everything that changes what gets written for an image, for the journal.
+    settings = detection_settings(**kwargs)
+    for name in ('xpad_detect', 'ypad_detect', 'xpad_box', 'ypad_box', 'min_area', 'max_area', 'min_total_area', 'text_direction', 'contain_max_nodes'):
+        settings[name] = kwargs.get(name)
+    for name in ('corners', 'edges', 'only_largest', 'contain_bounding_boxes', 'draw_contain', 'contain_under_min', 'include_empty'):
+        settings[name] = bool(kwargs.get(name))
+    if kwargs.get('keep_boxes', KEEP_BOXES) != KEEP_BOXES:
+        # Only when set, so journals from before the flag still match.
+        settings['keep_boxes'] = kwargs['keep_boxes']
+    settings['include_textfile'] = kwargs.get('include_textfile', True)
+    settings['mask_format'] = kwargs.get('mask_format', 'image')
+    return settings
+
+
+def journal_image(written, digest=None, **kwargs):
+    # Record the outcome once the mask is on disk. A mask left over from
+    # earlier settings that no longer produce one is removed.
+    journal_path = kwargs.get('journal')
+    if not journal_path:
+        return
+    image_path = kwargs['image_path']
+    mask_format = kwargs.get('mask_format', 'image')
+    mask_filename = get_mask_filename(image_path, kwargs['out_folder'], mask_format)
+    journal = get_run_journal(journal_path)
+    if not written:
+        entry = journal.get(image_path)
+        if entry is not None and entry['status'] == WRITTEN and mask_format != 'rle':
+            for filename in (mask_filename, mask_filename.rsplit('.', 1)[0] + '.txt'):
+                if os.path.exists(filename):
+                    os.remove(filename)
+    journal.record(image_path, output_settings(**kwargs), WRITTEN if written else NO_MASK, mask_filename if written else None, digest)
+
+
+def wants_text(mask, **kwargs):
+    # Text is recognized for masks that get a .txt, and for every image when
+    # the detections are exported.
+    return bool(kwargs.get('export_detections')) or (mask is not None and kwargs.get('include_textfile', True))
+
+
+def export_image(size, result, written, digest=None, **kwargs):
+    # With --export-detections, one row for the image and one per detection.
+    # Images are named relative to where they were read from: the file name
+    # in --path, or the member name in the shard given alongside.
+    folder = kwargs.get('export_detections')
+    if not folder:
+        return
+    image_path = kwargs['image_path']
+    shard = kwargs.get('source_shard')
+    image = image_path if shard else os.path.basename(image_path)
+    with metrics.stage('export'):
+        export = get_detection_export(folder, kwargs.get('export_format', 'jsonl'))
+        export.add(image, size, result, written, output_settings(**kwargs), digest, shard)
+
+
+@contextlib.contextmanager
+def exports_closed():
+    # Buffered export rows are written out even when the run stops early.
+    try:
+        yield
+    finally:
+        close_detection_exports()
+
+
+def claims_for(**kwargs):
+    claims_folder = kwargs.get('claims')
+    if not claims_folder:
+        return None
+    return work_claims.get_work_claims(claims_folder, kwargs.get('claim_ttl', work_claims.LEASE_TTL))
+
+
+def claim_image(image_path, **kwargs):
+    # With --claim, True once this run holds the image (or shard), False when
+    # another run holds it or already finished it with the same settings.
+    claims = claims_for(**kwargs)
+    if claims is None or claims.claim(image_path, output_settings(**kwargs)):
+        return True
+    print(f"\n{os.path.basename(image_path)} is claimed or done by another worker, skipping.")
+    metrics.count('claimed_elsewhere')
+    return False
+
+
+def finish_claim(image_path, **kwargs):
+    claims = claims_for(**kwargs)
+    if claims is not None:
+        claims.finish(image_path, output_settings(**kwargs))
+
+
+def release_claim(image_path, **kwargs):
+    claims = claims_for(**kwargs)
+    if claims is not None:
+        claims.release(image_path)
+
+
+def renew_claims(**kwargs):
+    claims = claims_for(**kwargs)
+    if claims is not None:
+        claims.renew()
+
+
+@contextlib.contextmanager
+def held_claims(**kwargs):
+    # Leases still held when the run stops (error, Ctrl+C) are given back
+    # right away instead of waiting out the TTL.
+    try:
+        yield
+    finally:
+        claims = claims_for(**kwargs)
+        if claims is not None:
+            claims.release_all()
+
+
+def uses_border_ocr(**kwargs):
+    return bool(kwargs.get('border_ocr') and (kwargs.get('edges') or kwargs.get('corners')))
+
+
+def ocr_border_regions(size, **kwargs):
+    box_settings = prepare_boxes(size, **kwargs)
+    return ocr_regions.border_regions(
+        box_settings['width'],
+        box_settings['height'],
+        box_settings['xpad_detect'],
+        box_settings['ypad_detect'],
+        kwargs.get('border_margin', BORDER_MARGIN),
+        corners=bool(kwargs.get('corners')),
+    )
+
+
+def prefilter_regions(size, **kwargs):
+    # Regions worth checking for text: only the border strips matter with
+    # --edges/--corners.
+    if kwargs.get('edges') or kwargs.get('corners'):
+        return ocr_border_regions(size, **kwargs)
+    return None
+
+
+def tile_size(**kwargs):
+    # Side of the square tiles that keep one batch of them within
+    # --tile-budget-mb, or None when tiling is off.
+    budget = kwargs.get('tile_budget_mb')
+    if not budget:
+        return None
+    pixels = budget * 2**20 / (TILE_BYTES_PER_PIXEL * max(1, kwargs.get('batch_size', 1)))
+    return max(int(math.sqrt(pixels)), 2 * kwargs.get('tile_overlap', TILE_OVERLAP))
+
+
+def engine_for(**kwargs):
+    return kwargs.get('engine') or get_engine(backend=kwargs.get('ocr_backend', 'easyocr'), batch_size=kwargs.get('batch_size', 1))
+
+
+def run_ocr(ocr_inputs, **kwargs):
+    # With --dedupe-phash, a frame whose perceptual hash is close to one of the
+    # same size OCR'd earlier in this process, or earlier in this batch,
+    # reuses its detections. Only OCR'd frames are added, so reuse never chains.
+    if kwargs.get('dedupe_phash') is not None:
+        frame_index = perceptual_hash.get_frame_index(kwargs['dedupe_phash'])
+        batch_index = perceptual_hash.FrameIndex(kwargs['dedupe_phash'])
+        results = [None] * len(ocr_inputs)
+        selected, hashes, same_as = [], {}, {}
+        with metrics.stage('dedupe'):
+            for index, ocr_input in enumerate(ocr_inputs):
+                size = image_size(ocr_input)
+                value = perceptual_hash.image_hash(ocr_input)
+                match = frame_index.nearest(size, value)
+                if match is not None:
+                    results[index] = list(match[1])
+                    continue
+                match = batch_index.nearest(size, value)
+                if match is not None:
+                    same_as[index] = match[1]
+                    continue
+                batch_index.add(size, value, index)
+                hashes[index] = (size, value)
+                selected.append(index)
+        metrics.count('dedupe_hits', len(ocr_inputs) - len(selected))
+        selected_results = run_ocr([ocr_inputs[index] for index in selected], **dict(kwargs, dedupe_phash=None))
+        for index, result in zip(selected, selected_results):
+            results[index] = result
+            size, value = hashes[index]
+            frame_index.add(size, value, result)
+        for index, source in same_as.items():
+            results[index] = list(results[source])
+        return results
+
+    # With --prefilter, images that don't look like they contain text skip OCR
+    # and get no detections.
+    if kwargs.get('prefilter'):
+        threshold = kwargs.get('prefilter_threshold', text_prefilter.PREFILTER_THRESHOLD)
+        text_direction = kwargs.get('text_direction', 'horizontal')
+        with metrics.stage('prefilter'):
+            selected = [
+                index for index, ocr_input in enumerate(ocr_inputs)
+                if text_prefilter.text_score(ocr_input, prefilter_regions(image_size(ocr_input), **kwargs), text_direction) >= threshold
+            ]
+        metrics.count('prefilter_skipped', len(ocr_inputs) - len(selected))
+        results = [[] for _ in ocr_inputs]
+        selected_results = run_ocr([ocr_inputs[index] for index in selected], **dict(kwargs, prefilter=False))
+        for index, result in zip(selected, selected_results):
+            results[index] = result
+        return results
+
+    # With --detect-max-side, large images are detected on a downscaled copy
+    # and --detect-refine detects again at full resolution around what was found.
+    if kwargs.get('detect_max_side'):
+        engine = engine_for(**kwargs)
+        results = ocr_frames(ocr_inputs, **dict(kwargs, engine=scaled_detect.ScaledEngine(engine, kwargs['detect_max_side'])))
+        if kwargs.get('detect_refine'):
+            regions = [scaled_detect.refine_regions(image_size(ocr_input), result) for ocr_input, result in zip(ocr_inputs, results)]
+            with metrics.stage('ocr'):
+                results = ocr_regions.ocr_regions_many(engine, ocr_inputs, regions, detect_only=not kwargs.get('recognize_all', False))
+        return results
+    return ocr_frames(ocr_inputs, **kwargs)
+
+
+def ocr_frames(ocr_inputs, **kwargs):
+    # Only the text detector runs unless --recognize-all is set; text is
+    # recognized later for the images that end up needing it (ensure_text).
+    engine = engine_for(**kwargs)
+    detect_only = not kwargs.get('recognize_all', False)
+
+    # With --border-ocr only the strips along the border are OCR'd (top and
+    # bottom for --corners) and boxes are mapped back to image coordinates.
+    regions = None
+    if uses_border_ocr(**kwargs):
+        regions = [ocr_border_regions(image_size(ocr_input), **kwargs) for ocr_input in ocr_inputs]
+
+    # With --tile-budget-mb, anything bigger than one tile is OCR'd as
+    # overlapping tiles (views into the decoded image) and boxes cut at the
+    # seams are merged back together.
+    tile = tile_size(**dict(kwargs, batch_size=engine.batch_size))
+    if tile:
+        if regions is None:
+            regions = [[(0, 0, ocr_input.shape[1], ocr_input.shape[0])] for ocr_input in ocr_inputs]
+        overlap = kwargs.get('tile_overlap', TILE_OVERLAP)
+        regions = [ocr_regions.split_regions(image_regions, tile, overlap) for image_regions in regions]
+
+    with metrics.stage('ocr'):
+        if regions is not None:
+            return ocr_regions.ocr_regions_many(engine, ocr_inputs, regions, detect_only=detect_only)
+        if detect_only:
+            return engine.detect_many(ocr_inputs)
+        return engine.readtext_many(ocr_inputs)
+
+
+def ensure_text(size, result, ocr_input=None, digest=None, **kwargs):
+    # Recognize the text of a detection-only result, decoding the image again
+    # if it came from the detection cache, and keep the text in the cache.
+    if not needs_recognition(result):
+        return result
+    if ocr_input is None:
+        ocr_input = load_image(kwargs['image_path'], **load_kwargs(**kwargs))
+    with metrics.stage('recognize'):
+        result = engine_for(**kwargs).recognize(ocr_input, result)
+    metrics.count('recognized')
+    store_detections(size, digest, result, **kwargs)
+    return result
+
+
+def load_for_ocr(image_path, data=None, **kwargs):
+    # Returns (size, ocr_input, digest, result). On a detection cache hit only
+    # the file header is read for the size and result is already filled in.
+    digest = None
+    if data is not None:
+        digest = bytes_digest(data)
+    cache_path = kwargs.get('detection_cache')
+    if cache_path:
+        digest = digest or file_digest(image_path)
+        cached = get_detection_cache(cache_path).get(digest, detection_settings(**kwargs))
+        if cached is not None:
+            metrics.count('detection_cache_hits')
+            return probe_size(image_path, data), None, digest, cached[1]
+
+    ocr_input = load_image(image_path, digest=digest, data=data, **load_kwargs(**kwargs))
+    return image_size(ocr_input), ocr_input, digest, None
+
+
+def store_detections(size, digest, result, **kwargs):
+    cache_path = kwargs.get('detection_cache')
+    if cache_path and digest is not None:
+        get_detection_cache(cache_path).put(digest, detection_settings(**kwargs), size, result)
+
+
+def build_mask(size, result, **kwargs):
+    # Runs draw_boxes on a fresh mask of the given (width, height).
+    # Returns (mask, mask_created, total_masked_area_percent).
+    box_settings = prepare_boxes(size, **kwargs)
+    with metrics.stage('render'):
+        mask = mask_io.blank_mask(size)
+
+
+    all_kwargs = box_settings.copy()  # Start with the contents of box_settings
+
+    # Update all_kwargs only for keys that have non-None values in kwargs
+    for key, value in kwargs.items():
+        if value is not None:
+            all_kwargs[key] = value
+
+    # Filtering and the contain search count as filter, filling the boxes in
+    # (fill_rects) as render.
+    with metrics.stage('filter'):
+        mask_created, total_masked_area_percent = draw_boxes(
+            result=result,
+            mask=mask,
+            **all_kwargs,
+        )
+    return mask, mask_created, total_masked_area_percent
+
+
+def passes_min_total_area(mask_created, total_masked_area_percent, **kwargs):
+    return mask_created and total_masked_area_percent >= kwargs.get('min_total_area', 0.1)
+
+
+def render_mask(size, result, **kwargs):
+    # Returns the mask to write for this image, or None if nothing should be saved.
+    image_path = kwargs['image_path']
+
+    mask, mask_created, total_masked_area_percent = build_mask(size, result, **kwargs)
+    metrics.count('images')
+    metrics.count('detections', len(result))
+
+    if passes_min_total_area(mask_created, total_masked_area_percent, **kwargs):
+        metrics.count('masked')
+        return mask
+
+    include_blank = kwargs.get('include_empty', True)
+    if include_blank and total_masked_area_percent == 0:
+        metrics.count('blank')
+        mask = mask_io.blank_mask(size)
+    else:
+        metrics.count('no_mask')
+        mask = None
+    print(f"\nMask was not created for {os.path.basename(image_path)}, total masked area percentage was {total_masked_area_percent} and threshold was {kwargs.get('min_total_area', 0.1)}")
+    return mask
+
+
+def write_mask(mask, result, **kwargs):
+    mask_format = kwargs.get('mask_format', 'image')
+    mask_filename = get_mask_filename(kwargs['image_path'], kwargs['out_folder'], mask_format)
+    with metrics.stage('save'):
+        save_mask(mask, mask_filename, kwargs.get('include_textfile', True), result, mask_format)
+
+
+def finish_image(size, result, ocr_input=None, digest=None, **kwargs):
+    mask = render_mask(size, result, **kwargs)
+    if wants_text(mask, **kwargs):
+        result = ensure_text(size, result, ocr_input, digest, **kwargs)
+    if mask is not None:
+        write_mask(mask, result, **kwargs)
+    journal_image(mask is not None, digest, **kwargs)
+    export_image(size, result, mask is not None, digest, **kwargs)
+
+
+def process_image(**kwargs):
+    process_batch([kwargs['image_path']], **{k: v for k, v in kwargs.items() if k != 'image_path'})
+
+
+def process_batch(image_paths, **kwargs):
+    # Decode a group of images, run the cache misses through the engine
+    # together so same-size images share a batched OCR call, then build each mask.
+    engine = engine_for(**kwargs)
+    loaded = []
+    for image_path in image_paths:
+        print(f"\nProcessing {os.path.basename(image_path)}")
+        if not should_process(image_path=image_path, **kwargs):
+            continue
+        if not claim_image(image_path, **kwargs):
+            continue
+        size, ocr_input, digest, result = load_for_ocr(image_path, **kwargs)
+        # Leases taken earlier in the batch are held until its last image is
+        # written, so they are renewed per image, not per batch.
+        renew_claims(**kwargs)
+        if result is not None:
+            finish_image(size, result, digest=digest, image_path=image_path, **kwargs)
+            finish_claim(image_path, **kwargs)
+            continue
+        loaded.append((image_path, size, ocr_input, digest))
+
+    kwargs = dict(kwargs, engine=engine)
+    results = run_ocr([ocr_input for _, _, ocr_input, _ in loaded], **kwargs)
+    for (image_path, size, ocr_input, digest), result in zip(loaded, results):
+        store_detections(size, digest, result, **kwargs)
+        finish_image(size, result, ocr_input, digest, image_path=image_path, **kwargs)
+        finish_claim(image_path, **kwargs)
+        renew_claims(**kwargs)
+    metrics.tick()
+
+
+@contextlib.contextmanager
+def quiet_output(quiet):
+    # Per-image messages go to stdout; the tqdm bar is on stderr and stays.
+    if not quiet:
+        yield
+        return
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def process_shard(shard_path, **kwargs):
+    # Masks for every image in a tar shard go into a shard of the same name in
+    # the output folder, under the names the loose layout would give the files.
+    # A finished output shard is only ever renamed into place, so one that
+    # exists is complete and the input shard is skipped.
+    out_shard = os.path.join(kwargs['out_folder'], os.path.basename(shard_path))
+    if os.path.exists(out_shard) and not kwargs.get('overwrite', False):
+        print(f"\nMask shard already exists for {os.path.basename(shard_path)}, skipping.")
+        metrics.count('skipped')
+        return 0
+    if not claim_image(shard_path, **kwargs):
+        return 0
+
+    engine = engine_for(**kwargs)
+    kwargs = dict(kwargs, engine=engine, source_shard=os.path.basename(shard_path))
+    processed = 0
+    try:
+        with shards.ShardWriter(out_shard) as writer:
+            batch = []
+            for member in shards.iter_images(shard_path):
+                batch.append(member)
+                if len(batch) >= engine.batch_size:
+                    process_shard_batch(batch, writer, **kwargs)
+                    processed += len(batch)
+                    batch = []
+                    renew_claims(**kwargs)
+            if batch:
+                process_shard_batch(batch, writer, **kwargs)
+                processed += len(batch)
+    except BaseException:
+        release_claim(shard_path, **kwargs)
+        raise
+    finish_claim(shard_path, **kwargs)
+    # One export part per shard, so pool workers never leave one open.
+    close_detection_exports()
+    metrics.tick()
+    return processed
+
+
+def process_shard_batch(members, writer, **kwargs):
+    # members is [(member name, image bytes)].
+    loaded = []
+    for name, data in members:
+        print(f"\nProcessing {name}")
+        size, ocr_input, digest, result = load_for_ocr(name, data=data, **kwargs)
+        loaded.append([name, data, size, ocr_input, digest, result])
+
+    misses = [item for item in loaded if item[5] is None]
+    results = run_ocr([item[3] for item in misses], **kwargs)
+    for item, result in zip(misses, results):
+        store_detections(item[2], item[4], result, **kwargs)
+        item[5] = result
+
+    mask_format = kwargs.get('mask_format', 'image')
+    include_textfile = kwargs.get('include_textfile', True)
+    for name, data, size, ocr_input, digest, result in loaded:
+        mask = render_mask(size, result, image_path=name, **kwargs)
+        if wants_text(mask, **kwargs):
+            if ocr_input is None and needs_recognition(result):
+                ocr_input = load_image(name, digest=digest, data=data, **load_kwargs(**kwargs))
+            result = ensure_text(size, result, ocr_input, digest, image_path=name, **kwargs)
+        if mask is None:
+            export_image(size, result, False, digest, image_path=name, **kwargs)
+            continue
+        member = posixpath.join(posixpath.dirname(name), os.path.basename(get_mask_filename(name, '', mask_format)))
+        with metrics.stage('save'):
+            writer.write(member, mask_io.encode_mask(mask, member, mask_format))
+            if include_textfile:
+                writer.write(member.rsplit('.', 1)[0] + '.txt', sidecar_text(result).encode('utf-8'))
+        export_image(size, result, True, digest, image_path=name, **kwargs)
@@ -0,0 +1,70 @@
+import Levenshtein
+
+# Nearest mask filename lookup for guess_masks. Masks are bucketed by image
+# size and each bucket is a BK-tree over the filenames: every child edge is
+# the edit distance to its parent, so by the triangle inequality a query only
+# has to descend into edges within the best distance found so far of the
+# query's own distance to the node. Sequentially numbered frames find a close
+# neighbour right away, which prunes almost the whole tree. Ties go to the
+# mask that was added first, same as min() over the mask list did.
+
+
+class BKTree:
+    def __init__(self):
+        self.root = None
+        self.count = 0
+
+    def add(self, name):
+        # Nodes are [name, order, {distance: child}].
+        node = [name, self.count, {}]
+        self.count += 1
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = Levenshtein.distance(name, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def nearest(self, name, count=1):
+        # The count closest names as [(distance, name)], closest first.
+        best = []
+        if self.root is None:
+            return best
+        # Each entry carries the least (distance, order) its subtree can have:
+        # no name in it is closer than the triangle inequality allows, and
+        # none was added before the subtree's root. A subtree is skipped once
+        # that is already worse than the count-th best.
+        stack = [(0, 0, self.root)]
+        while stack:
+            lower, order, node = stack.pop()
+            if len(best) == count and (lower, order) > best[-1][:2]:
+                continue
+            distance = Levenshtein.distance(name, node[0])
+            if len(best) < count or (distance, node[1]) < best[-1][:2]:
+                best.append((distance, node[1], node[0]))
+                best.sort()
+                del best[count:]
+            # Most promising child goes on top, so the bound tightens early.
+            children = sorted(((abs(edge - distance), child[1], child) for edge, child in node[2].items()), reverse=True)
+            for child_lower, child_order, child in children:
+                if len(best) < count or (child_lower, child_order) < best[-1][:2]:
+                    stack.append((child_lower, child_order, child))
+        return [(distance, name) for distance, _, name in best]
+
+
+class MaskIndex:
+    def __init__(self):
+        self.buckets = {}
+
+    def add(self, size, name):
+        self.buckets.setdefault(size, BKTree()).add(name)
+
+    def nearest(self, size, name, count=1):
+        # [] when there is no mask of that size.
+        tree = self.buckets.get(size)
+        return tree.nearest(name, count) if tree is not None else []
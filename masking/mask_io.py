@@ -0,0 +1,159 @@
+import contextlib
+import io
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+# Masks are held as (height, width) uint8 arrays: 0 where the image is masked
+# (black) and 255 where it is kept (white). They can be written as
+#
+#   image  RGB file named after the source image, same extension (legacy)
+#   png1   1-bit PNG named <stem>.png
+#   rle    one line per image in <out>/masks.jsonl, COCO-style uncompressed
+#          RLE (column-major counts, starting with a run of unmasked pixels)
+
+MASK_FORMATS = ('image', 'png1', 'rle')
+RLE_FILENAME = 'masks.jsonl'
+
+
+def blank_mask(size):
+    width, height = size
+    return np.full((height, width), 255, dtype=np.uint8)
+
+
+def pack_mask(mask):
+    # 1 bit per pixel, for handing masks between processes.
+    return mask.shape, np.packbits(mask == 0)
+
+
+def unpack_mask(packed):
+    shape, bits = packed
+    masked = np.unpackbits(bits, count=shape[0] * shape[1]).reshape(shape)
+    return np.where(masked, 0, 255).astype(np.uint8)
+
+
+def rle_encode(mask):
+    masked = (mask == 0).ravel(order='F')
+    changes = np.flatnonzero(masked[1:] != masked[:-1]) + 1
+    bounds = np.concatenate(([0], changes, [masked.size]))
+    counts = np.diff(bounds).tolist()
+    if masked.size and masked[0]:
+        counts.insert(0, 0)
+    return {'size': [int(mask.shape[0]), int(mask.shape[1])], 'counts': counts}
+
+
+def rle_decode(rle):
+    # Boolean (height, width) array, True where masked.
+    height, width = rle['size']
+    counts = np.asarray(rle['counts'], dtype=np.int64)
+    values = np.arange(len(counts)) % 2 == 1
+    return np.repeat(values, counts).reshape((height, width), order='F')
+
+
+def rasterize(rle):
+    # Back to the uint8 layout used everywhere else, e.g. for inpainting.
+    return np.where(rle_decode(rle), 0, 255).astype(np.uint8)
+
+
+class RLEStore:
+    def __init__(self, folder):
+        self.path = os.path.join(folder, RLE_FILENAME)
+        self.keys = set()
+        if os.path.exists(self.path):
+            for record in iter_rle(self.path):
+                self.keys.add(record['file'])
+
+    def has(self, key):
+        return key in self.keys
+
+    def write(self, key, mask):
+        record = {'file': key}
+        record.update(rle_encode(mask))
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+        self.keys.add(key)
+
+
+def iter_rle(path):
+    # Later lines win when an image was written more than once (--overwrite).
+    # A line cut short by an interrupted run is skipped, so that image is
+    # treated as not written yet.
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def load_rle(path):
+    return {record['file']: record for record in iter_rle(path)}
+
+
+_STORES = {}
+
+
+def get_rle_store(folder):
+    if folder not in _STORES:
+        _STORES[folder] = RLEStore(folder)
+    return _STORES[folder]
+
+
+def mask_filename(image_path, out_folder, mask_format='image'):
+    # For rle this names the record, not a file on disk.
+    basename = os.path.basename(image_path)
+    if mask_format == 'png1':
+        return os.path.join(out_folder, os.path.splitext(basename)[0] + '.png')
+    return os.path.join(out_folder, basename)
+
+
+def mask_exists(filename, mask_format='image'):
+    if mask_format == 'rle':
+        return get_rle_store(os.path.dirname(filename)).has(os.path.basename(filename))
+    return os.path.exists(filename)
+
+
+@contextlib.contextmanager
+def atomic_path(filename):
+    # Yields a temporary name next to filename (same extension, so PIL picks
+    # the same format) and renames it over filename once the block finishes.
+    # An interrupted write never leaves a truncated file under the real name.
+    folder, basename = os.path.split(filename)
+    stem, ext = os.path.splitext(basename)
+    temp_filename = os.path.join(folder, f".{stem}.{os.getpid()}.tmp{ext}")
+    try:
+        yield temp_filename
+        os.replace(temp_filename, filename)
+    finally:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+
+
+def encode_mask(mask, filename, mask_format='image'):
+    # The bytes write_mask would put in filename, for masks stored in shards.
+    buffer = io.BytesIO()
+    if mask_format == 'image':
+        image_format = Image.registered_extensions()[os.path.splitext(filename)[1].lower()]
+        Image.fromarray(mask).convert("RGB").save(buffer, format=image_format)
+    elif mask_format == 'png1':
+        Image.fromarray(mask != 0).save(buffer, format='PNG', optimize=True)
+    else:
+        raise ValueError(f"Mask format '{mask_format}' is not stored as one file per image")
+    return buffer.getvalue()
+
+
+def write_mask(mask, filename, mask_format='image'):
+    if mask_format == 'image':
+        with atomic_path(filename) as temp_filename:
+            Image.fromarray(mask).convert("RGB").save(temp_filename)
+    elif mask_format == 'png1':
+        with atomic_path(filename) as temp_filename:
+            Image.fromarray(mask != 0).save(temp_filename, optimize=True)
+    elif mask_format == 'rle':
+        get_rle_store(os.path.dirname(filename)).write(os.path.basename(filename), mask)
+    else:
+        raise ValueError(f"Unknown mask format '{mask_format}'. Choices are {', '.join(MASK_FORMATS)}")
@@ -0,0 +1,331 @@
+import os
+import sys
+import queue
+import threading
+import time
+import multiprocessing
+import traceback
+from multiprocessing.connection import wait
+
+import mask_core
+import mask_io
+import metrics
+from ocr_engine import get_engine
+
+# Staged pipeline for batch_create_masks --workers N:
+#
+#   feeder thread -> task queue -> N worker processes -> result pipes -> writer
+#
+# Each worker process keeps one warm OCR engine and runs its own decode thread
+# ahead of OCR and mask rendering. All queues are bounded so a slow stage
+# applies back-pressure instead of piling decoded images up in memory, and the
+# feeder stops once the writer is too far behind, so one slow image can't make
+# the finished results waiting for it grow without limit. The writer runs in
+# the parent and saves masks strictly in input order through the same save
+# path as the serial loop, so outputs match it byte for byte.
+#
+# Workers report every task they take and every result on their own pipe,
+# which the writer waits on together with the process sentinels. When a
+# worker dies (OOM, segfault) the images it had taken are recorded as failed
+# and the rest of the run carries on with the others. A worker can also die
+# after taking a task but before reporting it; once a worker has died, a task
+# that has left the queue (a later one was reported, or the queue is empty)
+# and stays unreported for RESULT_POLL_SECONDS is failed the same way, since
+# live workers report a task right after taking it. If no worker is left,
+# what is already finished is written before the run stops.
+
+RESULT_POLL_SECONDS = 5
+
+
+def _decode_stage(task_queue, decoded_queue, send, kwargs):
+    while True:
+        task = task_queue.get()
+        if task is None:
+            decoded_queue.put(None)
+            return
+        index, image_path = task
+        send(('taken', index, image_path))
+        try:
+            size, ocr_input, digest, result = mask_core.load_for_ocr(image_path, **kwargs)
+            decoded_queue.put((index, image_path, size, ocr_input, digest, result, None))
+        except Exception:
+            decoded_queue.put((index, image_path, None, None, None, None, traceback.format_exc()))
+
+
+def _failed(send, index, image_path, error):
+    send(('done', index, image_path, None, None, None, None, error, metrics.get_metrics().take()))
+
+
+def _render(send, index, image_path, size, ocr_input, digest, result, kwargs):
+    try:
+        mask = mask_core.render_mask(size, result, image_path=image_path, **kwargs)
+        if mask_core.wants_text(mask, **kwargs):
+            result = mask_core.ensure_text(size, result, ocr_input, digest, image_path=image_path, **kwargs)
+        if mask is not None:
+            mask = mask_io.pack_mask(mask)
+        send(('done', index, image_path, size, mask, result, digest, None, metrics.get_metrics().take()))
+    except Exception:
+        _failed(send, index, image_path, traceback.format_exc())
+
+
+def _worker_main(task_queue, connection, engine_options, kwargs, prefetch):
+    if kwargs.get('quiet'):
+        sys.stdout = open(os.devnull, 'w')
+    # The decode thread and this one share the pipe. Connection.send writes
+    # straight to it, so whatever was sent survives the process dying.
+    lock = threading.Lock()
+
+    def send(message):
+        with lock:
+            connection.send(message)
+
+    engine = get_engine(**engine_options)
+    kwargs = dict(kwargs, engine=engine)
+    decoded_queue = queue.Queue(maxsize=prefetch)
+    decoder = threading.Thread(target=_decode_stage, args=(task_queue, decoded_queue, send, kwargs), daemon=True)
+    decoder.start()
+
+    finished = False
+    while not finished:
+        # Take whatever is already decoded, up to one OCR batch.
+        batch = [decoded_queue.get()]
+        while len(batch) < engine.batch_size and batch[-1] is not None:
+            try:
+                batch.append(decoded_queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch[-1] is None:
+            finished = True
+            batch.pop()
+
+        ready = []
+        for index, image_path, size, ocr_input, digest, result, error in batch:
+            if error is not None:
+                _failed(send, index, image_path, error)
+            elif result is not None:
+                # Detection cache hit, skip straight to rendering.
+                _render(send, index, image_path, size, None, digest, result, kwargs)
+            else:
+                ready.append((index, image_path, size, ocr_input, digest))
+
+        try:
+            results = mask_core.run_ocr([item[3] for item in ready], **kwargs)
+        except Exception:
+            error = traceback.format_exc()
+            for index, image_path, _, _, _ in ready:
+                _failed(send, index, image_path, error)
+            continue
+
+        for (index, image_path, size, ocr_input, digest), result in zip(ready, results):
+            mask_core.store_detections(size, digest, result, **kwargs)
+            _render(send, index, image_path, size, ocr_input, digest, result, kwargs)
+    connection.close()
+
+
+def _feed(task_queue, image_paths, workers, fed, window, kwargs):
+    # With --claim, images are claimed here, just before they are queued, so a
+    # run only holds leases on the few images it is about to do. Indexes stay
+    # contiguous over the images that are fed; fed['total'] is set at the end.
+    # The feeder waits while it is window images ahead of the writer.
+    index = 0
+    for image_path in image_paths:
+        if not mask_core.claim_image(image_path, **kwargs):
+            fed['skipped'] += 1
+            continue
+        with fed['written_changed']:
+            while index - fed['written'] >= window and not fed['stop']:
+                fed['written_changed'].wait(RESULT_POLL_SECONDS)
+        if fed['stop']:
+            mask_core.release_claim(image_path, **kwargs)
+            return
+        fed['paths'].append(image_path)
+        task_queue.put((index, image_path))
+        index += 1
+    fed['total'] = index
+    for _ in range(workers):
+        task_queue.put(None)
+
+
+def _write_result(image_path, size, mask, result, digest, error, failed, kwargs):
+    if error is not None:
+        print(f"\nFailed to process {os.path.basename(image_path)}:\n{error}")
+        metrics.count('errors')
+        failed.append(image_path)
+        mask_core.release_claim(image_path, **kwargs)
+        return
+    if mask is not None:
+        mask_core.write_mask(mask_io.unpack_mask(mask), result, image_path=image_path, **kwargs)
+    mask_core.journal_image(mask is not None, digest, image_path=image_path, **kwargs)
+    mask_core.export_image(size, result, mask is not None, digest, image_path=image_path, **kwargs)
+    mask_core.finish_claim(image_path, **kwargs)
+
+
+def run_pipeline(image_paths, workers, engine_options, progress=None, prefetch=4, **kwargs):
+    kwargs = {key: value for key, value in kwargs.items() if key != 'engine'}
+    context = multiprocessing.get_context('spawn')
+    batch_size = engine_options.get('batch_size', 1)
+    depth = max(prefetch, batch_size)
+    task_queue = context.Queue(maxsize=workers * depth)
+
+    processes = []
+    readers = []
+    for _ in range(workers):
+        reader, writer = context.Pipe(duplex=False)
+        process = context.Process(target=_worker_main, args=(task_queue, writer, engine_options, kwargs, depth), daemon=True)
+        process.start()
+        writer.close()
+        processes.append(process)
+        readers.append(reader)
+
+    # What can be in the task queue and inside the workers, plus prefetch
+    # finished images per worker waiting on an earlier one.
+    window = workers * (2 * depth + 1 + prefetch)
+    fed = {'total': None, 'skipped': 0, 'written': 0, 'stop': False, 'paths': [], 'written_changed': threading.Condition()}
+    feeder = threading.Thread(target=_feed, args=(task_queue, image_paths, workers, fed, window, kwargs), daemon=True)
+    feeder.start()
+
+    # Write stage: hold finished images until every earlier one is written.
+    pending = {}
+    in_flight = [{} for _ in range(workers)]
+    live = set(range(workers))
+    # Indexes any worker has reported, from next_index on, and what is
+    # suspected lost by a dead worker (index -> when first suspected).
+    reported = set()
+    highest = [-1]
+    suspects = {}
+    died = []
+    next_index = 0
+    skipped = 0
+    failed = []
+
+    def receive(number):
+        # Everything the worker has sent so far; False once its pipe is closed.
+        try:
+            while readers[number].poll():
+                message = readers[number].recv()
+                reported.add(message[1])
+                highest[0] = max(highest[0], message[1])
+                if message[0] == 'taken':
+                    in_flight[number][message[1]] = message[2]
+                    continue
+                index, image_path, size, mask, result, digest, error, worker_metrics = message[1:]
+                in_flight[number].pop(index, None)
+                metrics.get_metrics().merge(worker_metrics)
+                pending[index] = (image_path, size, mask, result, digest, error)
+        except (EOFError, OSError):
+            return False
+        return True
+
+    def worker_exited(number):
+        receive(number)
+        processes[number].join(RESULT_POLL_SECONDS)
+        live.discard(number)
+        if processes[number].exitcode != 0:
+            died.append(number)
+        for index, image_path in in_flight[number].items():
+            pending[index] = (image_path, None, None, None, None, f"Worker exited with code {processes[number].exitcode} while processing this image.")
+        in_flight[number].clear()
+
+    def find_lost():
+        now = time.monotonic()
+        for index in range(next_index, len(fed['paths'])):
+            if index in reported or index in pending:
+                suspects.pop(index, None)
+            elif index < highest[0] or task_queue.empty():
+                if now - suspects.setdefault(index, now) >= RESULT_POLL_SECONDS:
+                    suspects.pop(index)
+                    pending[index] = (fed['paths'][index], None, None, None, None, "A mask worker exited after taking this image and before reporting it.")
+
+    try:
+        while fed['total'] is None or next_index < fed['total']:
+            if progress is not None and fed['skipped'] > skipped:
+                progress.update(fed['skipped'] - skipped)
+                skipped = fed['skipped']
+            if not live:
+                break
+            sentinels = {processes[number].sentinel: number for number in live}
+            connections = {readers[number]: number for number in live}
+            for ready in wait(list(sentinels) + list(connections), timeout=RESULT_POLL_SECONDS):
+                if ready in connections:
+                    if connections[ready] in live and not receive(connections[ready]):
+                        worker_exited(connections[ready])
+                elif sentinels[ready] in live:
+                    worker_exited(sentinels[ready])
+
+            if died:
+                find_lost()
+
+            while next_index in pending:
+                _write_result(*pending.pop(next_index), failed, kwargs)
+                reported.discard(next_index)
+                next_index += 1
+                if progress is not None:
+                    progress.update(1)
+            with fed['written_changed']:
+                fed['written'] = next_index
+                fed['written_changed'].notify()
+            mask_core.renew_claims(**kwargs)
+            metrics.tick()
+        if progress is not None and fed['skipped'] > skipped:
+            progress.update(fed['skipped'] - skipped)
+
+        if fed['total'] is None or next_index < fed['total']:
+            # Every worker is gone. Keep what is finished, even out of order,
+            # and fail whatever was fed but never came back. A worker that
+            # exited normally saw the end of the tasks, so then nothing is
+            # left in the queue and only what dead workers took is missing.
+            finished = fed['total'] is not None and any(process.exitcode == 0 for process in processes)
+            with fed['written_changed']:
+                fed['stop'] = True
+                fed['written_changed'].notify()
+            for index in range(next_index, len(fed['paths'])):
+                reason = "A mask worker exited after taking this image and before reporting it." if finished else "No mask worker was left to process this image."
+                _write_result(*pending.pop(index, (fed['paths'][index], None, None, None, None, reason)), failed, kwargs)
+            if not finished:
+                raise RuntimeError(f"All mask workers exited before the run finished ({len(failed)} images failed).")
+    finally:
+        for process in processes:
+            process.join(timeout=RESULT_POLL_SECONDS)
+            if process.is_alive():
+                process.terminate()
+
+    return failed
+
+
+# Shard mode (--shards --workers N): every shard is read and written as one
+# unit, so workers take whole shards from a process pool. There is nothing to
+# keep in order across shards, and each worker writes its own output shard.
+
+_SHARD_STATE = {}
+
+
+def _shard_worker_init(engine_options, kwargs):
+    if kwargs.get('quiet'):
+        sys.stdout = open(os.devnull, 'w')
+    _SHARD_STATE['kwargs'] = dict(kwargs, engine=get_engine(**engine_options))
+
+
+def _process_shard(shard_path):
+    try:
+        mask_core.process_shard(shard_path, **_SHARD_STATE['kwargs'])
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    return shard_path, error, metrics.get_metrics().take()
+
+
+def run_shards(shard_paths, workers, engine_options, progress=None, **kwargs):
+    kwargs = {key: value for key, value in kwargs.items() if key != 'engine'}
+    context = multiprocessing.get_context('spawn')
+    failed = []
+    with context.Pool(workers, initializer=_shard_worker_init, initargs=(engine_options, kwargs)) as pool:
+        for shard_path, error, worker_metrics in pool.imap_unordered(_process_shard, shard_paths):
+            metrics.get_metrics().merge(worker_metrics)
+            if error is not None:
+                print(f"\nFailed to process shard {os.path.basename(shard_path)}:\n{error}")
+                metrics.count('errors')
+                failed.append(shard_path)
+            if progress is not None:
+                progress.update(1)
+            metrics.tick()
+    return failed
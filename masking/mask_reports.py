@@ -0,0 +1,111 @@
+import os
+import json
+import time
+import random
+import contextlib
+
+import mask_core
+import scaled_detect
+import text_prefilter
+
+# Sample reports for batch_create_masks --prefilter-report and --detect-report:
+# each runs a shortcut and the full OCR side by side on random images and
+# measures what the shortcut would change.
+
+
+def prefilter_report(image_paths, sample_size, seed=0, **kwargs):
+    # Run the prefilter and the real OCR on a sample and measure how many
+    # images with text (and with a mask) the prefilter would have let through.
+    sample = random.Random(seed).sample(image_paths, min(sample_size, len(image_paths)))
+    ocr_kwargs = dict(kwargs, prefilter=False)
+    threshold = kwargs.get('prefilter_threshold', text_prefilter.PREFILTER_THRESHOLD)
+
+    rows = []
+    for image_path in sample:
+        ocr_input = mask_core.load_image(image_path, **mask_core.load_kwargs(**kwargs))
+        size = mask_core.image_size(ocr_input)
+        score = text_prefilter.text_score(ocr_input, mask_core.prefilter_regions(size, **kwargs), kwargs.get('text_direction', 'horizontal'))
+        result = mask_core.run_ocr([ocr_input], **ocr_kwargs)[0]
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            _, mask_created, total = mask_core.build_mask(size, result, **kwargs)
+        rows.append({
+            'image': os.path.basename(image_path),
+            'score': score,
+            'passed': score >= threshold,
+            'detections': len(result),
+            'masked': bool(mask_core.passes_min_total_area(mask_created, total, **kwargs)),
+        })
+
+    def recall(key):
+        positives = [row for row in rows if row[key]]
+        return sum(row['passed'] for row in positives) / len(positives) if positives else None
+
+    return {
+        'sample': len(rows),
+        'threshold': threshold,
+        'skip_rate': sum(not row['passed'] for row in rows) / len(rows) if rows else None,
+        'text_recall': recall('detections'),
+        'mask_recall': recall('masked'),
+        'missed': [row['image'] for row in rows if row['masked'] and not row['passed']],
+        'images': rows,
+    }
+
+
+def detect_report(image_paths, sample_size, seed=0, **kwargs):
+    # OCR a sample at full resolution and with --detect-max-side, time both,
+    # and compare the masks they produce.
+    sample = random.Random(seed).sample(image_paths, min(sample_size, len(image_paths)))
+    full_kwargs = dict(kwargs, detect_max_side=None, detect_refine=False, prefilter=False)
+    scaled_kwargs = dict(kwargs, prefilter=False)
+
+    rows = []
+    for index, image_path in enumerate(sample):
+        ocr_input = mask_core.load_image(image_path, **mask_core.load_kwargs(**kwargs))
+        size = mask_core.image_size(ocr_input)
+        if index == 0:
+            # Load the model before anything is timed.
+            mask_core.run_ocr([ocr_input], **full_kwargs)
+
+        timings = {}
+        masks = {}
+        for name, run_kwargs in (('full', full_kwargs), ('scaled', scaled_kwargs)):
+            start = time.perf_counter()
+            result = mask_core.run_ocr([ocr_input], **run_kwargs)[0]
+            timings[name] = time.perf_counter() - start
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                mask, mask_created, total = mask_core.build_mask(size, result, **kwargs)
+            masks[name] = mask if mask_core.passes_min_total_area(mask_created, total, **kwargs) else None
+
+        full, scaled = masks['full'], masks['scaled']
+        rows.append({
+            'image': os.path.basename(image_path),
+            'size': list(size),
+            'full_seconds': timings['full'],
+            'scaled_seconds': timings['scaled'],
+            'full_masked': full is not None,
+            'scaled_masked': scaled is not None,
+            'iou': scaled_detect.mask_iou(full, scaled) if full is not None and scaled is not None else None,
+        })
+
+    full_seconds = sum(row['full_seconds'] for row in rows)
+    scaled_seconds = sum(row['scaled_seconds'] for row in rows)
+    ious = [row['iou'] for row in rows if row['iou'] is not None]
+    return {
+        'sample': len(rows),
+        'detect_max_side': kwargs.get('detect_max_side'),
+        'detect_refine': bool(kwargs.get('detect_refine')),
+        'full_seconds': full_seconds,
+        'scaled_seconds': scaled_seconds,
+        'speedup': full_seconds / scaled_seconds if scaled_seconds else None,
+        'mean_iou': sum(ious) / len(ious) if ious else None,
+        'min_iou': min(ious) if ious else None,
+        'mask_agreement': sum(row['full_masked'] == row['scaled_masked'] for row in rows) / len(rows) if rows else None,
+        'missed': [row['image'] for row in rows if row['full_masked'] and not row['scaled_masked']],
+        'extra': [row['image'] for row in rows if row['scaled_masked'] and not row['full_masked']],
+        'images': rows,
+    }
+
+
+def write_report(report, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,203 @@
+import contextlib
+import cProfile
+import json
+import os
+import random
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Stage timers and counters for batch_create_masks. Every process keeps its
+# own Metrics; worker processes hand theirs to the parent with each finished
+# image (take), where they are merged into the run totals. Stage times are
+# exclusive: time spent in a stage nested inside another (decode inside
+# preprocess, render inside filter) only counts for the inner one. Nesting is
+# tracked per thread, since the pipeline decodes on its own thread. A bounded
+# random sample of single timings is kept per stage for the percentiles.
+
+STAGES = ('decode', 'preprocess', 'dedupe', 'prefilter', 'ocr', 'recognize', 'filter', 'render', 'save', 'export')
+LIVE_INTERVAL = 30
+TOP_ALLOCATIONS = 10
+MAX_SAMPLES = 10000
+PERCENTILES = (50, 90, 99)
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.reset()
+
+    def reset(self):
+        self.stages = {}
+        self.counters = Counter()
+        self._random = random.Random(0)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        stack = self._local.__dict__.setdefault('stack', [])
+        frame = [time.perf_counter(), 0.0]
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            stack.pop()
+            elapsed = time.perf_counter() - frame[0]
+            if stack:
+                stack[-1][1] += elapsed
+            self.add_time(name, elapsed - frame[1])
+
+    def add_time(self, name, seconds, count=1, longest=None, samples=None):
+        with self._lock:
+            entry = self.stages.setdefault(name, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'samples': []})
+            for sample in ([seconds] if samples is None else samples):
+                # Reservoir sampling, so every timing has the same chance to be kept.
+                entry['seen'] = entry.get('seen', 0) + 1
+                if len(entry['samples']) < MAX_SAMPLES:
+                    entry['samples'].append(sample)
+                else:
+                    slot = self._random.randrange(entry['seen'])
+                    if slot < MAX_SAMPLES:
+                        entry['samples'][slot] = sample
+            entry['count'] += count
+            entry['seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds if longest is None else longest)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def take(self):
+        # Plain copy of everything recorded since the last take, then start over.
+        with self._lock:
+            snapshot = {'stages': self.stages, 'counters': dict(self.counters)}
+            self.stages = {}
+            self.counters = Counter()
+        return snapshot
+
+    def merge(self, snapshot):
+        for name, entry in snapshot['stages'].items():
+            self.add_time(name, entry['seconds'], entry['count'], entry['max_seconds'], entry['samples'])
+        self.counters.update(snapshot['counters'])
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        stage_seconds = sum(entry['seconds'] for entry in self.stages.values())
+        names = [name for name in STAGES if name in self.stages] + sorted(set(self.stages) - set(STAGES))
+        images = self.counters.get('images', 0)
+        return {
+            'elapsed_seconds': elapsed,
+            'images_per_second': images / elapsed if elapsed else None,
+            # Summed over worker processes, so with --workers this can exceed
+            # elapsed_seconds.
+            'stage_seconds': stage_seconds,
+            'stages': {
+                name: {
+                    'count': self.stages[name]['count'],
+                    'seconds': self.stages[name]['seconds'],
+                    'mean_ms': self.stages[name]['seconds'] / self.stages[name]['count'] * 1000 if self.stages[name]['count'] else 0.0,
+                    'max_ms': self.stages[name]['max_seconds'] * 1000,
+                    'share': self.stages[name]['seconds'] / stage_seconds if stage_seconds else 0.0,
+                    **percentiles_ms(self.stages[name]['samples']),
+                }
+                for name in names
+            },
+            'counters': dict(self.counters),
+            'peak_rss_mb': peak_rss_mb(),
+        }
+
+
+def percentiles_ms(samples):
+    if not samples:
+        return {}
+    values = np.percentile(np.asarray(samples) * 1000, PERCENTILES)
+    return {f"p{p}_ms": float(value) for p, value in zip(PERCENTILES, values)}
+
+
+def peak_rss_mb():
+    # Peak resident memory of this process and of its finished children (the
+    # pipeline workers), where the platform reports it.
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    unit = 1 if os.uname().sysname == 'Darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit
+    return {'main': own / 2**20, 'children': children / 2**20}
+
+
+_METRICS = Metrics()
+_LIVE = {'path': None, 'interval': LIVE_INTERVAL, 'written': 0.0}
+
+
+def get_metrics():
+    return _METRICS
+
+
+def stage(name):
+    return _METRICS.stage(name)
+
+
+def count(name, amount=1):
+    _METRICS.count(name, amount)
+
+
+def write_json(data, path):
+    # Temp file then rename, so a scraper never reads half a file.
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def configure_live(path, interval=LIVE_INTERVAL):
+    _LIVE['path'] = path
+    _LIVE['interval'] = interval
+
+
+def tick():
+    # Rewrite the live metrics file if it is due. Only the process that
+    # configured it writes one.
+    if _LIVE['path'] is None:
+        return
+    now = time.perf_counter()
+    if now - _LIVE['written'] >= _LIVE['interval']:
+        write_json(_METRICS.summary(), _LIVE['path'])
+        _LIVE['written'] = now
+
+
+@contextlib.contextmanager
+def profiled(profile_path=None, trace_memory=False):
+    # Optional cProfile (stats dumped to profile_path, read them with pstats)
+    # and tracemalloc around a block. Yields a dict that gets the memory
+    # numbers once the block is done.
+    profile = cProfile.Profile() if profile_path else None
+    memory = {}
+    if trace_memory:
+        tracemalloc.start()
+    if profile is not None:
+        profile.enable()
+    try:
+        yield memory
+    finally:
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(profile_path)
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics('lineno')[:TOP_ALLOCATIONS]
+            tracemalloc.stop()
+            memory.update({
+                'current_mb': current / 2**20,
+                'peak_mb': peak / 2**20,
+                'top_allocations': [str(stat) for stat in top],
+            })
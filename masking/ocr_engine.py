@@ -0,0 +1,208 @@
+import importlib
+from collections import OrderedDict
+import numpy as np
+
+# Results from every backend use the easyocr layout: a list of
+# (box, text, confidence) tuples where box is four [x, y] points in the order
+# top-left, top-right, bottom-right, bottom-left. Detection-only results have
+# empty text and a confidence of None until they are recognized.
+
+
+def needs_recognition(result):
+    return any(detection[2] is None for detection in result)
+
+
+class OCRBackend:
+    def readtext(self, image):
+        raise NotImplementedError
+
+    def readtext_batched(self, images):
+        # Backends without a real batched path just loop.
+        return [self.readtext(image) for image in images]
+
+    def detect(self, image):
+        # Backends that can't run detection on its own do the full read.
+        return self.readtext(image)
+
+    def detect_batched(self, images):
+        return [self.detect(image) for image in images]
+
+    def recognize(self, image, result):
+        return self.readtext(image)
+
+
+class EasyOCRBackend(OCRBackend):
+    def __init__(self, languages=('en',), gpu=True):
+        self.languages = list(languages)
+        self.gpu = gpu
+        self._reader = None
+
+    @property
+    def reader(self):
+        # Import and load the weights on first use, so building an engine is
+        # cheap and processes that never hit OCR (cache hits etc.) skip it.
+        if self._reader is None:
+            import easyocr
+            self._reader = easyocr.Reader(self.languages, gpu=self.gpu)
+        return self._reader
+
+    def readtext(self, image):
+        return self.reader.readtext(image)
+
+    def readtext_batched(self, images):
+        height, width = images[0].shape[:2]
+        return self.reader.readtext_batched(images, n_width=width, n_height=height, batch_size=len(images))
+
+    def detect(self, image):
+        from easyocr.utils import reformat_input
+        image, _ = reformat_input(image)
+        horizontal_lists, free_lists = self.reader.detect(image)
+        return self._detections(horizontal_lists[0], free_lists[0], image.shape)
+
+    def detect_batched(self, images):
+        from easyocr.utils import reformat_input
+        batch = np.stack([reformat_input(image)[0] for image in images])
+        horizontal_lists, free_lists = self.reader.detect(batch, reformat=False)
+        return [self._detections(h, f, image.shape) for h, f, image in zip(horizontal_lists, free_lists, images)]
+
+    def recognize(self, image, result):
+        # Same recognizer call readtext makes after detection. The recognizer
+        # returns boxes in its own order (by kind, or sorted by top y when it
+        # batches), so its text is matched back to the detections by
+        # coordinates and the boxes the masks were drawn from are kept.
+        from easyocr.utils import reformat_input
+        _, gray = reformat_input(image)
+        horizontal_list, free_list = [], []
+        for box, _, _ in result:
+            xs = [int(point[0]) for point in box]
+            ys = [int(point[1]) for point in box]
+            if xs[0] == xs[3] and xs[1] == xs[2] and ys[0] == ys[1] and ys[2] == ys[3]:
+                horizontal_list.append([min(xs), max(xs), min(ys), max(ys)])
+            else:
+                free_list.append([[x, y] for x, y in zip(xs, ys)])
+        recognized = {}
+        for box, text, confidence in self.reader.recognize(gray, horizontal_list=horizontal_list, free_list=free_list):
+            recognized.setdefault(self._box_key(box), []).append((text, confidence))
+        read = []
+        for box, _, _ in result:
+            matches = recognized.get(self._box_key(box))
+            # A box the recognizer dropped counts as read, with no text.
+            text, confidence = matches.pop(0) if matches else ('', 0.0)
+            read.append((box, text, confidence))
+        return read
+
+    @staticmethod
+    def _box_key(box):
+        return tuple((int(point[0]), int(point[1])) for point in box)
+
+    @staticmethod
+    def _detections(horizontal_list, free_list, shape):
+        # Boxes as readtext reports them: get_image_list clamps horizontal
+        # boxes to the image, drops empty ones and sorts everything by top y.
+        height, width = shape[:2]
+        result = []
+        for x_min, x_max, y_min, y_max in horizontal_list:
+            x_min, x_max, y_min, y_max = max(0, int(x_min)), min(int(x_max), width), max(0, int(y_min)), min(int(y_max), height)
+            if x_max > x_min and y_max > y_min:
+                result.append(([[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]], '', None))
+        result.extend(([[int(x), int(y)] for x, y in box], '', None) for box in free_list)
+        result.sort(key=lambda detection: detection[0][0][1])
+        return result
+
+
+class StubBackend(OCRBackend):
+    # Stand-in for tests and benchmarks. Either returns a fixed result for every
+    # image or calls detect_fn(image) to build one.
+    def __init__(self, detect_fn=None, results=None):
+        self.detect_fn = detect_fn
+        self.results = results or []
+        self.calls = 0
+
+    def readtext(self, image):
+        self.calls += 1
+        if self.detect_fn is not None:
+            return self.detect_fn(image)
+        return list(self.results)
+
+    def detect(self, image):
+        return [(box, '', None) for box, _, _ in self.readtext(image)]
+
+
+BACKENDS = {
+    'easyocr': EasyOCRBackend,
+    'stub': StubBackend,
+}
+
+
+def register_backend(name, backend_class):
+    BACKENDS[name] = backend_class
+
+
+def resolve_backend(name):
+    # Accept either a registered name or a "module:Class" import path, so a
+    # backend defined outside this module can still be picked from the CLI
+    # and from freshly spawned worker processes.
+    if name in BACKENDS:
+        return BACKENDS[name]
+    if ':' in name:
+        module_name, attr = name.split(':', 1)
+        return getattr(importlib.import_module(module_name), attr)
+    raise ValueError(f"Unknown OCR backend '{name}'. Choices are {', '.join(BACKENDS)} or module:Class")
+
+
+class OCREngine:
+    def __init__(self, backend, batch_size=1):
+        self.backend = backend
+        self.batch_size = max(1, int(batch_size))
+
+    def readtext(self, image):
+        return self.backend.readtext(image)
+
+    def detect(self, image):
+        return self.backend.detect(image)
+
+    def recognize(self, image, result):
+        if not result:
+            return result
+        return self.backend.recognize(image, result)
+
+    def readtext_many(self, images):
+        return self._run_many(images, self.backend.readtext, self.backend.readtext_batched)
+
+    def detect_many(self, images):
+        return self._run_many(images, self.backend.detect, self.backend.detect_batched)
+
+    def _run_many(self, images, single, batched):
+        # Group same-size arrays so they can go through the batched path
+        # together; results come back in the order the images were given.
+        results = [None] * len(images)
+        groups = OrderedDict()
+        for index, image in enumerate(images):
+            if isinstance(image, str):
+                results[index] = single(image)
+            else:
+                groups.setdefault(image.shape, []).append(index)
+
+        for indices in groups.values():
+            for start in range(0, len(indices), self.batch_size):
+                chunk = indices[start:start + self.batch_size]
+                if len(chunk) == 1:
+                    results[chunk[0]] = single(images[chunk[0]])
+                    continue
+                batch_results = batched([images[i] for i in chunk])
+                for index, result in zip(chunk, batch_results):
+                    results[index] = result
+
+        return results
+
+
+_ENGINES = {}
+
+
+def get_engine(backend='easyocr', batch_size=1, **options):
+    # One engine per process and configuration, so the model weights are only
+    # loaded once no matter how many images go through it.
+    key = (backend, batch_size, tuple(sorted((k, repr(v)) for k, v in options.items())))
+    if key not in _ENGINES:
+        _ENGINES[key] = OCREngine(resolve_backend(backend)(**options), batch_size=batch_size)
+    return _ENGINES[key]
@@ -0,0 +1,151 @@
+import numpy as np
+
+# OCR over parts of an image instead of the whole frame. Regions are
+# (x1, y1, x2, y2) rectangles in image coordinates; each one is OCR'd as a view
+# into the decoded array, boxes are shifted back to image coordinates, and
+# detections that overlap across region seams are merged into one.
+
+SEAM_OVERLAP = 0.5  # intersection over the smaller box needed to merge across a seam
+SEAM_LINE_OVERLAP = 0.5  # vertical overlap over the shorter box for pieces of one line cut at a seam
+SEAM_GAP = 0.2  # horizontal gap allowed between those pieces, as a fraction of the shorter box height
+
+
+def border_regions(width, height, xpad, ypad, margin, corners=False):
+    # Strips along the borders, reaching margin pixels past the padding so text
+    # touching the padding line is not cut off. Left/right strips only cover
+    # the span between the top and bottom strips, plus margin to overlap them.
+    # Every box that contains a corner point crosses the top or bottom padding
+    # line, so corners mode only needs the top and bottom strips.
+    strip_h = min(height, ypad + margin)
+    strip_w = min(width, xpad + margin)
+    regions = [(0, 0, width, strip_h), (0, max(0, height - strip_h), width, height)]
+    if not corners:
+        y1 = max(0, strip_h - margin)
+        y2 = min(height, height - strip_h + margin)
+        if y2 > y1:
+            regions.append((0, y1, strip_w, y2))
+            regions.append((max(0, width - strip_w), y1, width, y2))
+    # Tiny images: the strips already cover everything.
+    return list(dict.fromkeys(region for region in regions if region[2] > region[0] and region[3] > region[1]))
+
+
+def tile_starts(start, stop, tile, overlap):
+    if stop - start <= tile:
+        return [start]
+    step = tile - overlap
+    starts = list(range(start, stop - tile, step))
+    starts.append(stop - tile)
+    return starts
+
+
+def split_regions(regions, tile, overlap):
+    # Cut regions larger than tile x tile into overlapping tiles. The last tile
+    # in each row and column is shifted back to end on the region edge, so every
+    # tile has the same size and same-size tiles can share a batch.
+    tiles = []
+    for x1, y1, x2, y2 in regions:
+        for ty in tile_starts(y1, y2, tile, overlap):
+            for tx in tile_starts(x1, x2, tile, overlap):
+                tiles.append((tx, ty, min(x2, tx + tile), min(y2, ty + tile)))
+    return tiles
+
+
+def box_bounds(box):
+    xs = [point[0] for point in box]
+    ys = [point[1] for point in box]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def rect_box(x1, y1, x2, y2):
+    return [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+
+
+def offset_result(result, dx, dy):
+    return [
+        ([[point[0] + dx, point[1] + dy] for point in detection[0]], detection[1], detection[2])
+        for detection in result
+    ]
+
+
+def merge_detections(tagged, regions=None):
+    # tagged is [(region_index, detection)]. Boxes from different regions that
+    # mostly overlap are the same text seen twice and are merged into their
+    # union; boxes within one region are left as the engine returned them.
+    # With the region rectangles given, a line cut at a seam is merged too:
+    # its pieces overlap vertically, touch or overlap horizontally, and both
+    # reach into the band where the two regions overlap.
+    if not tagged:
+        return []
+    bounds = np.array([box_bounds(detection[0]) for _, detection in tagged], dtype=np.float64)
+    owners = np.array([region for region, _ in tagged])
+    areas = (bounds[:, 2] - bounds[:, 0]) * (bounds[:, 3] - bounds[:, 1])
+    heights = bounds[:, 3] - bounds[:, 1]
+    if regions:
+        rects = np.array(regions, dtype=np.float64)[owners]
+
+    parent = list(range(len(tagged)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i in range(len(tagged)):
+        iw = np.minimum(bounds[i, 2], bounds[i + 1:, 2]) - np.maximum(bounds[i, 0], bounds[i + 1:, 0])
+        ih = np.minimum(bounds[i, 3], bounds[i + 1:, 3]) - np.maximum(bounds[i, 1], bounds[i + 1:, 1])
+        inter = np.clip(iw, 0, None) * np.clip(ih, 0, None)
+        smaller = np.maximum(np.minimum(areas[i], areas[i + 1:]), 1e-9)
+        same = inter / smaller >= SEAM_OVERLAP
+        if regions:
+            shorter = np.maximum(np.minimum(heights[i], heights[i + 1:]), 1e-9)
+            reach = SEAM_GAP * shorter
+            band = np.stack([
+                np.maximum(rects[i, 0], rects[i + 1:, 0]) - reach,
+                np.maximum(rects[i, 1], rects[i + 1:, 1]),
+                np.minimum(rects[i, 2], rects[i + 1:, 2]) + reach,
+                np.minimum(rects[i, 3], rects[i + 1:, 3]),
+            ], axis=1)
+            in_band = (
+                (bounds[i, 0] <= band[:, 2]) & (bounds[i, 2] >= band[:, 0]) & (bounds[i, 1] <= band[:, 3]) & (bounds[i, 3] >= band[:, 1])
+                & (bounds[i + 1:, 0] <= band[:, 2]) & (bounds[i + 1:, 2] >= band[:, 0]) & (bounds[i + 1:, 1] <= band[:, 3]) & (bounds[i + 1:, 3] >= band[:, 1])
+            )
+            same |= (ih / shorter >= SEAM_LINE_OVERLAP) & (iw >= -reach) & in_band
+        matches = np.flatnonzero(same & (owners[i + 1:] != owners[i]))
+        for j in (matches + i + 1).tolist():
+            parent[find(j)] = find(i)
+
+    groups = {}
+    for i in range(len(tagged)):
+        groups.setdefault(find(i), []).append(i)
+
+    merged = []
+    for members in groups.values():
+        if len(members) == 1:
+            merged.append(tagged[members[0]][1])
+            continue
+        x1, y1 = bounds[members, 0].min(), bounds[members, 1].min()
+        x2, y2 = bounds[members, 2].max(), bounds[members, 3].max()
+        # Keep the text of the biggest piece, it saw the most of the line.
+        largest = tagged[max(members, key=lambda i: areas[i])][1]
+        confidences = [tagged[i][1][2] for i in members]
+        confidence = None if None in confidences else min(confidences)
+        merged.append((rect_box(x1.item(), y1.item(), x2.item(), y2.item()), largest[1], confidence))
+    return merged
+
+
+def ocr_regions_many(engine, images, regions_per_image, detect_only=False):
+    # OCR the given regions of every image in one engine call, so same-size
+    # crops from different images can share a batch.
+    crops = []
+    owners = []
+    for image_index, (image, regions) in enumerate(zip(images, regions_per_image)):
+        for region_index, (x1, y1, x2, y2) in enumerate(regions):
+            crops.append(image[y1:y2, x1:x2])
+            owners.append((image_index, region_index, x1, y1))
+
+    tagged = [[] for _ in images]
+    run_many = engine.detect_many if detect_only else engine.readtext_many
+    for (image_index, region_index, x1, y1), result in zip(owners, run_many(crops)):
+        tagged[image_index].extend((region_index, detection) for detection in offset_result(result, x1, y1))
+    return [merge_detections(image_tagged, regions) for image_tagged, regions in zip(tagged, regions_per_image)]
@@ -0,0 +1,120 @@
+import cv2
+import numpy as np
+
+# 64-bit perceptual hashes for spotting near-duplicate frames, plus an index
+# that finds every stored hash within a Hamming distance without comparing
+# against all of them.
+#
+#   phash  signs of the low-frequency DCT of a 32x32 grayscale, against
+#          their median; survives recompression, small crops and gamma
+#   dhash  signs of horizontal gradients of a 9x8 grayscale; cheaper and a
+#          bit less robust
+#
+# HammingIndex is multi-index hashing: the 64 bits are cut into r + 1 chunks,
+# and by the pigeonhole principle two hashes at most r bits apart are equal in
+# at least one chunk. Each chunk has its own table, so a query only looks at
+# hashes sharing a chunk with it and then checks the real distance.
+
+HASH_METHODS = ('phash', 'dhash')
+HASH_BITS = 64
+
+
+def grayscale(image):
+    if image.ndim == 3:
+        return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    return image
+
+
+def to_int(bits):
+    value = 0
+    for bit in bits.ravel():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def phash(image):
+    small = cv2.resize(grayscale(image), (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].ravel()
+    # The DC term is overall brightness, leave it out of the median.
+    return to_int(low > np.median(low[1:]))
+
+
+def dhash(image):
+    small = cv2.resize(grayscale(image), (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return to_int(small[:, 1:] > small[:, :-1])
+
+
+def image_hash(image, method='phash'):
+    return phash(image) if method == 'phash' else dhash(image)
+
+
+def file_hash(path, method='phash'):
+    # Decoding at a quarter of the size is plenty for a 32x32 hash and lets
+    # JPEGs skip most of the IDCT. None if the file can't be read.
+    image = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_4 | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is not None and min(image.shape[:2]) < 32:
+        image = cv2.imread(path, cv2.IMREAD_GRAYSCALE | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        return None
+    return image_hash(image, method)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class HammingIndex:
+    def __init__(self, max_distance):
+        self.max_distance = max_distance
+        chunks = min(max_distance + 1, HASH_BITS)
+        bounds = [int(bound) for bound in np.linspace(0, HASH_BITS, chunks + 1)]
+        # (shift, mask) of every chunk.
+        self.chunks = [(start, (1 << (end - start)) - 1) for start, end in zip(bounds[:-1], bounds[1:])]
+        self.tables = [{} for _ in self.chunks]
+        self.items = []
+
+    def add(self, value, item):
+        entry = len(self.items)
+        self.items.append((value, item))
+        for table, (shift, mask) in zip(self.tables, self.chunks):
+            table.setdefault((value >> shift) & mask, []).append(entry)
+
+    def nearest(self, value):
+        # (distance, item) of the closest stored hash within max_distance,
+        # the first one added on ties, or None.
+        entries = set()
+        for table, (shift, mask) in zip(self.tables, self.chunks):
+            entries.update(table.get((value >> shift) & mask, ()))
+        best = None
+        for entry in entries:
+            distance = hamming(value, self.items[entry][0])
+            if distance <= self.max_distance and (best is None or (distance, entry) < best):
+                best = (distance, entry)
+        if best is None:
+            return None
+        return best[0], self.items[best[1]][1]
+
+
+class FrameIndex:
+    # Hashes bucketed by image size, for reuse that needs the same size.
+    def __init__(self, max_distance, method='phash'):
+        self.max_distance = max_distance
+        self.method = method
+        self.buckets = {}
+
+    def add(self, size, value, item):
+        self.buckets.setdefault(size, HammingIndex(self.max_distance)).add(value, item)
+
+    def nearest(self, size, value):
+        index = self.buckets.get(size)
+        return index.nearest(value) if index is not None else None
+
+
+_FRAME_INDEXES = {}
+
+
+def get_frame_index(max_distance, method='phash'):
+    key = (max_distance, method)
+    if key not in _FRAME_INDEXES:
+        _FRAME_INDEXES[key] = FrameIndex(max_distance, method)
+    return _FRAME_INDEXES[key]
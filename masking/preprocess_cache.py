@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+# On-disk store of preprocessed (grayscale / binary) images for --use-cache.
+# Entries are keyed by the source's content hash plus the preprocessing
+# settings, so an edited source or a different --use-binary never reads a
+# stale entry. Each entry is a .npy file loaded memory-mapped. Hits bump the
+# file's mtime, and once the folder grows past its byte budget the least
+# recently used entries are deleted until it is down to LOW_WATER of the
+# budget, so a full cache doesn't evict on every put. Sizes and ages are kept
+# in memory; the folder is only walked when opening it and when evicting, to
+# pick up entries other processes wrote.
+
+CACHE_MAX_MB = 2048
+LOW_WATER = 0.9
+ENTRY_SUFFIX = '.npy'
+
+
+def cache_key(digest, params):
+    return hashlib.sha256((digest + json.dumps(params, sort_keys=True)).encode('utf-8')).hexdigest()
+
+
+class PreprocessCache:
+    def __init__(self, folder, max_bytes=CACHE_MAX_MB * 2**20):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        os.makedirs(folder, exist_ok=True)
+        self._scan()
+        if max_bytes is not None and self.total_bytes > max_bytes:
+            self.evict()
+
+    def _path(self, key):
+        return os.path.join(self.folder, key[:2], key + ENTRY_SUFFIX)
+
+    def _scan(self):
+        # {path: [size, mtime]} of every entry, including ones other processes wrote.
+        self.entries = {}
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                if not name.endswith(ENTRY_SUFFIX):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                self.entries[path] = [stat.st_size, stat.st_mtime]
+        self.total_bytes = sum(size for size, _ in self.entries.values())
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            array = np.load(path, mmap_mode='r')
+            os.utime(path)
+        except (OSError, ValueError):
+            # Missing, evicted meanwhile, or cut short: treat as a miss.
+            return None
+        if path in self.entries:
+            self.entries[path][1] = time.time()
+        return array
+
+    def put(self, key, array):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write next to the entry and rename, so readers never see half a file.
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.replace(temp_path, path)
+        size = os.path.getsize(path)
+        previous = self.entries.get(path)
+        self.total_bytes += size - (previous[0] if previous else 0)
+        self.entries[path] = [size, time.time()]
+        if self.max_bytes is not None and self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        # Oldest first until the folder is down to the low-water mark.
+        self._scan()
+        target = self.max_bytes * LOW_WATER
+        for path, (size, _) in sorted(self.entries.items(), key=lambda item: item[1][1]):
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # Still mapped by a reader on Windows; leave it for next time.
+                continue
+            del self.entries[path]
+            self.total_bytes -= size
+
+
+_CACHES = {}
+
+
+def get_preprocess_cache(folder, max_bytes=CACHE_MAX_MB * 2**20):
+    key = (folder, max_bytes)
+    if key not in _CACHES:
+        _CACHES[key] = PreprocessCache(folder, max_bytes)
+    return _CACHES[key]
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import sqlite3
+
+from detection_cache import file_digest
+
+# Per-image record of what the last run produced, so a re-run only redoes
+# images whose file or output-relevant settings changed. Each row holds the
+# source's size, mtime and content hash, a hash of the settings the mask was
+# made with, and whether a mask was written. Rows are only added once the mask
+# is fully on disk, so an image interrupted mid-write is redone next time.
+
+WRITTEN = 'written'
+NO_MASK = 'no_mask'
+
+
+def settings_hash(settings):
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class RunJournal:
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            " image TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " digest TEXT NOT NULL,"
+            " settings TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " output TEXT)"
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def image_key(image_path):
+        return os.path.abspath(image_path)
+
+    def get(self, image_path):
+        row = self.connection.execute(
+            "SELECT size, mtime_ns, digest, settings, status, output FROM images WHERE image = ?",
+            (self.image_key(image_path),),
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('size', 'mtime_ns', 'digest', 'settings', 'status', 'output'), row))
+
+    def is_current(self, entry, image_path, settings):
+        # Same settings and same file. A changed mtime alone (copied or touched
+        # file) falls back to comparing content hashes.
+        if entry['settings'] != settings_hash(settings):
+            return False
+        stat = os.stat(image_path)
+        if stat.st_size != entry['size']:
+            return False
+        if stat.st_mtime_ns == entry['mtime_ns']:
+            return True
+        return file_digest(image_path) == entry['digest']
+
+    def record(self, image_path, settings, status, output=None, digest=None):
+        stat = os.stat(image_path)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO images (image, size, mtime_ns, digest, settings, status, output) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                self.image_key(image_path),
+                stat.st_size,
+                stat.st_mtime_ns,
+                digest or file_digest(image_path),
+                settings_hash(settings),
+                status,
+                output,
+            ),
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+_JOURNALS = {}
+
+
+def get_run_journal(path):
+    if path not in _JOURNALS:
+        _JOURNALS[path] = RunJournal(path)
+    return _JOURNALS[path]
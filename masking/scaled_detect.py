@@ -0,0 +1,96 @@
+import cv2
+import numpy as np
+
+import ocr_regions
+
+# Run the text detector on a downscaled copy of large images and scale the
+# boxes back to full resolution. The text we mask is big, so detection holds up
+# well at a fraction of the pixels. With refinement the boxes found on the
+# small copy only pick the regions that get a second, full-resolution pass.
+
+REFINE_MARGIN = 32  # full-resolution pixels added around each candidate box
+
+
+def downscale(image, max_side):
+    # Returns (image, scale) with scale = new size / old size.
+    if isinstance(image, str):
+        return image, 1.0
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1.0:
+        return image, 1.0
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA), scale
+
+
+def scale_result(result, factor):
+    return [
+        ([[point[0] * factor, point[1] * factor] for point in detection[0]], detection[1], detection[2])
+        for detection in result
+    ]
+
+
+class ScaledEngine:
+    # Wraps an OCREngine so every image (or region crop) is detected at no more
+    # than max_side pixels per side, with boxes in the caller's coordinates.
+    def __init__(self, engine, max_side):
+        self.engine = engine
+        self.max_side = max_side
+        self.batch_size = engine.batch_size
+
+    def readtext_many(self, images):
+        return self._run_many(images, self.engine.readtext_many)
+
+    def detect_many(self, images):
+        return self._run_many(images, self.engine.detect_many)
+
+    def recognize(self, image, result):
+        # Recognition reads crops from the full-resolution image.
+        return self.engine.recognize(image, result)
+
+    def _run_many(self, images, run_many):
+        if not images:
+            return []
+        scaled = [downscale(image, self.max_side) for image in images]
+        results = run_many([image for image, _ in scaled])
+        return [scale_result(result, 1 / scale) if scale != 1.0 else result for (_, scale), result in zip(scaled, results)]
+
+
+def merge_rects(rects):
+    # Union overlapping rectangles until none overlap, so text isn't detected
+    # once per overlapping candidate.
+    rects = [list(rect) for rect in rects]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(len(rects) - 1, i, -1):
+                a, b = rects[i], rects[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    rects[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del rects[j]
+                    merged = True
+    return [tuple(rect) for rect in rects]
+
+
+def refine_regions(size, result, margin=REFINE_MARGIN):
+    width, height = size
+    rects = []
+    for detection in result:
+        x1, y1, x2, y2 = ocr_regions.box_bounds(detection[0])
+        rect = (
+            max(0, int(np.floor(x1)) - margin),
+            max(0, int(np.floor(y1)) - margin),
+            min(width, int(np.ceil(x2)) + margin),
+            min(height, int(np.ceil(y2)) + margin),
+        )
+        if rect[2] > rect[0] and rect[3] > rect[1]:
+            rects.append(rect)
+    return merge_rects(rects)
+
+
+def mask_iou(a, b):
+    a = a == 0
+    b = b == 0
+    union = np.count_nonzero(a | b)
+    return np.count_nonzero(a & b) / union if union else 1.0
@@ -0,0 +1,77 @@
+import io
+import os
+import posixpath
+import tarfile
+import time
+
+# Tar shard datasets (WebDataset layout): each shard is a plain tar whose
+# members are named <key>.<ext>, and all files of one sample (image, mask,
+# .txt) share the key. Shards are read as a stream, front to back, so a shard
+# costs one open and sequential reads no matter how many images it holds.
+# Output shards use the same member names the loose-file layout would use for
+# the files, e.g. img001.png -> mask img001.png and img001.txt.
+
+SHARD_EXTENSIONS = ('.tar',)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+def list_shards(folder):
+    return sorted(os.path.join(folder, f) for f in os.listdir(folder) if f.lower().endswith(SHARD_EXTENSIONS))
+
+
+def split_key(name):
+    # 'dir/img001.png' -> ('dir/img001', '.png'). Like the loose layout, only
+    # the last extension is split off.
+    key, ext = posixpath.splitext(name)
+    return key, ext.lower()
+
+
+def iter_members(shard_path):
+    # (name, bytes) for every regular file, in tar order.
+    with tarfile.open(shard_path, mode='r|*') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            yield member.name, tar.extractfile(member).read()
+
+
+def iter_images(shard_path):
+    # (member name, bytes) for the images in a shard.
+    for name, data in iter_members(shard_path):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            yield name, data
+
+
+class ShardWriter:
+    # Writes members into a new tar. Everything goes to a temporary file that
+    # is renamed over the shard on close, so a shard on disk is always whole.
+    def __init__(self, shard_path):
+        self.shard_path = shard_path
+        self.temp_path = f"{shard_path}.{os.getpid()}.tmp"
+        self.tar = tarfile.open(self.temp_path, mode='w')
+        self.mtime = time.time()
+
+    def write(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = self.mtime
+        info.mode = 0o644
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self.tar.close()
+        os.replace(self.temp_path, self.shard_path)
+
+    def abort(self):
+        self.tar.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
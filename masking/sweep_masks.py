@@ -0,0 +1,229 @@
+import os
+import argparse
+import itertools
+import json
+import contextlib
+import multiprocessing
+import numpy as np
+from tqdm import tqdm
+
+import mask_core
+import mask_io
+from ocr_engine import get_engine
+
+# Try a grid of mask settings against one OCR pass. Detections come from the
+# detection cache (or OCR on a miss), then every configuration is evaluated
+# against every image in parallel without writing anything, unless
+# --write-config picks one to write out.
+
+GRID_PARAMS = [
+    # (option, kwargs name, type)
+    ('min_area', 'min_area', float),
+    ('max_area', 'max_area', float),
+    ('min_total_area', 'min_total_area', float),
+    ('xpad_detect', 'xpad_detect', int),
+    ('ypad_detect', 'ypad_detect', int),
+    ('contain', 'contain_bounding_boxes', 'flag'),
+    ('draw_contain', 'draw_contain', 'flag'),
+    ('contain_under_min', 'contain_under_min', 'flag'),
+]
+
+CHUNK_SIZE = 64
+
+
+def parse_flag(value):
+    value = value.lower()
+    if value in ('1', 'true', 'yes', 'on'):
+        return True
+    if value in ('0', 'false', 'no', 'off'):
+        return False
+    raise argparse.ArgumentTypeError(f"Expected on/off, got '{value}'")
+
+
+def build_configs(args, base):
+    names = [name for _, name, _ in GRID_PARAMS]
+    values = [getattr(args, option) for option, _, _ in GRID_PARAMS]
+    configs = []
+    for combo in itertools.product(*values):
+        config = dict(base)
+        config.update(zip(names, combo))
+        configs.append(config)
+    return configs
+
+
+def describe(config):
+    return {name: config[name] for _, name, _ in GRID_PARAMS}
+
+
+def collect_detections(image_paths, engine, **kwargs):
+    # OCR every image once, or take it from the detection cache.
+    # Returns [(image_path, (width, height), result)] in input order.
+    detections = [None] * len(image_paths)
+    for start in tqdm(range(0, len(image_paths), engine.batch_size), desc="Reading detections"):
+        loaded = []
+        for index in range(start, min(start + engine.batch_size, len(image_paths))):
+            image_path = image_paths[index]
+            size, ocr_input, digest, result = mask_core.load_for_ocr(image_path, **kwargs)
+            if result is not None:
+                detections[index] = (image_path, size, result)
+            else:
+                loaded.append((index, size, ocr_input, digest))
+
+        results = mask_core.run_ocr([ocr_input for _, _, ocr_input, _ in loaded], engine=engine, **kwargs)
+        for (index, size, _, digest), result in zip(loaded, results):
+            mask_core.store_detections(size, digest, result, **kwargs)
+            detections[index] = (image_paths[index], size, result)
+    return detections
+
+
+def new_stats():
+    return {'images': 0, 'masked': 0, 'below_min_total_area': 0, 'no_boxes': 0, 'masked_area_sum': 0.0}
+
+
+def evaluate_chunk(task):
+    configs, detections = task
+    stats = [new_stats() for _ in configs]
+    # draw_boxes reports per image; that is just noise over a whole grid.
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _, size, result in detections:
+            for config, stat in zip(configs, stats):
+                mask, mask_created, total = mask_core.build_mask(size, result, **config)
+                stat['images'] += 1
+                if mask_core.passes_min_total_area(mask_created, total, **config):
+                    stat['masked'] += 1
+                    stat['masked_area_sum'] += np.count_nonzero(mask == 0) / mask.size * 100
+                elif total == 0:
+                    stat['no_boxes'] += 1
+                else:
+                    stat['below_min_total_area'] += 1
+    return stats
+
+
+def run_sweep(configs, detections, workers):
+    chunks = [(configs, detections[i:i + CHUNK_SIZE]) for i in range(0, len(detections), CHUNK_SIZE)]
+    totals = [new_stats() for _ in configs]
+
+    if workers > 1:
+        pool = multiprocessing.get_context('spawn').Pool(workers)
+        results = pool.imap_unordered(evaluate_chunk, chunks)
+    else:
+        pool = None
+        results = map(evaluate_chunk, chunks)
+
+    try:
+        for chunk_stats in tqdm(results, total=len(chunks), desc="Evaluating configurations"):
+            for total, stat in zip(totals, chunk_stats):
+                for key, value in stat.items():
+                    total[key] += value
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    report = []
+    for index, (config, total) in enumerate(zip(configs, totals)):
+        masked_area_sum = total.pop('masked_area_sum')
+        total['mean_masked_area_percent'] = masked_area_sum / total['masked'] if total['masked'] else 0.0
+        report.append({'config': index, 'params': describe(config), 'stats': total})
+    return report
+
+
+def write_config(config, detections, engine):
+    for image_path, size, result in tqdm(detections, desc="Writing masks"):
+        kwargs = dict(config, image_path=image_path, engine=engine)
+        if not mask_core.should_process(**kwargs):
+            continue
+        mask_core.finish_image(size, result, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate a grid of batch_create_masks settings with one OCR pass per image.')
+    parser.add_argument('--path', required=True, help='Path to the source directory of images.')
+    parser.add_argument('--out', default='./masks', help='Output directory for masks written with --write-config.')
+    parser.add_argument('--report', help='Write the per-configuration stats to this JSON file.')
+    parser.add_argument('--write-config', type=int, help='Index of the configuration to write masks for.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Processes used to evaluate configurations. Default is the number of CPUs.')
+
+    # Grid parameters, each takes one or more values.
+    parser.add_argument('--min-area', type=float, nargs='+', default=[0.1], help='Values for --min-area.')
+    parser.add_argument('--max-area', type=float, nargs='+', default=[10], help='Values for --max-area.')
+    parser.add_argument('--min-total-area', type=float, nargs='+', default=[0.1], help='Values for --min-total-area.')
+    parser.add_argument('--xpad-detect', type=int, nargs='+', default=[256], help='Values for --xpad-detect.')
+    parser.add_argument('--ypad-detect', type=int, nargs='+', default=[256], help='Values for --ypad-detect.')
+    parser.add_argument('--contain', type=parse_flag, nargs='+', default=[False], help='Values for --contain (on/off).')
+    parser.add_argument('--draw-contain', type=parse_flag, nargs='+', default=[False], help='Values for --draw-contain (on/off).')
+    parser.add_argument('--contain-under-min', type=parse_flag, nargs='+', default=[False], help='Values for --contain-under-min (on/off).')
+
+    # Fixed settings, same meaning as in mask_core.py.
+    parser.add_argument('--corners', action='store_true', help='Include only masks touching corners.')
+    parser.add_argument('--edges', action='store_true', help='Include masks touching edges.')
+    parser.add_argument('--only-largest', action='store_true', help='Only keep the largest detected mask.')
+    parser.add_argument('--xpad-box', type=int, default=0, help='Horizontal padding for bounding box.')
+    parser.add_argument('--ypad-box', type=int, default=0, help='Vertical padding for bounding box.')
+    parser.add_argument('--text-direction', default='horizontal', choices=['horizontal', 'vertical', 'any'], help='Orientation of the bounding box.')
+    parser.add_argument('--contain-max-nodes', type=int, default=mask_core.MAX_COMBINATIONS, help='Cap on the contain search per image.')
+    parser.add_argument('--keep-boxes', type=int, default=mask_core.KEEP_BOXES, help='Boxes kept with contain when no group fits in the max area.')
+    parser.add_argument('--use-color', type=bool, default=True, help='Use color images instead of grayscale.')
+    parser.add_argument('--use-binary', action='store_true', help='Use binary black/white instead of grayscale.')
+    parser.add_argument('--include-textfile', action='store_true', help='Include text file with --write-config.')
+    parser.add_argument('--include-empty', action='store_true', help='Include blank masks with --write-config.')
+    parser.add_argument('--overwrite', action='store_true', help='Overwrite existing mask files with --write-config.')
+    parser.add_argument('--mask-format', default='image', choices=mask_io.MASK_FORMATS, help='Mask format for --write-config.')
+    parser.add_argument('--ocr-backend', default='easyocr', help='OCR backend to use for images not in the detection cache.')
+    parser.add_argument('--batch-size', type=int, default=1, help='Number of images sent to the OCR engine at once.')
+    parser.add_argument('--detection-cache', help='Detection cache file. Defaults to <path>_detections.sqlite.')
+
+    args = parser.parse_args()
+
+    detection_cache = args.detection_cache or args.path.rstrip('/\\') + '_detections.sqlite'
+    base = {
+        'out_folder': args.out,
+        'include_textfile': args.include_textfile,
+        'use_color': args.use_color,
+        'use_binary': args.use_binary,
+        'xpad_box': args.xpad_box,
+        'ypad_box': args.ypad_box,
+        'corners': args.corners,
+        'edges': args.edges,
+        'only_largest': args.only_largest,
+        'overwrite': args.overwrite,
+        'text_direction': args.text_direction,
+        'contain_max_nodes': args.contain_max_nodes,
+        'keep_boxes': args.keep_boxes,
+        'include_empty': args.include_empty,
+        'mask_format': args.mask_format,
+        'ocr_backend': args.ocr_backend,
+        'detection_cache': detection_cache,
+    }
+    configs = build_configs(args, base)
+
+    image_files = [f for f in os.listdir(args.path) if f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff'))]
+    image_paths = [os.path.join(args.path, f) for f in image_files]
+    tqdm.write(f"Total images: {len(image_paths)}")
+    tqdm.write(f"Configurations: {len(configs)}")
+    tqdm.write(f"Detection cache: {detection_cache}")
+
+    engine = get_engine(backend=args.ocr_backend, batch_size=args.batch_size)
+    detections = collect_detections(image_paths, engine, **base)
+    report = run_sweep(configs, detections, max(1, args.workers or 1))
+
+    for entry in report:
+        stats = entry['stats']
+        tqdm.write(
+            f"[{entry['config']}] {entry['params']}: masked {stats['masked']}/{stats['images']}, "
+            f"mean masked area {stats['mean_masked_area_percent']:.2f}%, "
+            f"below --min-total-area {stats['below_min_total_area']}, no boxes {stats['no_boxes']}"
+        )
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.write_config is not None:
+        if not os.path.exists(args.out):
+            os.mkdir(args.out)
+        write_config(configs[args.write_config], detections, engine)
+
+
+if __name__ == "__main__":
+    main()
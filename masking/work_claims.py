@@ -0,0 +1,168 @@
+import os
+import socket
+import threading
+import time
+import uuid
+import zlib
+
+from run_journal import settings_hash
+
+# Splitting one mask run over several processes, on any number of machines
+# that share the input and output folders, without a coordinator.
+#
+# --shard i/N keeps the images whose file name hashes to i (crc32 mod N), so
+# runs started with 0/N .. N-1/N cover every image exactly once without
+# talking to each other.
+#
+# --claim lets any number of runs pull from the same list instead. Before an
+# image is processed its lease file is created with O_CREAT | O_EXCL, which
+# only one process can win (also on NFS v3 and later). A finished image gets a
+# done file holding the hash of the settings it was made with, so no other run
+# takes it again. Leases are touched while they are held; one left untouched
+# for longer than the TTL belongs to a run that died and is taken over.
+
+LEASE_SUFFIX = '.lease'
+DONE_SUFFIX = '.done'
+LEASE_TTL = 600
+
+
+def parse_shard(value):
+    # 'i/N' -> (i, N), raises ValueError when it is not a valid shard.
+    index, count = (int(part) for part in value.split('/'))
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard {value}")
+    return index, count
+
+
+def in_shard(name, index, count):
+    # Only the file name counts, so every host agrees whatever the mount point.
+    return zlib.crc32(os.path.basename(name).encode('utf-8')) % count == index
+
+
+def read_token(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read().split(' ', 1)[0]
+
+
+class WorkClaims:
+    def __init__(self, folder, ttl=LEASE_TTL):
+        self.folder = folder
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.held = {}
+        self.renewed = time.time()
+        # The pipeline claims on its feeder thread and finishes on the writer.
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, name, suffix):
+        return os.path.join(self.folder, os.path.basename(name) + suffix)
+
+    def is_done(self, name, settings):
+        try:
+            with open(self._path(name, DONE_SUFFIX), 'r', encoding='utf-8') as f:
+                return f.read().strip() == settings_hash(settings)
+        except FileNotFoundError:
+            return False
+
+    def claim(self, name, settings):
+        # True when this process now holds name and nobody finished it yet
+        # with the same settings.
+        lease_path = self._path(name, LEASE_SUFFIX)
+        token = uuid.uuid4().hex
+        while True:
+            try:
+                fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._break_stale(lease_path):
+                    return False
+                continue
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(f"{token} {self.owner} {time.time():.0f}\n")
+            break
+        # Checked while holding the lease, so a run that finished the image
+        # just before we got here is never redone.
+        if self.is_done(name, settings):
+            os.remove(lease_path)
+            return False
+        with self.lock:
+            self.held[name] = token
+        return True
+
+    def _break_stale(self, lease_path):
+        # True when the caller should try to create the lease again.
+        try:
+            age = time.time() - os.stat(lease_path).st_mtime
+            token = read_token(lease_path)
+        except FileNotFoundError:
+            return True
+        if age < self.ttl:
+            return False
+        # Move it aside rather than deleting it: if another run took the lease
+        # over between our check and the rename, we moved a live lease and put
+        # it back (link never replaces an existing file).
+        stale_path = f"{lease_path}.{token}.stale"
+        try:
+            os.rename(lease_path, stale_path)
+        except FileNotFoundError:
+            return True
+        if read_token(stale_path) != token:
+            try:
+                os.link(stale_path, lease_path)
+            except FileExistsError:
+                pass
+        os.remove(stale_path)
+        return True
+
+    def _drop(self, name):
+        # Remove our lease, unless it was taken over while we were slow.
+        with self.lock:
+            token = self.held.pop(name, None)
+        lease_path = self._path(name, LEASE_SUFFIX)
+        try:
+            if token is not None and read_token(lease_path) == token:
+                os.remove(lease_path)
+        except FileNotFoundError:
+            pass
+
+    def finish(self, name, settings):
+        done_path = self._path(name, DONE_SUFFIX)
+        temp_path = f"{done_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(settings_hash(settings) + '\n')
+        os.replace(temp_path, done_path)
+        self._drop(name)
+
+    def release(self, name):
+        # Give the image back without marking it done, e.g. after an error.
+        self._drop(name)
+
+    def release_all(self):
+        with self.lock:
+            names = list(self.held)
+        for name in names:
+            self._drop(name)
+
+    def renew(self):
+        # Touch every held lease, at most a few times per TTL.
+        now = time.time()
+        if now - self.renewed < self.ttl / 4:
+            return
+        self.renewed = now
+        with self.lock:
+            names = list(self.held)
+        for name in names:
+            try:
+                os.utime(self._path(name, LEASE_SUFFIX))
+            except FileNotFoundError:
+                pass
+
+
+_CLAIMS = {}
+
+
+def get_work_claims(folder, ttl=LEASE_TTL):
+    key = (folder, ttl)
+    if key not in _CLAIMS:
+        _CLAIMS[key] = WorkClaims(folder, ttl)
+    return _CLAIMS[key]
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The scripts import each other as top-level modules, from the repo root and
+# from masking/.
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'masking')]
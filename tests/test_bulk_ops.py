@@ -0,0 +1,106 @@
+import os
+
+import pytest
+
+import bulk_ops
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def read(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def listing(folder):
+    return {
+        os.path.relpath(os.path.join(root, name), folder): read(os.path.join(root, name))
+        for root, _, files in os.walk(folder) for name in files
+    }
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    data = tmp_path / 'data'
+    for name in ('a.png', 'b.png', 'c.png', 'd.png'):
+        write(str(data / name), name)
+    write(str(tmp_path / 'out' / 'a.png'), 'old a')
+    ops = [
+        ('move', str(data / 'a.png'), str(tmp_path / 'out' / 'a.png')),
+        ('move', str(data / 'b.png'), str(tmp_path / 'out' / 'b.png')),
+        ('delete', str(data / 'c.png'), None),
+        ('move', str(data / 'd.png'), str(tmp_path / 'out' / 'd.png')),
+    ]
+    return tmp_path, ops
+
+
+def run(tmp_path, ops, trash, workers=2):
+    run_id, planned = bulk_ops.plan_ops(ops)
+    journal = str(tmp_path / 'journal.jsonl')
+    results = bulk_ops.run_plan(planned, run_id, journal, workers=workers, trash=trash)
+    assert all(error is None for _, _, _, error in results)
+    return journal
+
+
+def interrupt(tmp_path, ops, trash):
+    # Runs every operation, then cuts the journal back to the plan plus the
+    # first finished line and half of the next, as a crash mid-run would.
+    # One worker, so the finished lines are in plan order.
+    journal = run(tmp_path, ops, trash, workers=1)
+    with open(journal, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    header = 1 + len(ops)
+    with open(journal, 'w', encoding='utf-8') as f:
+        f.writelines(lines[:header + 1])
+        f.write(lines[header + 1][:5])
+    return journal
+
+
+@pytest.mark.parametrize('trash', [False, True])
+def test_run_and_undo(dataset, trash):
+    tmp_path, ops = dataset
+    journal = run(tmp_path, ops, trash)
+    assert listing(str(tmp_path / 'data')) == {}
+    assert listing(str(tmp_path / 'out')) == {'a.png': 'a.png', 'b.png': 'b.png', 'd.png': 'd.png'}
+    assert os.path.isdir(bulk_ops.trash_folder(journal)) == trash
+
+    results = bulk_ops.undo(journal, workers=2)
+    assert all(error is None for _, _, _, error in results)
+    if trash:
+        assert listing(str(tmp_path / 'data')) == {name: name for name in ('a.png', 'b.png', 'c.png', 'd.png')}
+        assert listing(str(tmp_path / 'out')) == {'a.png': 'old a'}
+    else:
+        # The delete and the overwritten file are gone for good.
+        assert listing(str(tmp_path / 'data')) == {name: name for name in ('a.png', 'b.png', 'd.png')}
+        assert listing(str(tmp_path / 'out')) == {}
+
+    # Undoing again finds nothing left to do.
+    assert bulk_ops.undo(journal) == []
+
+
+def test_resume_after_interruption(dataset):
+    tmp_path, ops = dataset
+    journal = interrupt(tmp_path, ops, trash=True)
+    # b.png was moved but never journaled; put d.png back as if the crash
+    # came before it ran.
+    os.replace(str(tmp_path / 'out' / 'd.png'), str(tmp_path / 'data' / 'd.png'))
+
+    results = bulk_ops.resume(journal, workers=2)
+    assert sorted(os.path.basename(src) for src, _, _, error in results if error is None) == ['b.png', 'c.png', 'd.png']
+    assert listing(str(tmp_path / 'out')) == {'a.png': 'a.png', 'b.png': 'b.png', 'd.png': 'd.png'}
+    _, planned, finished, _ = bulk_ops.load_journal(journal)
+    assert sorted(finished) == [entry['id'] for entry in planned]
+
+    bulk_ops.undo(journal, workers=2)
+    assert listing(str(tmp_path / 'data')) == {name: name for name in ('a.png', 'b.png', 'c.png', 'd.png')}
+    assert listing(str(tmp_path / 'out')) == {'a.png': 'old a'}
+
+
+def test_resume_with_nothing_left(dataset):
+    tmp_path, ops = dataset
+    journal = run(tmp_path, ops, trash=False)
+    assert bulk_ops.resume(journal) == []
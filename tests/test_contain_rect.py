@@ -0,0 +1,52 @@
+import itertools
+import random
+
+import mask_core
+
+
+def union(boxes):
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+def exhaustive_contain_area(boxes, max_area_px):
+    # Largest enclosing rectangle over every group of two or more boxes, or -1.
+    best = -1
+    for size in range(2, len(boxes) + 1):
+        for group in itertools.combinations(boxes, size):
+            area = mask_core.calculate_area(*union(group))
+            if area <= max_area_px:
+                best = max(best, area)
+    return best
+
+
+def test_find_contain_rect_matches_exhaustive_search():
+    rng = random.Random(0)
+    no_solution = 0
+    for _ in range(600):
+        boxes = []
+        for _ in range(rng.randint(0, 7)):
+            x1, y1 = rng.randint(0, 200), rng.randint(0, 150)
+            boxes.append((x1, y1, x1 + rng.randint(1, 60), y1 + rng.randint(1, 30)))
+        max_area_px = rng.choice([500, 2000, 8000, 30000])
+
+        expected = exhaustive_contain_area(boxes, max_area_px)
+        rect = mask_core.find_contain_rect(boxes, max_area_px)
+
+        if expected == -1:
+            no_solution += 1
+            assert rect is None, (boxes, max_area_px)
+            continue
+        assert rect is not None, (boxes, max_area_px)
+        inside = [b for b in boxes if b[0] >= rect[0] and b[1] >= rect[1] and b[2] <= rect[2] and b[3] <= rect[3]]
+        assert len(inside) >= 2 and union(inside) == tuple(rect), (boxes, max_area_px)
+        area = mask_core.calculate_area(*rect)
+        # The search may stop once a group is within CONTAIN_TOLERANCE of the limit.
+        assert area <= expected, (boxes, max_area_px)
+        assert area == expected or area * (1 + mask_core.CONTAIN_TOLERANCE) >= max_area_px, (boxes, max_area_px)
+    assert no_solution > 50
+
+
+def test_find_contain_rect_without_a_group_that_fits():
+    assert mask_core.find_contain_rect([(0, 0, 10, 10)], 1000) is None
+    assert mask_core.find_contain_rect([(0, 0, 10, 10), (90, 90, 100, 100)], 1000) is None
+    assert mask_core.find_contain_rect([(0, 0, 10, 10), (5, 5, 15, 15)], 225) == (0, 0, 15, 15)
@@ -0,0 +1,120 @@
+import os
+import time
+
+import pytest
+from PIL import Image
+
+import dataset_index
+from dataset_index import DatasetIndex
+
+
+def write_image(path, size):
+    Image.new('RGB', size).save(path)
+    return str(path)
+
+
+def set_mtime(path, ns):
+    os.utime(path, ns=(ns, ns))
+
+
+@pytest.fixture
+def folder(tmp_path):
+    folder = tmp_path / 'images'
+    folder.mkdir()
+    write_image(folder / 'a.png', (10, 20))
+    write_image(folder / 'b.png', (30, 40))
+    return folder
+
+
+def old_ns():
+    return time.time_ns() - 10 * dataset_index.MTIME_SLACK_NS
+
+
+def test_unchanged_folder_is_not_listed_again(tmp_path, folder):
+    path = str(tmp_path / 'index.sqlite')
+    mtime = old_ns()
+    set_mtime(folder, mtime)
+    assert DatasetIndex(path).refresh(str(folder))
+
+    # A new file whose folder mtime is put back is not seen: only the
+    # folder's stat was checked.
+    write_image(folder / 'c.png', (5, 5))
+    set_mtime(folder, mtime)
+    index = DatasetIndex(path)
+    assert not index.refresh(str(folder))
+    assert index.names(str(folder)) == ['a.png', 'b.png']
+
+    set_mtime(folder, mtime + 1)
+    index = DatasetIndex(path)
+    assert index.names(str(folder)) == ['a.png', 'b.png', 'c.png']
+    assert not index.refresh(str(folder))
+
+
+def test_folder_changed_within_the_slack_is_listed_again(tmp_path, folder):
+    path = str(tmp_path / 'index.sqlite')
+    set_mtime(folder, time.time_ns())
+    assert DatasetIndex(path).refresh(str(folder))
+    # Same mtime, but a change in the same clock tick would not have moved it.
+    assert DatasetIndex(path).refresh(str(folder))
+
+    set_mtime(folder, old_ns())
+    assert DatasetIndex(path).refresh(str(folder))
+    assert not DatasetIndex(path).refresh(str(folder))
+
+
+def test_relisting_keeps_dimensions_of_unchanged_files(tmp_path, folder, monkeypatch):
+    path = str(tmp_path / 'index.sqlite')
+    probed = []
+    probe_size = dataset_index.probe_size
+
+    def counting_probe(image_path):
+        probed.append(os.path.basename(image_path))
+        return probe_size(image_path)
+    monkeypatch.setattr(dataset_index, 'probe_size', counting_probe)
+
+    index = DatasetIndex(path)
+    assert index.sizes(str(folder), ['a.png', 'b.png']) == {'a.png': (10, 20), 'b.png': (30, 40)}
+    assert sorted(probed) == ['a.png', 'b.png']
+
+    # b is rewritten with another size and c is added; a keeps its dimensions.
+    write_image(folder / 'b.png', (300, 400))
+    write_image(folder / 'c.png', (50, 60))
+    set_mtime(folder, old_ns())
+    probed.clear()
+    index = DatasetIndex(path)
+    assert index.sizes(str(folder), ['a.png', 'b.png', 'c.png']) == {'a.png': (10, 20), 'b.png': (300, 400), 'c.png': (50, 60)}
+    assert sorted(probed) == ['b.png', 'c.png']
+
+    probed.clear()
+    assert DatasetIndex(path).sizes(str(folder), ['a.png', 'b.png', 'c.png']) == {'a.png': (10, 20), 'b.png': (300, 400), 'c.png': (50, 60)}
+    assert probed == []
+
+
+def test_records_pair_captions_and_masks(tmp_path):
+    images = tmp_path / 'images'
+    masks = tmp_path / 'masks'
+    captions = tmp_path / 'captions'
+    for folder in (images, masks, captions):
+        folder.mkdir()
+    a = write_image(images / 'a.png', (8, 8))
+    b = write_image(images / 'b.JPG', (8, 8))
+    write_image(images / 'c.webp', (8, 8))
+    (images / 'a.txt').write_text('caption a')
+    (images / 'orphan.txt').write_text('no image')
+    mask_a = write_image(masks / 'a.png', (8, 8))
+    write_image(masks / 'z.png', (8, 8))
+    (masks / 'b.txt').write_text('not a mask')
+    (captions / 'b.txt').write_text('caption b')
+
+    index = DatasetIndex(':memory:')
+    records = index.records(str(images), ['png', 'jpg'], mask_folder=str(masks))
+    assert sorted(records) == ['a', 'b']
+    assert {stem: (r['image'], r['caption'], r['mask']) for stem, r in records.items()} == {
+        'a': (a, str(images / 'a.txt'), mask_a),
+        'b': (b, None, None),
+    }
+    assert records['a']['size'] == os.path.getsize(a)
+    assert records['a']['mtime_ns'] == os.stat(a).st_mtime_ns
+
+    records = index.records(str(images), ['png', 'jpg'], caption_folder=str(captions))
+    assert (records['a']['caption'], records['b']['caption'], records['a']['mask']) == (None, str(captions / 'b.txt'), None)
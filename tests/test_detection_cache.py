@@ -0,0 +1,56 @@
+import os
+
+import cv2
+import numpy as np
+
+import mask_core
+from ocr_engine import OCREngine, StubBackend
+
+
+def dark_box(image):
+    gray = image if image.ndim == 2 else image.min(axis=2)
+    ys, xs = np.nonzero(gray < 128)
+    x1, y1, x2, y2 = int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1
+    return [([[x1, y1], [x2, y1], [x2, y2], [x1, y2]], 'text', 0.9)]
+
+
+def write_images(folder):
+    os.makedirs(folder)
+    paths = []
+    for index in range(3):
+        image = np.full((100, 150, 3), 255, np.uint8)
+        cv2.rectangle(image, (10 + 20 * index, 10 + 15 * index), (60 + 20 * index, 25 + 15 * index), (0, 0, 0), -1)
+        path = os.path.join(folder, f'img{index}.png')
+        cv2.imwrite(path, image)
+        paths.append(path)
+    return paths
+
+
+def run(paths, out_folder, backend, **kwargs):
+    os.makedirs(out_folder)
+    mask_core.process_batch(paths, out_folder=out_folder, engine=OCREngine(backend), include_textfile=False, min_total_area=0.01, **kwargs)
+    return {name: open(os.path.join(out_folder, name), 'rb').read() for name in sorted(os.listdir(out_folder))}
+
+
+def test_cache_hit_skips_ocr_and_settings_change_misses(tmp_path):
+    paths = write_images(str(tmp_path / 'images'))
+    cache = str(tmp_path / 'detections.sqlite')
+    backend = StubBackend(detect_fn=dark_box)
+
+    first = run(paths, str(tmp_path / 'first'), backend, detection_cache=cache)
+    assert backend.calls == 3
+    assert len(first) == 3
+
+    # Settings applied after OCR reuse the stored detections.
+    retuned = run(paths, str(tmp_path / 'retuned'), backend, detection_cache=cache, xpad_box=5)
+    assert backend.calls == 3
+    assert retuned == run(paths, str(tmp_path / 'fresh'), StubBackend(detect_fn=dark_box), xpad_box=5)
+    assert retuned != first
+
+    # Anything that changes what the engine sees does not.
+    run(paths, str(tmp_path / 'gray'), backend, detection_cache=cache, use_color=False)
+    assert backend.calls == 6
+    run(paths, str(tmp_path / 'other_backend'), backend, detection_cache=cache, ocr_backend='stub')
+    assert backend.calls == 9
+    run(paths, str(tmp_path / 'again'), backend, detection_cache=cache, use_color=False)
+    assert backend.calls == 9
@@ -0,0 +1,112 @@
+import random
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import mask_core
+
+WIDTH, HEIGHT = 160, 120
+
+
+def reference_draw_boxes(result, draw, **kwargs):
+    # The per-detection loop draw_boxes replaced, without --contain. The one
+    # intended change is kept: --only-largest takes the first largest box by
+    # pixel area and adds that box's own area.
+    min_area, max_area = kwargs['min_area'], kwargs['max_area']
+    xpad_box, ypad_box = kwargs['xpad_box'], kwargs['ypad_box']
+    xpad_detect, ypad_detect = kwargs['xpad_detect'], kwargs['ypad_detect']
+    width, height, total_area = kwargs['width'], kwargs['height'], kwargs['total_area']
+    total_masked_area_percent = 0
+    was_mask_created = False
+    largest = None
+
+    for detection in result:
+        x1, y1 = detection[0][0]
+        x2, y2 = detection[0][2]
+        box_width, box_height = x2 - x1, y2 - y1
+        if kwargs['text_direction'] == 'horizontal' and box_width < box_height:
+            continue
+        if kwargs['text_direction'] == 'vertical' and box_width > box_height:
+            continue
+
+        area = box_width * box_height
+        area_percent = area / total_area * 100
+        if area_percent < min_area or area_percent > max_area:
+            continue
+
+        should_draw = False
+        if kwargs['corners']:
+            should_draw = mask_core.is_touching_corners(x1, y1, x2, y2, width, height, xpad_detect, ypad_detect)
+        elif kwargs['edges']:
+            x1_draw = 0 if x1 <= xpad_detect else x1
+            y1_draw = 0 if y1 <= ypad_detect else y1
+            x2_draw = width if x2 >= width - xpad_detect else x2
+            y2_draw = height if y2 >= height - ypad_detect else y2
+            extended_area_percent = mask_core.calculate_area_percentage(mask_core.calculate_area(x1_draw, y1_draw, x2_draw, y2_draw), total_area)
+            if extended_area_percent < min_area or extended_area_percent > max_area:
+                continue
+            draw.rectangle([x1_draw, y1_draw, x2_draw, y2_draw], fill="black")
+            was_mask_created = True
+            total_masked_area_percent += extended_area_percent
+        else:
+            should_draw = True
+
+        if should_draw and not kwargs['edges']:
+            if kwargs['only_largest']:
+                if largest is None or area > largest[0]:
+                    largest = (area, area_percent, x1, y1, x2, y2)
+            else:
+                draw.rectangle([max(x1 - xpad_box, 0), max(y1 - ypad_box, 0), min(x2 + xpad_box, width), min(y2 + ypad_box, height)], fill="black")
+                was_mask_created = True
+                total_masked_area_percent += area_percent
+
+    if largest is not None:
+        _, area_percent, x1, y1, x2, y2 = largest
+        draw.rectangle([max(x1 - xpad_box, 0), max(y1 - ypad_box, 0), min(x2 + xpad_box, width), min(y2 + ypad_box, height)], fill="black")
+        was_mask_created = True
+        total_masked_area_percent += area_percent
+
+    return was_mask_created, total_masked_area_percent
+
+
+def random_result(rng):
+    result = []
+    for _ in range(rng.randint(0, 8)):
+        x1, y1 = rng.randint(0, WIDTH - 1), rng.randint(0, HEIGHT - 1)
+        x2, y2 = x1 + rng.randint(1, 80), y1 + rng.randint(1, 60)
+        if rng.random() < 0.3:
+            x1, y2 = x1 + 0.5, y2 - 0.5
+        result.append(([[x1, y1], [x2, y1], [x2, y2], [x1, y2]], 'text', 0.9))
+    return result
+
+
+def test_draw_boxes_matches_the_per_box_loop():
+    rng = random.Random(0)
+    for _ in range(2000):
+        kwargs = dict(
+            min_area=rng.choice([0, 0.1, 1]), max_area=rng.choice([5, 10, 100]),
+            text_direction=rng.choice(['horizontal', 'vertical', 'any']),
+            xpad_box=rng.choice([0, 3, 20]), ypad_box=rng.choice([0, 3, 20]),
+            edges=rng.random() < 0.4, corners=rng.random() < 0.3, only_largest=rng.random() < 0.3,
+            xpad_detect=rng.choice([0, 10, 30]), ypad_detect=rng.choice([0, 10, 30]),
+            width=WIDTH, height=HEIGHT, total_area=WIDTH * HEIGHT,
+        )
+        result = random_result(rng)
+
+        image = Image.new('L', (WIDTH, HEIGHT), 'white')
+        expected = reference_draw_boxes(result, ImageDraw.Draw(image), **kwargs)
+        mask = np.full((HEIGHT, WIDTH), 255, np.uint8)
+        created, total = mask_core.draw_boxes(result, mask, **kwargs)
+
+        assert (created, total) == expected, (result, kwargs)
+        assert np.array_equal(mask, np.asarray(image)), (result, kwargs)
+
+
+def test_only_largest_keeps_the_first_of_equal_boxes():
+    result = [
+        ([[10, 10], [50, 10], [50, 20], [10, 20]], 'first', 0.9),
+        ([[60, 60], [100, 60], [100, 70], [60, 70]], 'second', 0.9),
+    ]
+    mask = np.full((HEIGHT, WIDTH), 255, np.uint8)
+    mask_core.draw_boxes(result, mask, only_largest=True, width=WIDTH, height=HEIGHT, total_area=WIDTH * HEIGHT)
+    assert mask[15, 30] == 0 and mask[65, 80] == 255
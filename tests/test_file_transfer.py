@@ -0,0 +1,102 @@
+import os
+
+import pytest
+
+import file_transfer
+from file_transfer import plan, transfer_many
+
+
+def write(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return str(path)
+
+
+def read(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+@pytest.fixture
+def pairs(tmp_path):
+    # a and b both go to out/x.txt, which already exists; c goes to a free name.
+    src = tmp_path / 'src'
+    out = tmp_path / 'out'
+    src.mkdir()
+    out.mkdir()
+    write(out / 'x.txt', 'old')
+    return [
+        (write(src / 'a.txt', 'a'), str(out / 'x.txt')),
+        (write(src / 'b.txt', 'b'), str(out / 'x.txt')),
+        (write(src / 'c.txt', 'c'), str(out / 'c.txt')),
+    ]
+
+
+def test_plan_skip(pairs):
+    assert plan(pairs, 'skip') == [(pairs[0][0], None), (pairs[1][0], None), pairs[2]]
+
+
+def test_plan_rename(pairs):
+    out = os.path.dirname(pairs[0][1])
+    assert plan(pairs, 'rename') == [
+        (pairs[0][0], os.path.join(out, 'x_1.txt')),
+        (pairs[1][0], os.path.join(out, 'x_2.txt')),
+        pairs[2],
+    ]
+
+
+def test_plan_error(pairs):
+    with pytest.raises(FileExistsError):
+        plan(pairs, 'error')
+    # Also when the clash is only inside the plan.
+    assert plan(pairs[2:], 'error') == pairs[2:]
+    with pytest.raises(FileExistsError):
+        plan([pairs[2], (pairs[0][0], pairs[2][1])], 'error')
+
+
+def test_plan_overwrite_reports_dropped_operations(pairs, capsys):
+    assert plan(pairs, 'overwrite') == [(pairs[0][0], None), pairs[1], pairs[2]]
+    assert capsys.readouterr().out == f"Skipping {pairs[0][0]}: {pairs[1][0]} also goes to {pairs[1][1]} and replaces it.\n"
+
+
+def test_transfer_many_overwrite_keeps_the_last_source(pairs):
+    results = transfer_many(pairs, on_collision='overwrite', move=True)
+    assert [(src, dest) for src, dest, _, _ in results] == plan(pairs, 'overwrite')
+    assert read(pairs[0][1]) == 'b' and read(pairs[2][1]) == 'c'
+    assert os.path.exists(pairs[0][0])
+    assert not os.path.exists(pairs[1][0]) and not os.path.exists(pairs[2][0])
+
+
+def test_link_modes(tmp_path):
+    src = write(tmp_path / 'src.txt', 'data')
+    existing = write(tmp_path / 'existing.txt', 'old')
+
+    assert file_transfer.transfer_file(src, str(tmp_path / 'copy.txt'), 'copy') == 'copy'
+    assert not os.path.samefile(src, tmp_path / 'copy.txt')
+
+    assert file_transfer.transfer_file(src, str(tmp_path / 'hard.txt'), 'hardlink') == 'hardlink'
+    assert os.path.samefile(src, tmp_path / 'hard.txt')
+
+    assert file_transfer.transfer_file(src, str(tmp_path / 'sym.txt'), 'symlink') == 'symlink'
+    assert os.readlink(tmp_path / 'sym.txt') == os.path.abspath(src)
+
+    # Filesystems without reflinks fall back to a copy.
+    assert file_transfer.transfer_file(src, str(tmp_path / 'clone.txt'), 'reflink') in ('reflink', 'copy')
+
+    # An existing destination is replaced, not appended to or linked through.
+    assert file_transfer.transfer_file(src, existing, 'hardlink') == 'hardlink'
+    for name in ('copy.txt', 'hard.txt', 'sym.txt', 'clone.txt', 'existing.txt'):
+        assert read(tmp_path / name) == 'data'
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith('.tmp')) == []
+
+
+def test_failed_link_falls_back_to_copy(tmp_path, monkeypatch, capsys):
+    def no_links(src, dest):
+        raise OSError(18, 'Invalid cross-device link')
+    monkeypatch.setattr(os, 'link', no_links)
+    src = write(tmp_path / 'src.txt', 'data')
+
+    results = transfer_many([(src, str(tmp_path / 'dest.txt'))], link_mode='hardlink')
+    assert results == [(src, str(tmp_path / 'dest.txt'), 'copy', None)]
+    assert not os.path.samefile(src, tmp_path / 'dest.txt')
+    assert "Could not hardlink 1 files" in capsys.readouterr().out
@@ -0,0 +1,39 @@
+import random
+
+import Levenshtein
+
+from mask_index import BKTree, MaskIndex
+
+
+def brute_force(names, query, count):
+    # min() over the mask list, extended to count: ties go to the earlier mask.
+    ranked = sorted((Levenshtein.distance(query, name), order, name) for order, name in enumerate(names))
+    return [(distance, name) for distance, _, name in ranked[:count]]
+
+
+def random_name(rng):
+    if rng.random() < 0.5:
+        return f"frame_{rng.randint(0, 300):05d}.png"
+    return ''.join(rng.choice('abc_01') for _ in range(rng.randint(0, 8)))
+
+
+def test_nearest_matches_brute_force():
+    rng = random.Random(0)
+    for _ in range(300):
+        names = [random_name(rng) for _ in range(rng.randint(0, 40))]
+        tree = BKTree()
+        for name in names:
+            tree.add(name)
+        for _ in range(5):
+            query = random_name(rng)
+            count = rng.randint(1, 5)
+            assert tree.nearest(query, count) == brute_force(names, query, count), (names, query, count)
+
+
+def test_mask_index_only_searches_the_same_size():
+    index = MaskIndex()
+    index.add((640, 480), 'frame_00010.png')
+    index.add((1920, 1080), 'frame_00011.png')
+    index.add((640, 480), 'frame_00020.png')
+    assert index.nearest((640, 480), 'frame_00011.png', 2) == [(1, 'frame_00010.png'), (2, 'frame_00020.png')]
+    assert index.nearest((800, 600), 'frame_00011.png') == []
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from mask_io import rasterize, rle_decode, rle_encode
+
+
+def masks():
+    rng = np.random.default_rng(0)
+    yield np.zeros((5, 7), np.uint8)
+    yield np.full((5, 7), 255, np.uint8)
+    yield np.where(rng.random((31, 17)) < 0.5, 0, 255).astype(np.uint8)
+    blocky = np.full((40, 60), 255, np.uint8)
+    blocky[5:20, 10:50] = 0
+    blocky[0, 0] = 0
+    blocky[-1, -1] = 0
+    yield blocky
+    yield np.zeros((1, 1), np.uint8)
+    yield np.full((1, 1), 255, np.uint8)
+
+
+@pytest.mark.parametrize('mask', list(masks()))
+def test_rle_round_trip(mask):
+    rle = rle_encode(mask)
+    assert rle['size'] == list(mask.shape)
+    assert sum(rle['counts']) == mask.size
+    np.testing.assert_array_equal(rle_decode(rle), mask == 0)
+    np.testing.assert_array_equal(rasterize(rle), np.where(mask == 0, 0, 255))
+
+
+def test_rle_counts_start_with_unmasked_run():
+    mask = np.array([[0, 255], [0, 255]], np.uint8)
+    # Column-major, starting with an empty unmasked run.
+    assert rle_encode(mask)['counts'] == [0, 2, 2]
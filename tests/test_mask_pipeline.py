@@ -0,0 +1,54 @@
+import os
+
+import cv2
+import numpy as np
+
+import mask_core
+import mask_pipeline
+from ocr_engine import OCRBackend, OCREngine
+
+
+class DarkBoxBackend(OCRBackend):
+    # One detection around the dark pixels, so every image gets its own mask.
+    # Spawned workers import it as test_mask_pipeline:DarkBoxBackend.
+    def readtext(self, image):
+        gray = image if image.ndim == 2 else image.min(axis=2)
+        ys, xs = np.nonzero(gray < 128)
+        if not len(xs):
+            return []
+        x1, y1, x2, y2 = int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1
+        return [([[x1, y1], [x2, y1], [x2, y2], [x1, y2]], 'text', 0.9)]
+
+
+def write_images(folder, count=8):
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for index in range(count):
+        image = np.full((120, 160, 3), 255, np.uint8)
+        if index % 4 != 3:
+            cv2.rectangle(image, (5 + 12 * index, 10 + 8 * index), (40 + 12 * index, 25 + 8 * index), (0, 0, 0), -1)
+        path = os.path.join(folder, f'img{index}.png')
+        cv2.imwrite(path, image)
+        paths.append(path)
+    return paths
+
+
+def read_outputs(folder):
+    return {name: open(os.path.join(folder, name), 'rb').read() for name in sorted(os.listdir(folder))}
+
+
+def test_workers_write_the_same_masks_as_a_serial_run(tmp_path):
+    paths = write_images(str(tmp_path / 'images'))
+    settings = dict(include_textfile=True, include_empty=False, min_total_area=0.01)
+
+    serial = str(tmp_path / 'serial')
+    os.makedirs(serial)
+    mask_core.process_batch(paths, out_folder=serial, engine=OCREngine(DarkBoxBackend()), **settings)
+
+    parallel = str(tmp_path / 'parallel')
+    os.makedirs(parallel)
+    failed = mask_pipeline.run_pipeline(paths, 2, {'backend': 'test_mask_pipeline:DarkBoxBackend'}, out_folder=parallel, **settings)
+
+    assert failed == []
+    assert len(read_outputs(serial)) == 12
+    assert read_outputs(parallel) == read_outputs(serial)
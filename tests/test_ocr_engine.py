@@ -0,0 +1,53 @@
+import numpy as np
+
+import ocr_engine
+from ocr_engine import OCREngine, StubBackend, get_engine
+
+
+class RecordingBackend(StubBackend):
+    # Reads each image's fill value back as its text and box x, and records
+    # how the engine called it.
+    def __init__(self):
+        super().__init__(detect_fn=self.read_fill)
+        self.batches = []
+
+    @staticmethod
+    def read_fill(image):
+        value = int(image.flat[0])
+        return [([[value, 0], [value + 1, 0], [value + 1, 1], [value, 1]], str(value), 1.0)]
+
+    def readtext_batched(self, images):
+        self.batches.append([image.shape for image in images])
+        return [self.readtext(image) for image in images]
+
+
+def test_get_engine_caches_per_options(monkeypatch):
+    monkeypatch.setattr(ocr_engine, '_ENGINES', {})
+    engine = get_engine(backend='stub', batch_size=2)
+    assert get_engine(backend='stub', batch_size=2) is engine
+    assert isinstance(engine.backend, StubBackend)
+    assert get_engine(backend='stub', batch_size=4) is not engine
+    assert get_engine(backend='stub', batch_size=2, results=[]) is not engine
+    assert get_engine(backend='stub', batch_size=2, results=[]) is get_engine(backend='stub', batch_size=2, results=[])
+
+
+def test_run_many_groups_same_shape_and_keeps_order():
+    shapes = [(10, 20), (30, 40), (10, 20), (10, 20), (30, 40), (5, 5), (10, 20)]
+    images = [np.full(shape, index, np.uint8) for index, shape in enumerate(shapes)]
+    backend = RecordingBackend()
+    results = OCREngine(backend, batch_size=3).readtext_many(images)
+
+    assert [result[0][1] for result in results] == [str(index) for index in range(len(images))]
+    # Four 10x20 images go as a batch of 3 and a single; the two 30x40 as a
+    # batch of 2; the lone 5x5 on its own.
+    assert backend.batches == [[(10, 20)] * 3, [(30, 40)] * 2]
+    assert backend.calls == len(images)
+
+
+def test_run_many_batch_size_one_never_batches():
+    images = [np.full((8, 8), index, np.uint8) for index in range(4)]
+    backend = RecordingBackend()
+    results = OCREngine(backend, batch_size=1).detect_many(images)
+    assert [result[0][0][0][0] for result in results] == [0, 1, 2, 3]
+    assert backend.batches == []
+    assert backend.calls == 4
@@ -0,0 +1,44 @@
+import random
+
+import pytest
+
+from perceptual_hash import HASH_BITS, HammingIndex, hamming
+
+
+def brute_force(items, value, max_distance):
+    best = None
+    for entry, (stored, item) in enumerate(items):
+        distance = hamming(value, stored)
+        if distance <= max_distance and (best is None or (distance, entry) < best):
+            best = (distance, entry)
+    return None if best is None else (best[0], items[best[1]][1])
+
+
+def flip(value, bits, rng):
+    for bit in rng.sample(range(HASH_BITS), bits):
+        value ^= 1 << bit
+    return value
+
+
+@pytest.mark.parametrize('max_distance', [0, 1, 4, 10, 63])
+def test_nearest_matches_brute_force(max_distance):
+    rng = random.Random(max_distance)
+    bases = [rng.getrandbits(HASH_BITS) for _ in range(20)]
+    # Near-duplicates of a few bases, so there are hits at every distance.
+    items = [(flip(rng.choice(bases), rng.randint(0, 16), rng), index) for index in range(300)]
+    index = HammingIndex(max_distance)
+    for value, item in items:
+        index.add(value, item)
+
+    queries = [flip(rng.choice(bases), rng.randint(0, 16), rng) for _ in range(200)]
+    queries += [value for value, _ in items[:20]] + [rng.getrandbits(HASH_BITS) for _ in range(20)]
+    for value in queries:
+        assert index.nearest(value) == brute_force(items, value, max_distance)
+
+
+def test_nearest_prefers_first_added_on_ties():
+    index = HammingIndex(2)
+    index.add(0b11, 'first')
+    index.add(0b11, 'second')
+    assert index.nearest(0b01) == (1, 'first')
+    assert HammingIndex(2).nearest(0) is None
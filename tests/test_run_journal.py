@@ -0,0 +1,100 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+import mask_core
+from ocr_engine import OCREngine, StubBackend
+from run_journal import NO_MASK, WRITTEN, get_run_journal
+
+
+def dark_box(image):
+    gray = image if image.ndim == 2 else image.min(axis=2)
+    ys, xs = np.nonzero(gray < 128)
+    if not len(xs):
+        return []
+    x1, y1, x2, y2 = int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1
+    return [([[x1, y1], [x2, y1], [x2, y2], [x1, y2]], 'text', 0.9)]
+
+
+def write_image(path, offset):
+    image = np.full((100, 150, 3), 255, np.uint8)
+    cv2.rectangle(image, (10 + offset, 10), (60 + offset, 25), (0, 0, 0), -1)
+    cv2.imwrite(str(path), image)
+    return str(path)
+
+
+@pytest.fixture
+def setup(tmp_path):
+    folder = tmp_path / 'images'
+    folder.mkdir()
+    out_folder = tmp_path / 'out'
+    out_folder.mkdir()
+    paths = [write_image(folder / f'img{index}.png', 20 * index) for index in range(3)]
+    backend = StubBackend(detect_fn=dark_box)
+    settings = dict(out_folder=str(out_folder), journal=str(tmp_path / 'journal.sqlite'), include_textfile=False, min_total_area=0.01)
+
+    def run(**changes):
+        mask_core.process_batch(paths, engine=OCREngine(backend), **dict(settings, **changes))
+        return backend.calls
+    return paths, str(out_folder), settings, run
+
+
+def test_unchanged_images_are_skipped(setup):
+    paths, out_folder, _, run = setup
+    assert run() == 3
+    assert run() == 3
+
+    # A touched file with the same bytes is still current.
+    os.utime(paths[0], ns=(1, 1))
+    assert run() == 3
+
+    write_image(paths[1], 5)
+    assert run() == 4
+
+    # So is a missing mask the journal says was written.
+    os.remove(os.path.join(out_folder, 'img2.png'))
+    assert run() == 5
+    assert sorted(os.listdir(out_folder)) == ['img0.png', 'img1.png', 'img2.png']
+
+
+def test_settings_change_reruns_and_clears_stale_masks(setup):
+    paths, out_folder, settings, run = setup
+    assert run() == 3
+    assert run(xpad_box=4) == 6
+    assert run(xpad_box=4) == 6
+
+    # Settings that no longer make a mask remove the one made before.
+    assert run(xpad_box=4, min_total_area=50) == 9
+    assert os.listdir(out_folder) == []
+    journal = get_run_journal(settings['journal'])
+    assert [journal.get(path)['status'] for path in paths] == [NO_MASK] * 3
+    assert run(xpad_box=4) == 12
+    assert [journal.get(path)['status'] for path in paths] == [WRITTEN] * 3
+
+
+def test_interrupted_mask_write_keeps_the_old_mask(setup, monkeypatch):
+    paths, out_folder, settings, run = setup
+    assert run() == 3
+    mask_path = os.path.join(out_folder, 'img0.png')
+    before = open(mask_path, 'rb').read()
+    journal = get_run_journal(settings['journal'])
+    entry = journal.get(paths[0])
+
+    def interrupted_save(self, filename, *args, **kwargs):
+        with open(filename, 'wb') as f:
+            f.write(b'\x89PNG partial')
+        raise KeyboardInterrupt
+    monkeypatch.setattr(Image.Image, 'save', interrupted_save)
+
+    with pytest.raises(KeyboardInterrupt):
+        run(xpad_box=4)
+    assert open(mask_path, 'rb').read() == before
+    assert sorted(os.listdir(out_folder)) == ['img0.png', 'img1.png', 'img2.png']
+    # Nothing is recorded for the batch, so the next run redoes all of it.
+    assert journal.get(paths[0]) == entry
+    monkeypatch.undo()
+    assert run(xpad_box=4) == 9
+    assert open(mask_path, 'rb').read() != before
@@ -0,0 +1,88 @@
+import os
+import posixpath
+import tarfile
+
+import cv2
+import numpy as np
+import pytest
+
+import mask_core
+import shards
+from ocr_engine import OCREngine, StubBackend
+
+
+def dark_box(image):
+    gray = image if image.ndim == 2 else image.min(axis=2)
+    ys, xs = np.nonzero(gray < 128)
+    if not len(xs):
+        return []
+    x1, y1, x2, y2 = int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1
+    return [([[x1, y1], [x2, y1], [x2, y2], [x1, y2]], 'text', 0.9)]
+
+
+def encode_image(offset, ext='.png'):
+    image = np.full((80, 120, 3), 255, np.uint8)
+    cv2.rectangle(image, (10 + offset, 10), (50 + offset, 22), (0, 0, 0), -1)
+    return cv2.imencode(ext, image)[1].tobytes()
+
+
+def test_writer_round_trip(tmp_path):
+    path = str(tmp_path / 'shard.tar')
+    members = [('a.png', b'\x89PNG one'), ('a.txt', b'caption'), ('dir/b.JPG', bytes(range(256))), ('c.json', b'{}')]
+    with shards.ShardWriter(path) as writer:
+        for name, data in members:
+            writer.write(name, data)
+
+    assert list(shards.iter_members(path)) == members
+    assert list(shards.iter_images(path)) == [members[0], members[2]]
+    assert os.listdir(tmp_path) == ['shard.tar']
+
+
+def test_interrupted_writer_leaves_nothing(tmp_path):
+    path = str(tmp_path / 'shard.tar')
+    with pytest.raises(RuntimeError):
+        with shards.ShardWriter(path) as writer:
+            writer.write('a.png', b'data')
+            raise RuntimeError
+    assert os.listdir(tmp_path) == []
+
+
+def test_output_shards_mirror_input_shards(tmp_path):
+    inputs = tmp_path / 'shards'
+    inputs.mkdir()
+    images = {
+        'a.tar': [('img0.png', encode_image(0)), ('sub/img1.jpg', encode_image(30, '.jpg'))],
+        'b.tar': [('img2.png', encode_image(60)), ('notes.txt', b'not an image')],
+    }
+    for shard_name, members in images.items():
+        with shards.ShardWriter(str(inputs / shard_name)) as writer:
+            for name, data in members:
+                writer.write(name, data)
+
+    out_folder = tmp_path / 'out'
+    out_folder.mkdir()
+    settings = dict(out_folder=str(out_folder), engine=OCREngine(StubBackend(detect_fn=dark_box)), min_total_area=0.01)
+    for shard_path in shards.list_shards(str(inputs)):
+        mask_core.process_shard(shard_path, **settings)
+    assert sorted(os.listdir(out_folder)) == ['a.tar', 'b.tar']
+
+    # Each member is what the loose layout writes for the same image.
+    for shard_name, members in images.items():
+        expected = []
+        for index, (name, data) in enumerate(members):
+            if not name.endswith(shards.IMAGE_EXTENSIONS):
+                continue
+            folder = tmp_path / 'loose' / shard_name / str(index)
+            (folder / 'masks').mkdir(parents=True)
+            image_path = str(folder / posixpath.basename(name))
+            with open(image_path, 'wb') as f:
+                f.write(data)
+            mask_core.process_batch([image_path], **dict(settings, out_folder=str(folder / 'masks')))
+            # The mask, then its .txt.
+            for filename in sorted(os.listdir(folder / 'masks'), key=lambda f: f.endswith('.txt')):
+                with open(folder / 'masks' / filename, 'rb') as f:
+                    expected.append((posixpath.join(posixpath.dirname(name), filename), f.read()))
+        assert list(shards.iter_members(str(out_folder / shard_name))) == expected
+
+    with tarfile.open(str(out_folder / 'a.tar')) as tar:
+        assert tar.getnames() == ['img0.png', 'img0.txt', 'sub/img1.jpg', 'sub/img1.txt']
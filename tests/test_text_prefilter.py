@@ -0,0 +1,66 @@
+import os
+
+import cv2
+import numpy as np
+
+import mask_core
+import text_prefilter
+from ocr_engine import OCREngine, StubBackend
+
+CAPTION = ([[0, 0], [80, 0], [80, 20], [0, 20]], 'caption', 0.9)
+
+
+def write_images(folder, count=3):
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for index in range(count):
+        path = os.path.join(folder, f'img{index}.png')
+        cv2.imwrite(path, np.full((200, 300, 3), 255, np.uint8))
+        paths.append(path)
+    return paths
+
+
+def run(paths, out_folder, backend, **kwargs):
+    os.makedirs(out_folder, exist_ok=True)
+    kwargs = dict(
+        kwargs, out_folder=out_folder, engine=OCREngine(backend), include_textfile=False,
+        include_empty=False, min_total_area=0.1, prefilter=True,
+    )
+    mask_core.process_batch(paths, **kwargs)
+    return sorted(os.listdir(out_folder))
+
+
+def test_cached_prefilter_skip_is_not_reused_with_other_regions(tmp_path, monkeypatch):
+    # Text only shows up in the border strips, as when the middle of the
+    # image is cluttered enough to hide the caption line.
+    monkeypatch.setattr(text_prefilter, 'text_score', lambda image, regions=None, text_direction='horizontal': 10 if regions else 0)
+    paths = write_images(str(tmp_path / 'images'))
+    cache = str(tmp_path / 'detections.sqlite')
+    backend = StubBackend(results=[CAPTION])
+
+    assert run(paths, str(tmp_path / 'whole'), backend, detection_cache=cache) == []
+    assert backend.calls == 0
+
+    # A fresh run with --edges writes masks; the cached skips must not stop it.
+    assert run(paths, str(tmp_path / 'edges'), backend, detection_cache=cache, edges=True) == ['img0.png', 'img1.png', 'img2.png']
+    assert backend.calls == 3
+
+
+def test_prefilter_key_covers_its_inputs():
+    base = dict(prefilter=True, ocr_backend='stub')
+    keys = [
+        mask_core.detection_settings(**dict(base, **changes))
+        for changes in (
+            {},
+            {'prefilter_threshold': 2},
+            {'text_direction': 'any'},
+            {'edges': True},
+            {'corners': True},
+            {'edges': True, 'xpad_detect': 10},
+            {'edges': True, 'ypad_detect': 10},
+            {'edges': True, 'border_margin': 8},
+        )
+    ]
+    assert len({repr(sorted(key.items())) for key in keys}) == len(keys)
+    # Without --prefilter none of these change what OCR returns.
+    assert mask_core.detection_settings(ocr_backend='stub') == mask_core.detection_settings(ocr_backend='stub', text_direction='any', edges=True)
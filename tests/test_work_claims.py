@@ -0,0 +1,79 @@
+import os
+import time
+
+import cv2
+import numpy as np
+
+import mask_core
+import work_claims
+from ocr_engine import OCREngine, StubBackend
+from work_claims import WorkClaims
+
+SETTINGS = {'min_area': 0.1}
+
+
+def lease_path(folder, name):
+    return os.path.join(folder, name + work_claims.LEASE_SUFFIX)
+
+
+def age(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_claim_expiry_and_reclaim(tmp_path):
+    folder = str(tmp_path / 'claims')
+    first, second = WorkClaims(folder, ttl=60), WorkClaims(folder, ttl=60)
+
+    assert first.claim('a.png', SETTINGS)
+    assert not second.claim('a.png', SETTINGS)
+
+    # A lease left untouched past the TTL belongs to a dead run.
+    age(lease_path(folder, 'a.png'), 61)
+    assert second.claim('a.png', SETTINGS)
+    assert not first.claim('a.png', SETTINGS)
+
+    # The old holder giving it back must not remove the new holder's lease.
+    first.release('a.png')
+    assert os.path.exists(lease_path(folder, 'a.png'))
+
+    second.finish('a.png', SETTINGS)
+    assert not os.path.exists(lease_path(folder, 'a.png'))
+    assert not first.claim('a.png', SETTINGS)
+    assert first.claim('a.png', dict(SETTINGS, min_area=1))
+
+
+def test_renew_keeps_a_lease_from_expiring(tmp_path):
+    folder = str(tmp_path / 'claims')
+    holder, other = WorkClaims(folder, ttl=60), WorkClaims(folder, ttl=60)
+    assert holder.claim('a.png', SETTINGS)
+
+    age(lease_path(folder, 'a.png'), 61)
+    holder.renewed -= 60
+    holder.renew()
+    assert not other.claim('a.png', SETTINGS)
+
+
+def test_process_batch_renews_leases_per_image(tmp_path, monkeypatch):
+    paths = []
+    for index in range(3):
+        path = str(tmp_path / f'img{index}.png')
+        cv2.imwrite(path, np.full((40, 60, 3), 255, np.uint8))
+        paths.append(path)
+    out_folder = str(tmp_path / 'out')
+    os.makedirs(out_folder)
+
+    held = []
+    renew = WorkClaims.renew
+
+    def recording_renew(self):
+        held.append(len(self.held))
+        renew(self)
+    monkeypatch.setattr(WorkClaims, 'renew', recording_renew)
+
+    claims = str(tmp_path / 'claims')
+    mask_core.process_batch(paths, out_folder=out_folder, engine=OCREngine(StubBackend()), claims=claims, claim_ttl=60)
+
+    # Once after each image is decoded and again after each one is written.
+    assert held == [1, 2, 3, 2, 1, 0]
+    assert sorted(os.listdir(claims)) == [f'img{index}.png{work_claims.DONE_SUFFIX}' for index in range(3)]
@@ -1,50 +1,40 @@
 import os
 import argparse
 import re
-import shutil
 
-def main(path, delete_images, delete_text, move_captions_to, move_images_to, dry_run):
+from bulk_ops import add_bulk_args, journal_command, plan_ops, print_plan, report, run_plan
+from dataset_index import DatasetIndex, add_index_args, open_index
+from file_transfer import TRANSFER_WORKERS
+
+def main(path, delete_images, delete_text, move_captions_to, move_images_to, dry_run, index=None, journal=None, workers=TRANSFER_WORKERS, trash=False):
     image_exts = ['png', 'jpg', 'jpeg', 'gif', 'webm']
-    text_files = set()
-    image_files = set()
-    unmatched_images = []
-    unmatched_texts = []
 
-    for filename in os.listdir(path):
-        name, ext = os.path.splitext(filename)
-        ext = ext[1:]
+    # Images paired with their captions by the dataset index, so an unchanged
+    # folder isn't walked again.
+    index = index or DatasetIndex(':memory:')
+    records = index.records(path, image_exts)
+    unmatched_images = sorted(stem for stem, record in records.items() if record['caption'] is None)
+    unmatched_texts = sorted(stem for stem, files in index.stems(path).items() if 'txt' in files and stem not in records)
 
-        if ext in image_exts:
-            image_files.add(name)
-        elif ext == 'txt':
-            text_files.add(name)
+    # Everything is planned first and then run by bulk_ops, journaled so it
+    # can be resumed or undone.
+    ops = []
 
-    def move_file(src, dest, filename):
-        if dry_run:
-            print(f"Would move: {src} to {dest}")
-        else:
-            shutil.move(src, dest)
-            print(f"Moved: {filename}")
+    def handle_files(file_paths, delete, move_to_path):
+        for file_path in file_paths:
+            if delete:
+                ops.append(('delete', file_path, None))
+            elif move_to_path:
+                ops.append(('move', file_path, os.path.join(move_to_path, os.path.basename(file_path))))
 
-    def handle_files(files, extensions, delete, move_to_path, unmatched_list):
-        for file in files:
-            unmatched_list.append(file)
-            for ext in extensions:
-                file_path = os.path.join(path, f"{file}.{ext}")
-                if os.path.exists(file_path):
-                    if delete:
-                        if dry_run:
-                            print(f"Would remove: {file_path}")
-                        else:
-                            os.remove(file_path)
-                            break
-                    elif move_to_path:
-                        dest_path = os.path.join(move_to_path, f"{file}.{ext}")
-                        move_file(file_path, dest_path, file_path)
-                        break
+    handle_files([records[stem]['image'] for stem in unmatched_images], delete_images, move_images_to)
+    handle_files([os.path.join(path, f"{stem}.txt") for stem in unmatched_texts], delete_text, move_captions_to)
 
-    handle_files(image_files - text_files, image_exts, delete_images, move_images_to, unmatched_images)
-    handle_files(text_files - image_files, ['txt'], delete_text, move_captions_to, unmatched_texts)
+    run_id, planned = plan_ops(ops)
+    if dry_run:
+        print_plan(planned)
+    elif planned:
+        report(run_plan(planned, run_id, journal, workers, trash))
 
     print("----- START Images with no matching text files -----")
     print("\n".join(unmatched_images))
@@ -61,8 +51,13 @@ if __name__ == "__main__":
     parser.add_argument('--movecaptionsto', '-mvc', type=str, help='Move unmatched captions to this directory')
     parser.add_argument('--moveimagesto', '-mvi', type=str, help='Move unmatched images to this directory')
     parser.add_argument('--dry-run', '-dr', action='store_true', help='Only print what would be done, without making changes')
+    add_index_args(parser)
+    add_bulk_args(parser)
     args = parser.parse_args()
 
+    if journal_command(args):
+        exit()
+
     if not args.dry_run:
         confirmation_required = args.moveimagesto or args.movecaptionsto
         if confirmation_required:
@@ -71,4 +66,4 @@ if __name__ == "__main__":
                 print("Action cancelled.")
                 exit(1)
 
-    main(args.path, args.delete_images, args.delete_text, args.movecaptionsto, args.moveimagesto, args.dry_run)
+    main(args.path, args.delete_images, args.delete_text, args.movecaptionsto, args.moveimagesto, args.dry_run, open_index(args), args.journal, args.transfer_workers, args.trash)